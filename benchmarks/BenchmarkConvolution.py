@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of Data.doConvolution against the original loop over the target
+grid, on PACS-sized input.
+
+The cc package must be importable, as for ComboCode itself. Run from the 
+ComboCode folder as: 
+
+python benchmarks/BenchmarkConvolution.py [n_lines] [n_out]
+
+The defaults, 300 lines and 2500 output points, give about 168k input points,
+the size of a merged Sphinx spectrum for a full PACS range.
+
+"""
+
+import sys
+import time
+
+from scipy import array, sqrt, log, linspace, exp, concatenate, zeros
+from scipy.integrate import trapz
+import numpy as np
+
+from cc.data import Data
+
+
+
+def doConvolutionLoop(x_in,y_in,x_out,widths,factor=5,oversampling=1):
+
+    '''
+    The original implementation of Data.doConvolution, which convolves the
+    input for one target point at a time with Data.convolveArray.
+
+    The arguments are the same as for Data.doConvolution.
+
+    @return: The resulting y-values
+    @rtype: list
+
+    '''
+
+    x_in,y_in,x_out,widths = array(x_in),array(y_in),array(x_out),array(widths)
+    y_out = []
+    sigma = [fwhm/(2.*sqrt(2.*log(2.))) for fwhm in widths]
+    binsize = [w/oversampling for w in widths]
+    for delta_bin,sigi,xi_out in zip(binsize,sigma,x_out):
+        yi_in = y_in[abs(x_in-xi_out)<=factor*sigi]
+        if list(yi_in) and set(yi_in) != set([0.0]):
+            xi_in = x_in[abs(x_in-xi_out)<=delta_bin]
+            window = x_in[abs(x_in-xi_out)<=factor*sigi]
+            convolution = Data.convolveArray(window,yi_in,sigi)
+            if len(list(convolution[abs(window-xi_out)<=delta_bin])) == 1:
+                y_out.append(convolution[abs(window-xi_out)<=delta_bin][0])
+            elif list(convolution[abs(window-xi_out)<=delta_bin]):
+                y_out.append(trapz(y=convolution[abs(window-xi_out)<=delta_bin],x=xi_in)/(xi_in[-1]-xi_in[0]))
+            else:
+                y_out.append(sum(convolution)/float(len(convolution)))
+        else:
+            y_out.append(0.0)
+    return y_out
+
+
+
+def makePacsInput(n_lines=300,n_out=2500,wmin=55.,wmax=190.,\
+                  n_profile=150,resolution=1500.):
+
+    '''
+    Make a merged Sphinx line spectrum and a PACS wavelength grid.
+
+    Every line is a Gaussian profile of 15 km/s sampled in n_profile points,
+    on a zero-continuum sampled every 0.001 micron in between the lines, as 
+    produced by Instrument.mergeSphinx.
+
+    @keyword n_lines: The number of lines
+
+                      (default: 300)
+    @type n_lines: int
+    @keyword n_out: The number of points in the PACS grid
+
+                    (default: 2500)
+    @type n_out: int
+    @keyword wmin: The minimum wavelength in micron
+
+                   (default: 55.)
+    @type wmin: float
+    @keyword wmax: The maximum wavelength in micron
+
+                   (default: 190.)
+    @type wmax: float
+    @keyword n_profile: The number of points in a line profile
+
+                        (default: 150)
+    @type n_profile: int
+    @keyword resolution: The spectral resolution of the PACS grid
+
+                         (default: 1500.)
+    @type resolution: float
+
+    @return: The Sphinx wavelengths and fluxes, the PACS grid and its fwhm
+    @rtype: (array,array,array,array)
+
+    '''
+
+    np.random.seed(1)
+    centers = np.sort(np.random.uniform(wmin,wmax,n_lines))
+    waves,fluxes = [],[]
+    for center in centers:
+        width = center*15./3e5
+        wave = linspace(center-4*width,center+4*width,n_profile)
+        waves.append(wave)
+        fluxes.append(np.random.uniform(1,10)*exp(-0.5*((wave-center)/width)**2))
+    continuum = np.arange(wmin-1.,wmax+1.,0.001)
+    for wave in waves:
+        continuum = continuum[(continuum < wave[0]) | (continuum > wave[-1])]
+    sphinx_wave = concatenate(waves+[continuum])
+    sphinx_flux = concatenate(fluxes+[zeros(len(continuum))])
+    isort = np.argsort(sphinx_wave)
+    x_out = linspace(wmin,wmax,n_out)
+    return sphinx_wave[isort],sphinx_flux[isort],x_out,x_out/resolution
+
+
+
+def runBenchmark(n_lines=300,n_out=2500):
+
+    '''
+    Time both convolution implementations and compare their results.
+
+    @keyword n_lines: The number of lines
+
+                      (default: 300)
+    @type n_lines: int
+    @keyword n_out: The number of points in the PACS grid
+
+                    (default: 2500)
+    @type n_out: int
+
+    @return: The time of the loop and of Data.doConvolution in seconds
+    @rtype: (float,float)
+
+    '''
+
+    x_in,y_in,x_out,widths = makePacsInput(n_lines=n_lines,n_out=n_out)
+    print 'Convolving %i Sphinx points onto %i PACS points.'\
+          %(len(x_in),len(x_out))
+    t0 = time.time()
+    y_loop = array(doConvolutionLoop(x_in,y_in,x_out,widths))
+    t_loop = time.time() - t0
+    t0 = time.time()
+    y_fast = Data.doConvolution(x_in,y_in,x_out,widths)
+    t_fast = time.time() - t0
+    print 'Loop: %.2f s, doConvolution: %.2f s, speedup: %.1f'\
+          %(t_loop,t_fast,t_loop/t_fast)
+    print 'Maximum relative difference: %.2e'\
+          %(abs(y_loop-y_fast).max()/abs(y_loop).max())
+    return t_loop,t_fast
+
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    runBenchmark(*args)
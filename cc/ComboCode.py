@@ -19,6 +19,7 @@ from cc.tools.numerical import Gridding
 from cc.managers import ModelingManager
 from cc.managers import PlottingManager
 from cc.managers import Vic
+from cc.managers import Executor
 from cc.modeling.objects import Star
 from cc.modeling.objects import Transition
 from cc.statistics import UnresoStats
@@ -137,12 +138,21 @@ class ComboCode(object):
                           ('show_contdiv',0),('skip_cooling',0),\
                           ('recover_sphinxfiles',0),('stat_print',0),\
                           ('stat_lll_p',None),('stat_method','clipping'),\
-                          ('star_name','model')]
+                          ('star_name','model'),('num_workers',1),\
+                          ('num_sphinx_workers',1),('executor',''),\
+                          ('batch_host',''),('batch_path',''),\
+                          ('batch_submit','qsub'),('profile_cache_size',100)]
         global_pars = dict([(k,self.processed_input.pop(k.upper(),v)) 
                             for k,v in default_global])
         self.__dict__.update(global_pars)
         self.vic = 0
         if not self.gastronoom or not self.mcmax: self.iterations = 1 
+        self.num_workers = int(self.num_workers)
+        if self.num_workers > 1 and self.replace_db_entry:
+            print 'WARNING! NUM_WORKERS > 1 is not available with ' + \
+                  'REPLACE_DB_ENTRY. Models are calculated one at a time.'
+            self.num_workers = 1
+        Star.profile_cache.setMaxSize(self.profile_cache_size)
         if (not self.path_mcmax and self.mcmax):
             raise IOError('Please define PATH_MCMAX in your inputfile.')
         if (not self.path_gastronoom and self.gastronoom): 
@@ -187,7 +197,8 @@ class ComboCode(object):
                                   oversampling=oversampling,\
                                   intrinsic=intrinsic,\
                                   path_linefit=linefit,\
-                                  absflux_err=absflux_err)
+                                  absflux_err=absflux_err,\
+                                  num_workers=self.num_workers)
             self.pacs.setData(searchstring=searchstring)
         else:
             self.pacs = None
@@ -215,7 +226,8 @@ class ComboCode(object):
                                      intrinsic=intrinsic,\
                                      oversampling=oversampling,\
                                      path_linefit=linefit,\
-                                     absflux_err=absflux_err)
+                                     absflux_err=absflux_err,\
+                                     num_workers=self.num_workers)
             self.spire.setData(searchstring=searchstring)
         else:
             self.spire = None
@@ -523,11 +535,33 @@ class ComboCode(object):
     def setVicManager(self):
         
         '''
-        Set up the VIC manager.
+        Set up the VIC manager, or the executor that runs sphinx models in the 
+        background.
+        
+        EXECUTOR=local runs them on this machine, NUM_SPHINX_WORKERS at a 
+        time. EXECUTOR=batch submits them to a batch queue system with 
+        BATCH_SUBMIT, on BATCH_HOST through ssh if given, in the working folder 
+        BATCH_PATH.
         
         '''
         
-        if self.vic and self.gastronoom and self.sphinx : 
+        if not (self.gastronoom and self.sphinx):
+            self.vic_manager = None
+        elif self.executor == 'local':
+            self.vic_manager = Executor.LocalExecutor(\
+                                    path=self.path_gastronoom,\
+                                    num_workers=self.num_sphinx_workers,\
+                                    recover_sphinxfiles=self.recover_sphinxfiles)
+        elif self.executor == 'batch':
+            self.vic_manager = Executor.BatchExecutor(\
+                                    path=self.path_gastronoom,\
+                                    host=self.batch_host,\
+                                    remote_path=self.batch_path,\
+                                    submit_command=self.batch_submit,\
+                                    recover_sphinxfiles=self.recover_sphinxfiles)
+        elif self.executor:
+            raise IOError('EXECUTOR can only be local or batch.')
+        elif self.vic: 
             self.vic_manager = Vic.Vic(path=self.path_gastronoom,\
                                        account=self.vic_account,\
                                        time_per_sphinx=self.vic_time_per_sphinx,\
@@ -560,7 +594,9 @@ class ComboCode(object):
                                        replace_db_entry=self.replace_db_entry,\
                                        path_mcmax=self.path_mcmax,\
                                        skip_cooling=self.skip_cooling,\
-                                       recover_sphinxfiles=self.recover_sphinxfiles)
+                                       recover_sphinxfiles=self.recover_sphinxfiles,\
+                                       num_workers=self.num_workers,\
+                                       num_sphinx_workers=self.num_sphinx_workers)
     
     
     def setPlotManager(self):    
@@ -598,6 +634,11 @@ class ComboCode(object):
             print '***********************************'
             print '** Starting grid calculation.'
             print '***********************************'
+            if self.num_workers > 1 and self.vic_manager is None:
+                print '** Calculating %i models at a time.'%self.num_workers
+                print '***********************************'
+                self.model_manager.startGrid(self.star_grid)
+                return
             for star_index, star in enumerate(self.star_grid):
                 print '***********************************'
                 print '** Model #%i out of %i requested models.'\
@@ -632,10 +673,11 @@ class ComboCode(object):
             else:
                 vic_running = False
             while vic_running:
-                print 'VIC is not yet finished. Waiting 5 minutes before checking again.'
+                print 'Sphinx models are not yet finished. Waiting at most ' + \
+                      '5 minutes before checking again.'
                 print self.vic_manager.getQueue()
                 try: 
-                    time.sleep(300)
+                    self.vic_manager.wait(300)
                 except KeyboardInterrupt: 
                     print 'Ending wait time, continuing with progress check immediately.'
                 vic_running = self.vic_manager.checkProgress()
@@ -11,7 +11,6 @@ from scipy import mean, std, sqrt, log, isfinite
 from scipy import array, zeros, arange, argmin
 from scipy.stats import tmean, tstd
 from scipy.optimize import leastsq
-from scipy.integrate import trapz
 from scipy.special import erf
 
 import numpy as np
@@ -105,12 +104,21 @@ def alignY(datalists,xmin,xmax,zeropoint=0,p0=[1,0,1.5,-2.5],func='power'):
 
      
   
-def doConvolution(x_in,y_in,x_out,widths,factor=5,oversampling=1):
+def doConvolution(x_in,y_in,x_out,widths,factor=5,oversampling=1,\
+                  chunksize=2000000):
 
     '''
     Perform convolution on lists with a Gaussian filter.
     
     Reduce the input grid to the target grid by integration.
+    
+    The convolution is done for all target points at once. The window and the
+    integration bin of every target point are found in the sorted input grid
+    with searchsorted. Within a window, the convolution with the Gaussian is 
+    written as a sum of erf kernels centered on the midpoints between input 
+    points where the y-values change, which gives the same result as 
+    convolveArray. The kernels are evaluated in chunks of at most about 
+    chunksize values, to limit the memory use.
    
     @param x_in: The input x-values
     @type x_in: array
@@ -135,52 +143,198 @@ def doConvolution(x_in,y_in,x_out,widths,factor=5,oversampling=1):
                            
                            (default: 1)
     @type oversampling: int
+    @keyword chunksize: The number of erf kernels evaluated at once.
+    
+                        (default: 2000000)
+    @type chunksize: int
    
     @return: The resulting y-values
-    @rtype: list
+    @rtype: array
     
     '''
    
-    x_in,y_in,x_out,widths = array(x_in),array(y_in),array(x_out),array(widths)
-    y_out = []
+    x_in,y_in = array(x_in,dtype=float),array(y_in,dtype=float)
+    x_out,widths = array(x_out,dtype=float),array(widths,dtype=float)
     print 'Convolving for x_out between %.2f micron and %.2f micron with oversampling %i.' \
           %(x_out[0],x_out[-1],int(oversampling))
+    y_out = zeros(len(x_out))
+    if not len(x_in):
+        return y_out
+    #- The windows are searched in the sorted input grid
+    if (np.diff(x_in) < 0).any():
+        isort = np.argsort(x_in,kind='mergesort')
+        x_in,y_in = x_in[isort],y_in[isort]
     #- Convert FWHM's to sigma for the gaussians
-    sigma = [fwhm/(2.*sqrt(2.*log(2.))) for fwhm in widths]
+    sigma = widths/(2.*sqrt(2.*log(2.)))
     #- Define the binsizes of the bins that will be integrated, i.e. the 
-    #- apparent resolution of x_out 
-    binsize = [w/oversampling for w in widths]
-    for delta_bin,sigi,xi_out in zip(binsize,sigma,x_out):
-        yi_in = y_in[abs(x_in-xi_out)<=factor*sigi]   
-        #- if not empty: continue, else add 0
-        if list(yi_in) and set(yi_in) != set([0.0]):
-            #- all relevant xi's for the bin around xi_out, ie in this bin the 
-            #- y-values will be integrated
-            xi_in = x_in[abs(x_in-xi_out)<=delta_bin]   
-            #- The window for the convolution itself, outside this window the 
-            #- data are assumed to be negligible, ie for a gaussian
-            window = x_in[abs(x_in-xi_out)<=factor*sigi]
-            convolution = convolveArray(window,yi_in,sigi)
-            #- if one value in the bin, out of the window selection: add value
-            if len(list(convolution[abs(window-xi_out)<=delta_bin])) == 1:
-                y_out.append(convolution[abs(window-xi_out)<=delta_bin][0])
-                print 'Convolution has a window of only one element at xi_out %f.'%xi_out
-            #- If more than one value: integrate
-            elif list(convolution[abs(window-xi_out)<=delta_bin]):
-                y_out.append(trapz(y=convolution[abs(window-xi_out)<=delta_bin],x=xi_in)/(xi_in[-1]-xi_in[0]))
-            #- If no values in the bin from the window: add average of the window
-            #- This should not occur ideally!
-            else:
-                print 'Convolution has a window of no elements at x_out ' + \
-                      '%f. Careful! Average is taken of '%(xi_out) + \
-                      'sigma*factor window! This should not be happening...'
-                y_out.append(sum(convolution)/float(len(convolution)))
-        else:
-            y_out.append(0.0)
+    #- apparent resolution of x_out. The bins are part of the window.
+    binsize = widths/float(oversampling)
+    w0,w1 = findWindows(x_in,x_out,factor*sigma)
+    b0,b1 = findWindows(x_in,x_out,binsize)
+    b0,b1 = np.maximum(b0,w0),np.minimum(b1,w1)
+    b1 = np.maximum(b0,b1)
+    #- if the window is empty or only contains zeroes, the result is 0
+    nonzero = np.concatenate([[0],np.cumsum(y_in != 0)])
+    todo = np.nonzero(nonzero[w1]-nonzero[w0])[0]
+    nbin = b1[todo]-b0[todo]
+    for i in todo[nbin == 1]:
+        print 'Convolution has a window of only one element at xi_out %f.'\
+              %x_out[i]
+    for i in todo[nbin == 0]:
+        print 'Convolution has a window of no elements at x_out ' + \
+              '%f. Careful! Average is taken of '%(x_out[i]) + \
+              'sigma*factor window! This should not be happening...'
+    #- The points where the convolution is evaluated: the bin, or the whole
+    #- window if the bin is empty
+    p0 = np.where(nbin == 0,w0[todo],b0[todo])
+    p1 = np.where(nbin == 0,w1[todo],b1[todo])
+    #- The erf kernels sit at the midpoints where the y-values change
+    jumps = np.nonzero(np.diff(y_in))[0]
+    dy = y_in[jumps]-y_in[jumps+1]
+    mid = 0.5*(x_in[jumps]+x_in[jumps+1])
+    k0 = np.searchsorted(jumps,w0[todo])
+    k1 = np.maximum(k0,np.searchsorted(jumps,w1[todo]-1))
+    #- The outputs are handled in order of the number of erf terms, so the 
+    #- terms can be padded to the same number within a chunk
+    order = np.argsort(k1-k0,kind='mergesort')[::-1]
+    todo,nbin,p0,p1,k0,k1 = todo[order],nbin[order],p0[order],p1[order],\
+                            k0[order],k1[order]
+    nchunk = 0
+    while nchunk < len(todo):
+        nterm = k1[nchunk]-k0[nchunk]
+        npts = np.cumsum(p1[nchunk:]-p0[nchunk:])
+        end = nchunk + max(1,np.searchsorted(npts,chunksize/max(nterm,1),\
+                                             side='right'))
+        sel = slice(nchunk,end)
+        iout = todo[sel]
+        #- All evaluation points, with the target point they belong to
+        npoints = p1[sel]-p0[sel]
+        owner = np.repeat(np.arange(len(iout)),npoints)
+        points = getRanges(p0[sel],p1[sel])
+        x_points = x_in[points]
+        #- The erf terms of every target point, padded with zero terms
+        kk = k0[sel][:,None] + np.arange(nterm)
+        valid = kk < k1[sel][:,None]
+        kk[~valid] = 0
+        scale = 1./(sqrt(2)*sigma[iout])
+        mid_k = np.where(valid,mid[kk],0.)*scale[:,None]
+        dy_k = np.where(valid,dy[kk],0.)
+        kernels = dy_k[owner]*erf(mid_k[owner]\
+                                  -(x_points*scale[owner])[:,None])
+        conv = 0.5*(y_in[w0[iout]]+y_in[w1[iout]-1])[owner] \
+                + 0.5*kernels.sum(axis=1)
+        #- Integrate over the bin, with the trapezium rule
+        same = owner[1:] == owner[:-1]
+        areas = 0.5*(conv[1:]+conv[:-1])*(x_points[1:]-x_points[:-1])
+        areas = np.bincount(owner[1:][same],weights=areas[same],\
+                            minlength=len(iout))
+        first = np.concatenate([[0],np.cumsum(npoints)[:-1]])
+        last = first + npoints - 1
+        nbin_sel = nbin[sel]
+        #- if one value in the bin: add value
+        #- If more than one value: integrate
+        #- If no values in the bin: add average of the window
+        y_sel = np.bincount(owner,weights=conv,minlength=len(iout))/npoints
+        multi = nbin_sel > 1
+        y_sel[multi] = areas[multi]/(x_points[last]-x_points[first])[multi]
+        y_out[iout] = y_sel
+        nchunk = end
     return y_out
 
 
 
+def findWindows(x_in,x_out,half_widths):
+
+    '''
+    Find the points of a sorted grid within a distance of every target point.
+    
+    The points of x_in for which abs(x_in-x_out[i]) <= half_widths[i] are 
+    x_in[start[i]:stop[i]].
+    
+    @param x_in: The sorted input x-values
+    @type x_in: array
+    @param x_out: The target x-values
+    @type x_out: array
+    @param half_widths: The maximum distance to the target x-values
+    @type half_widths: array
+    
+    @return: The start and stop indices of the windows in x_in
+    @rtype: (array,array)
+    
+    '''
+    
+    start = np.searchsorted(x_in,x_out-half_widths,side='left')
+    stop = np.searchsorted(x_in,x_out+half_widths,side='right')
+    #- Round-off in x_out-half_widths can shift a boundary by one point with 
+    #- respect to the distance criterion.
+    n = len(x_in)
+    prev = np.maximum(start-1,0)
+    start[(start > 0) & (abs(x_in[prev]-x_out) <= half_widths)] -= 1
+    cur = np.minimum(start,n-1)
+    start[(start < n) & (abs(x_in[cur]-x_out) > half_widths)] += 1
+    nxt = np.minimum(stop,n-1)
+    stop[(stop < n) & (abs(x_in[nxt]-x_out) <= half_widths)] += 1
+    last = np.maximum(stop-1,0)
+    stop[(stop > 0) & (abs(x_in[last]-x_out) > half_widths)] -= 1
+    return start,np.maximum(start,stop)
+
+
+
+def findClosest(x,values):
+
+    '''
+    Find the point of a grid closest to every value.
+    
+    The result is the same as argmin(abs(x-value)) for every value, i.e. the 
+    first point is taken if multiple points are equally close, but the grid is
+    searched with searchsorted. 
+    
+    @param x: The grid, which does not have to be sorted
+    @type x: array
+    @param values: The values
+    @type values: array
+    
+    @return: The indices of the closest points in x
+    @rtype: array
+    
+    '''
+    
+    x,values = array(x,dtype=float),array(values,dtype=float)
+    isort = np.argsort(x,kind='mergesort')
+    xs = x[isort]
+    #- The closest point is either side of the value. Equal grid points are 
+    #- sorted by index, so the first of them is taken on both sides.
+    right = np.searchsorted(xs,values,side='left')
+    left = np.searchsorted(xs,xs[np.maximum(right-1,0)],side='left')
+    right = np.minimum(right,len(xs)-1)
+    d_left,d_right = abs(xs[left]-values),abs(xs[right]-values)
+    i_left,i_right = isort[left],isort[right]
+    take_right = (d_right < d_left) | ((d_right == d_left) & (i_right < i_left))
+    return np.where(take_right,i_right,i_left)
+
+
+
+def getRanges(starts,stops):
+
+    '''
+    Concatenate the integer ranges between pairs of start and stop indices.
+    
+    @param starts: The start indices
+    @type starts: array
+    @param stops: The stop indices, not included in the ranges
+    @type stops: array
+    
+    @return: The concatenated ranges
+    @rtype: array
+    
+    '''
+    
+    lengths = stops-starts
+    offsets = starts - np.concatenate([[0],np.cumsum(lengths)[:-1]])
+    return np.repeat(offsets,lengths) + np.arange(lengths.sum())
+
+
+
 def convolveArray(xx, yy=None, sigma=3):
  
     """
@@ -241,7 +395,74 @@ def convolveArray(xx, yy=None, sigma=3):
     return out
 
 
-      
+
+def convolveBanded(xx,yy,sigma,points=None,chunksize=2000000):
+
+    '''
+    Convolve a profile with a Gaussian of constant width, as convolveArray,
+    for a selection of points only.
+
+    The convolution is written as a sum of erf kernels centered on the
+    midpoints between input points where the y-values change. Only the kernels
+    within 6*sqrt(2)*sigma of a point are evaluated: beyond that the erf is
+    exactly +/-1 in double precision, and the sum of those kernels reduces to
+    a constant. The kernels are evaluated in chunks of at most about chunksize
+    values, to limit the memory use.
+
+    @param xx: The sorted x values
+    @type xx: array
+    @param yy: The y values
+    @type yy: array
+    @param sigma: The width of the gaussian profile
+    @type sigma: float
+
+    @keyword points: The indices of the x values for which the convolution is
+                     returned. If None, it is returned for all x values.
+
+                     (default: None)
+    @type points: array
+    @keyword chunksize: The number of erf kernels evaluated at once.
+
+                        (default: 2000000)
+    @type chunksize: int
+
+    @return: The new y values after convolution
+    @rtype: array
+
+    '''
+
+    xx,yy = array(xx,dtype=float),array(yy,dtype=float)
+    if points is None:
+        points = np.arange(len(xx))
+    x_points = xx[points]
+    #- The erf kernels sit at the midpoints where the y-values change. ystep
+    #- gives the y-value after every kernel.
+    jumps = np.nonzero(np.diff(yy))[0]
+    dy = yy[jumps]-yy[jumps+1]
+    mid = 0.5*(xx[jumps]+xx[jumps+1])
+    ystep = np.concatenate([yy[:1],yy[jumps+1]])
+    band = 6.*sqrt(2.)*sigma
+    k0 = np.searchsorted(mid,x_points-band,side='left')
+    k1 = np.maximum(k0,np.searchsorted(mid,x_points+band,side='right'))
+    #- The kernels left of the band give -1, those right of it +1.
+    out = 0.5*(ystep[k0]+ystep[k1])
+    nterms = k1-k0
+    done = np.concatenate([[0],np.cumsum(nterms)])
+    start = 0
+    while start < len(points):
+        end = max(start+1,np.searchsorted(done,done[start]+chunksize,\
+                                          side='right')-1)
+        kk = getRanges(k0[start:end],k1[start:end])
+        owner = np.repeat(np.arange(end-start),nterms[start:end])
+        kernels = dy[kk]*erf((mid[kk]-x_points[start:end][owner])\
+                             /(sqrt(2)*sigma))
+        out[start:end] += 0.5*np.bincount(owner,weights=kernels,\
+                                          minlength=end-start)
+        start = end
+    return out
+
+
+
 def convertAngular(angrad,distance):
 
     '''
@@ -275,6 +275,64 @@ def fitFunction(x,y,initial,function,vary):
     
     
     
+def shiftLP(flux,shifts,vel=None):
+    
+    """
+    Shift a line profile over a number of bins on its own grid, for a set of 
+    shifts at once.
+    
+    A positive shift moves the profile to lower velocity, i.e. shifted flux i
+    is the original flux at i+shift. The flux shifted beyond the grid is lost,
+    and is replaced by zeroes on the other side.
+    
+    Integer shifts are done by indexing. Sub-bin shifts require the velocity
+    grid, which must be equidistant, and are done by linear interpolation.
+    
+    Multiple profiles on the same grid can be given at once as a 2D array, 
+    with one profile per row.
+    
+    @param flux: The flux grid, or a 2D array of flux grids
+    @type flux: array
+    @param shifts: The shifts in number of bins
+    @type shifts: array
+    
+    @keyword vel: The velocity grid, only required for sub-bin shifts
+    
+                  (default: None)
+    @type vel: array
+    
+    @return: The shifted profiles, in the order of shifts along the first 
+             axis, and the profiles along the other axes
+    @rtype: array
+    
+    """
+    
+    flux, shifts = array(flux,dtype=float), array(shifts)
+    n = flux.shape[-1]
+    if (shifts == np.round(shifts)).all():
+        shifts = shifts.astype(int)
+        nmax = max(abs(shifts).max(),1)
+        pad = np.zeros(flux.shape[:-1]+(nmax,))
+        padded = np.concatenate([pad,flux,pad],axis=-1)
+        shifted = padded[...,np.arange(n)[None,:] + shifts[:,None] + nmax]
+        return np.rollaxis(shifted,-2)
+    vel = array(vel,dtype=float)
+    res = vel[1]-vel[0]
+    if res < 0: 
+        vel, flux = vel[::-1], flux[...,::-1]
+    xnew = vel[None,:]+shifts[:,None]*res
+    if flux.ndim == 1:
+        shifted = np.interp(xnew,vel,flux,left=0.,right=0.)
+    else:
+        shifted = array([np.interp(xnew,vel,fi,left=0.,right=0.) 
+                         for fi in flux])
+        shifted = np.rollaxis(shifted,-2)
+    if res < 0:
+        shifted = shifted[...,::-1]
+    return shifted
+    
+    
+    
 def checkLPShape(vel,flux,vlsr,vexp,window=2.,show=0):
     
     """
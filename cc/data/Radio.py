@@ -8,6 +8,8 @@ Author: R. Lombaert
 """
 
 import os, pyfits, re
+import hashlib
+import multiprocessing
 from glob import glob
 
 import cc.path
@@ -16,6 +18,78 @@ from cc.tools.io.Database import Database
 from cc.data import LPTools
 
 
+
+#-- Keywords of LPTools.fitLP() that only change how the fit is shown
+DISPLAY_KEYS = ['show','cfg']
+
+
+
+def getFitKey(filename,kwargs):
+
+    '''
+    Return the key of a line profile fit, which changes when the data file or 
+    the fit settings change.
+    
+    @param filename: The full filename of the data file
+    @type filename: string
+    @param kwargs: The keywords passed on to LPTools.fitLP(). The keywords in
+                   DISPLAY_KEYS are left out.
+    @type kwargs: dict
+    
+    @return: The md5 hash of the contents of the data file and the keywords
+    @rtype: string
+    
+    '''
+    
+    md5 = hashlib.md5()
+    dfile = open(filename,'rb')
+    try:
+        for chunk in iter(lambda: dfile.read(2**20),''):
+            md5.update(chunk)
+    finally:
+        dfile.close()
+    md5.update(repr(sorted([(k,v) 
+                            for k,v in kwargs.items() 
+                            if k not in DISPLAY_KEYS])))
+    return md5.hexdigest()
+    
+    
+
+def initFitWorker(kwargs):
+
+    '''
+    Initialize a worker process for fitting line profiles.
+    
+    @param kwargs: The keywords passed on to LPTools.fitLP()
+    @type kwargs: dict
+    
+    '''
+    
+    global fit_worker
+    fit_worker = kwargs
+    
+    
+
+def runFitWorker(filename):
+
+    '''
+    Fit a line profile in a worker process.
+    
+    @param filename: The full filename of the data file
+    @type filename: string
+    
+    @return: The results of LPTools.fitLP(), None if the fit failed
+    @rtype: dict
+    
+    '''
+    
+    try:
+        return LPTools.fitLP(filename=filename,**fit_worker)
+    except ValueError:
+        return None
+    
+    
+
 class Radio(Database):
     
     """
@@ -71,10 +145,11 @@ class Radio(Database):
         The None refers to the value of the dictionary entry for that file. 
         This is replaced by the fit results of the line when 
         >>> db.fitLP(filename='whya_co32_Maercker_new_JCMT.fits')
-        is ran. The method redoes the fit by default, regardless of there being
-        an entry for it already. Any required fitting parameters can be passed
-        along to the function (see LPTools.fitLP()). CC loads fit results from
-        the database.
+        is ran. The method only redoes the fit if the data file or the fitting 
+        parameters changed since, unless refit=1 is passed. Any required 
+        fitting parameters can be passed along to the function (see 
+        LPTools.fitLP()). With num_fit_workers > 1, several files are fitted 
+        at the same time. CC loads fit results from the database.
 
         If multiple data files are available for the same star, the same 
         transition and the same telescope, the multiple data files will also be
@@ -510,7 +585,8 @@ class Radio(Database):
         
     
     
-    def fitLP(self,star_name='',filename='',trans='',**kwargs):
+    def fitLP(self,star_name='',filename='',trans='',num_fit_workers=1,\
+              refit=0,**kwargs):
         
         '''
         Fit the data line profiles with a soft parabola or a Gaussian according
@@ -522,8 +598,11 @@ class Radio(Database):
             - star_name, trans: all lines for transition of star are fitted
             - star_name, filename: only this filename is fitted
         
-        The fit is redone by default, regardless of there being an entry in the
-        db already. 
+        A fit is only redone if the data file or the keywords passed on to 
+        LPTools.fitLP() changed since the fit in the db, unless refit is 
+        requested. The fits are compared by the key from getFitKey(), which is 
+        saved in the fit results as 'fit_key'. A failed fit is saved as a dict
+        with only 'fit_key' and 'fit_failed', so it is not retried either. 
         
         Note that this method does NOT automatically sync (ie save changes to 
         the hard disk) the database. That must be done through an additional 
@@ -545,31 +624,24 @@ class Radio(Database):
         
                         (default: '')
         @type trans: str
+        @keyword num_fit_workers: The number of files fitted at the same time,
+                                  each in a separate worker process. With one 
+                                  worker, the files are fitted in this 
+                                  process.
+                                  
+                                  (default: 1)
+        @type num_fit_workers: int
+        @keyword refit: Redo the fits regardless of there being an up to date
+                        fit in the db already.
+                        
+                        (default: 0)
+        @type refit: bool
         @keyword kwargs: Any additional keywords that are passed on to 
                          LPTools.fitLP()
         @type kwargs: dict
                          
         '''
         
-        def __fitLP(self,ss,tt,ff):
-            
-            '''
-            Helper method giving star_name, transition, and filename for the 
-            fitter to do and then remember to save when sync() is ran.
-            
-            Accessed only by Radio().fitLP().
-            
-            '''
-            
-            fn = os.path.join(self.folder,ff)
-            try:
-                fitr = LPTools.fitLP(filename=fn,**kwargs)
-            except ValueError:
-                fitr = None
-            self[ss][tt][ff] = fitr
-            self.addChangedKey(ss)
-            
-        
         if filename and not star_name:
             star_name = os.path.split(filename)[1].split('_')[0]
         
@@ -583,18 +655,18 @@ class Radio(Database):
         
         #-- No star_name given, so run through all stars, transitions and files
         if not star_name:
-            for ss in self.keys():
-                for tt in self[ss].keys():
-                    for ff in self[ss][tt].keys():
-                        __fitLP(self,ss,tt,ff)
+            todo = [(ss,tt,ff) 
+                    for ss in self.keys()
+                    for tt in self[ss].keys()
+                    for ff in self[ss][tt].keys()]
         
         #-- star_name given. If trans is given, run through all its filenames 
         elif trans:
             if trans not in self[star_name].keys():
                 print 'Transition not found.'
                 return
-            for ff in self[star_name][trans].keys():
-                __fitLP(self,star_name,trans,ff)
+            todo = [(star_name,trans,ff) 
+                    for ff in self[star_name][trans].keys()]
             
         #-- star_name given. If trans is not given, but filename is, fit it. 
         elif filename: 
@@ -606,11 +678,48 @@ class Radio(Database):
             if not trans: 
                 print 'Filename not found.'
                 return
-            __fitLP(self,star_name,trans,filename)
+            todo = [(star_name,trans,filename)]
         
         #-- star_name given. No trans/filename given. Fit everything for star
         else:
-            for tt in self[star_name].keys():
-                for ff in self[star_name][tt].keys():
-                    __fitLP(self,star_name,tt,ff)
+            todo = [(star_name,tt,ff) 
+                    for tt in self[star_name].keys()
+                    for ff in self[star_name][tt].keys()]
+        
+        #-- Skip the files of which the fit is up to date
+        tasks = []
+        for ss,tt,ff in todo:
+            fn = os.path.join(self.folder,ff)
+            fit_key = getFitKey(fn,kwargs)
+            fitr = self[ss][tt][ff]
+            if not refit and type(fitr) is dict \
+                    and fitr.get('fit_key') == fit_key:
+                continue
+            tasks.append((ss,tt,ff,fn,fit_key))
+        if not tasks:
+            return
+        
+        #-- Fit the line profiles, num_fit_workers files at the same time
+        fns = [fn for ss,tt,ff,fn,fit_key in tasks]
+        if num_fit_workers < 2 or len(tasks) < 2:
+            initFitWorker(kwargs)
+            results = [runFitWorker(fn) for fn in fns]
+        else:
+            processes = min(num_fit_workers,len(tasks))
+            pool = multiprocessing.Pool(processes=processes,\
+                                        initializer=initFitWorker,\
+                                        initargs=(kwargs,))
+            try:
+                results = pool.map(runFitWorker,fns,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        
+        #-- Remember to save the fit results when sync() is ran.
+        for (ss,tt,ff,fn,fit_key),fitr in zip(tasks,results):
+            if fitr is None:
+                fitr = {'fit_failed':1}
+            fitr['fit_key'] = fit_key
+            self[ss][tt][ff] = fitr
+            self.addChangedKey(ss)
         
\ No newline at end of file
@@ -8,13 +8,56 @@ Author: R. Lombaert
 """
 
 import os
+import multiprocessing
 from glob import glob
-from scipy import argmin,argmax,array,sqrt
+from scipy import array,sqrt
 import scipy
+import numpy as np
 
 import cc.path
 from cc.tools.io import DataIO
 from cc.modeling.objects import Star
+from cc.data import Data
+
+
+
+def initSphinxWorker(instrument,star_grid):
+
+    '''
+    Initialize a worker process for convolving the Sphinx output of a grid.
+    
+    The worker processes are forked, so the instrument and the grid are 
+    inherited rather than pickled.
+    
+    @param instrument: The instrument that started the convolutions
+    @type instrument: Instrument()
+    @param star_grid: The parameter sets of the grid
+    @type star_grid: list[Star()]
+    
+    '''
+    
+    global sphinx_worker
+    sphinx_worker = (instrument,star_grid)
+    
+    
+    
+def runSphinxWorker(task):
+
+    '''
+    Convolve the Sphinx output of one parameter set in a worker process.
+    
+    @param task: The index of the Star() object in the grid, and the extra 
+                 arguments of convolveSphinxModel
+    @type task: (int,tuple)
+    
+    @return: The result of convolveSphinxModel
+    @rtype: any
+    
+    '''
+    
+    instrument,star_grid = sphinx_worker
+    star_index,args = task
+    return instrument.convolveSphinxModel(star_grid[star_index],*args)
 
 
 
@@ -26,7 +69,8 @@ class Instrument(object):
     """
         
     def __init__(self,star_name,instrument_name,oversampling,absflux_err,\
-                 code='GASTRoNOoM',path=None,intrinsic=1,path_linefit=''):        
+                 code='GASTRoNOoM',path=None,intrinsic=1,path_linefit='',\
+                 num_workers=1):        
         
         """ 
         Initializing an instance of Instrument.
@@ -67,6 +111,12 @@ class Instrument(object):
                                
                                (default: '')
         @type path_linefit: string
+        @keyword num_workers: The number of parameter sets of which the Sphinx
+                              output is convolved at the same time, each in a
+                              separate process.
+                              
+                              (default: 1)
+        @type num_workers: int
 
         """
         
@@ -79,6 +129,7 @@ class Instrument(object):
         self.intrinsic = intrinsic
         self.absflux_err = absflux_err
         self.oversampling = int(oversampling)
+        self.num_workers = int(num_workers)
         self.data_filenames = []
         istar = DataIO.getInputData(keyword='STAR_NAME').index(star_name)
         #-- Set relevant velocities in cm/s
@@ -282,8 +333,8 @@ class Instrument(object):
         #      With the exception of lines superimposed, which should typically
         #      be avoided. Line matching will not be very accurate in this 
         #      case.
-        imatches = [argmin(abs(lf.wave_fit-mwav))
-                    for (st,mwav) in strans]
+        #      The closest fitted line is found with searchsorted.
+        imatches = Data.findClosest(lf.wave_fit,[mwav for st,mwav in strans])
         matches = [(mwav <= lf.wave_fit[ii] + lf.fwhm_fit[ii] \
                         and mwav >= lf.wave_fit[ii] - lf.fwhm_fit[ii]) \
                     and (lf.wave_fit[ii],ii) or (None,None)
@@ -293,9 +344,11 @@ class Instrument(object):
         #      line. These are blended IN MODEL and/or IN DATA.
         #      Check for model blend is done by looking for ALL transitions 
         #      that have been matched with a single fitted wavelength.
-        matches_wv = array([mm[0] for mm in matches])
-        wf_blends = [list(array([st for st,mwav in strans])[matches_wv==wv]) 
-                     for wv in lf.wave_fit]
+        matched_trans = dict()
+        for (st,mwav),(match,ii) in zip(strans,matches):
+            if match is not None:
+                matched_trans.setdefault(match,[]).append(st)
+        wf_blends = [list(matched_trans.get(wv,[])) for wv in lf.wave_fit]
         #      Use the wave_fit array indices from matches[:][1] to check  
         #      if indeed multiple transitions were found for the same wav.
         #      If positive, include True if the particular transition is  
@@ -342,6 +395,43 @@ class Instrument(object):
                 
                 
                 
+    def runSphinxConvolutions(self,star_grid,tasks):
+        
+        '''
+        Convolve the Sphinx output of parameter sets of a grid with 
+        convolveSphinxModel, num_workers parameter sets at the same time.
+        
+        Every convolution is done in a separate worker process, which does not
+        change this instrument or the grid: convolveSphinxModel returns what
+        is to be kept. With one worker, the convolutions are done in this 
+        process.
+        
+        @param star_grid: The parameter sets
+        @type star_grid: list[Star()]
+        @param tasks: The index of the Star() object in the grid, and the extra
+                      arguments of convolveSphinxModel for every convolution
+        @type tasks: list[(int,tuple)]
+        
+        @return: The results of convolveSphinxModel, in the order of tasks
+        @rtype: list
+        
+        '''
+        
+        if self.num_workers < 2 or len(tasks) < 2:
+            return [self.convolveSphinxModel(star_grid[i],*args) 
+                    for i,args in tasks]
+        pool = multiprocessing.Pool(processes=min(self.num_workers,len(tasks)),\
+                                    initializer=initSphinxWorker,\
+                                    initargs=(self,star_grid))
+        try:
+            results = pool.map(runSphinxWorker,tasks,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+        
+        
+        
     def mergeSphinx(self,star):
         
         '''
@@ -351,8 +441,8 @@ class Instrument(object):
         
         @param star: The Star object for which all lines are collected + merged
         @type star: Star()
-        @return: wave list in micron and flux list in Jy
-        @rtype: (list,list)
+        @return: wavelength in micron and flux in Jy
+        @rtype: (array,array)
         
         '''
                 
@@ -364,21 +454,22 @@ class Instrument(object):
         #- If no sphinx output found, this list will be empty and no convolution
         #- should be done. 
         if not sphinx_transitions: 
-            return [[],[]]
+            return array([]),array([])
         
         [trans.readSphinx() for trans in sphinx_transitions]
         sphinx_input = [self.intrinsic \
                             and (trans.sphinx.getVelocityIntrinsic(),\
                                  trans.sphinx.getLPIntrinsic())
-                            or (trans.sphinx.getVelocity,\
+                            or (trans.sphinx.getVelocity(),\
                                 trans.sphinx.getLPConvolved())
                         for trans in sphinx_transitions]
         
         #- convert km/s to cm/s to micron and flux to Jy 
         #- doppler shift (1-(v_source - v_observer=delta_v)/c)*f_zero converted 
         #- to wavelength in micron
-        sphinx_input = [(1/(1.-(vel*10**5/star.c))*trans.wavelength*10**(4),\
-                         flux*10**(23)) 
+        sphinx_input = [(1/(1.-(array(vel)*10**5/star.c))\
+                            *trans.wavelength*10**(4),\
+                         array(flux)*10**(23)) 
                         for (vel,flux),trans in zip(sphinx_input,\
                                                     sphinx_transitions)]
         
@@ -386,114 +477,97 @@ class Instrument(object):
         sphinx_input = [wav[0] > wav[-1] \
                             and (wav[::-1],flux[::-1]) or (wav,flux) 
                         for wav,flux in sphinx_input]
-        sphinx_input = [(list(wav),list(flux)) for wav,flux in sphinx_input]    
 
         #- Make sure all sphinx segments are increasing in wavelength/frequency
-        sphinx_input.sort()
+        order = np.argsort([wav[0] for wav,flux in sphinx_input],\
+                           kind='mergesort')
+        waves = [sphinx_input[i][0] for i in order]
+        fluxes = [sphinx_input[i][1] for i in order]
+        nseg = len(waves)
         
         #- Check if overlap between lines is present: 
         #- False if THIS line is overlapping with the one before it. 
         #- Hence the first line will always be true.
-        overlap_bools = [1] + \
-                        [sphinx_input[i-1][0][-1] <= sphinx_input[i][0][0] 
-                         for i in xrange(1,len(sphinx_input))]
+        overlap_bools = np.concatenate([[True],\
+                                        array([wav[-1] for wav in waves[:-1]])\
+                                         <= array([wav[0] for wav in waves[1:]])])
         
-        if False in overlap_bools:
+        if not overlap_bools.all():
             print 'WARNING! There is overlap between emission lines in ' + \
                   'Sphinx output. Overlap is included by simple addition only!'
         
         #- Add zeroes on a grid before the first line to make sure the 
-        #- convolution goes right
-        sphinx_final = [(sphinx_input[0][0][0] - 1 + d/1000.,0.0) 
-                        for d in xrange(1,1000)]  
-
-        #- For now stitch up the segments with zeroes. Later on: 
-        #- Make grid with zeroes, then add segments if no overlap, 
-        #- if overlap, make sure the addition works well
-        for i in xrange(len(sphinx_input)-1):
-            #- if True, no overlap with the sphinx file before i and it has to 
-            #- be added
-            #- if False, overlap with the sphinx file before i and it has been 
-            #- added already
-            if overlap_bools[i]:  
-                j = 1
-                this_wave = sphinx_input[i][0]
-                this_flux = sphinx_input[i][1]
-                blend_wave = []
-                blend_flux = []
-                #- If False, overlap: interpolation is needed, select all the 
-                #- sphinx results for which there is a subsequent blend
-                while not i+j == len(sphinx_input)-1 \
-                        and not overlap_bools[i+j]:
-                    blend_wave.append(sphinx_input[i+j][0])
-                    blend_flux.append(sphinx_input[i+j][1])
-                    j += 1
-                
-                #- note that at i+j there is no more blend, and it is a 
-                #- discrete sphinx result: This should not be added yet
-                #- if there are blends here, blend_wave is not []
-                if blend_wave:
-                    #- remember where the largest wavelength is to be found
-                    max_index = argmax(array([wav[-1] 
-                                              for wav in blend_wave]))+i+1
-                    if sphinx_input[max_index][0][-1] < sphinx_input[i][0][-1]: 
-                        max_index = i
-                    #- Making a new wavelength grid beyond the current line at 
-                    #- i; there should be no need to expand the grid
-                    #- to lower wavelengths, since sphinx_final was sorted. 
+        #- convolution goes right. The merged spectrum is collected in pieces
+        #- that are concatenated at the end.
+        final_wave = [waves[0][0] - 1 + np.arange(1,1000)/1000.]
+        final_flux = [np.zeros(999)]
+        
+        #- Stitch up the segments with zeroes. Lines that overlap with the line
+        #- before them are blends, which are added to the first line of their
+        #- blend. The last line is never a blend.
+        for i in np.nonzero(overlap_bools[:-1])[0]:
+            j = 1
+            while not i+j == nseg-1 and not overlap_bools[i+j]:
+                j += 1
+            this_wave = waves[i]
+            this_flux = fluxes[i]
+            blend_wave = waves[i+1:i+j]
+            blend_flux = fluxes[i+1:i+j]
+            if blend_wave:
+                #- Expand the grid of the first line beyond its last 
+                #- wavelength with its average step, until all wavelengths in
+                #- all blends are covered. The steps are added one by one.
+                max_wave = max([wav[-1] for wav in blend_wave])
+                if this_wave[-1] < max_wave:
                     delta_lambda = (this_wave[-1]-this_wave[0])/len(this_wave)
-                    #- expand until all wavelenghts in all blends are covered 
-                    while this_wave[-1] < max([wav[-1] for wav in blend_wave]):
-                        this_wave.append(this_wave[-1]+delta_lambda)
-                        this_flux.append(0.0)
-                    interpolations = []
-                    #- interpolate to get values for the new grid, where the 
-                    #- original wavelength grid for every blend is expanded
-                    #- such that all wavelengths in the new grid are covered, 
-                    #- adding zeroes in this way does not change the result
-                    for x,y in zip(blend_wave,blend_flux):
-                        this_x = array([this_wave[0],x[0]-(x[1]-x[0])] + x + \
-                                       [x[-1]+(x[-1]-x[-2]),this_wave[-1]])
-                        this_y = array([0,0] + y + [0,0])
-                        interpolations.append(array(scipy.interpolate.interp1d\
-                                                   (this_x,this_y)(this_wave)))
-                    #- add together 
-                    this_flux=array(this_flux)
-                    for blend in interpolations: this_flux += blend
-                else:
-                    max_index = i
-                
-                #- extend result with the new wavelengths and fluxes, 
-                #- including blends if needed
-                sphinx_final.extend([(x,y) 
-                                     for x,y in zip(this_wave,this_flux)])
-                #- extend result further with zeroes up until the next sphinx 
-                #- line, after the last line in the blend 
-                #- Take delta equal to average delta in last Sphinx segment, 
-                #- this may be different from delta in next segment, 
-                #- but since they're zeroes you don't really care 
-                sphinx_final.append((2*sphinx_final[-1][0]\
-                                        -sphinx_final[-2][0],\
-                                     0.0))
-                while sphinx_final[-1][0] + 0.001 < sphinx_input[i+j][0][0]:
-                    sphinx_final.append((sphinx_final[-1][0]+0.001,0.0))
-                sphinx_final.append((2*sphinx_input[i+j][0][0]-\
-                                        sphinx_input[i+j][0][1],\
-                                     0.0))
+                    nstep = int((max_wave-this_wave[-1])/delta_lambda) + 2
+                    extra = np.cumsum(np.concatenate([[this_wave[-1]],\
+                                                np.repeat(delta_lambda,nstep)]))
+                    extra = extra[1:np.argmax(extra >= max_wave)+1]
+                    this_wave = np.concatenate([this_wave,extra])
+                    this_flux = np.concatenate([this_flux,np.zeros(len(extra))])
+                #- interpolate to get values for the new grid, where the 
+                #- original wavelength grid for every blend is expanded
+                #- such that all wavelengths in the new grid are covered, 
+                #- adding zeroes in this way does not change the result
+                for x,y in zip(blend_wave,blend_flux):
+                    this_x = np.concatenate([[this_wave[0],x[0]-(x[1]-x[0])],\
+                                             x,[x[-1]+(x[-1]-x[-2]),\
+                                                this_wave[-1]]])
+                    this_y = np.concatenate([[0,0],y,[0,0]])
+                    this_flux = this_flux + \
+                                scipy.interpolate.interp1d(this_x,this_y)\
+                                                          (this_wave)
+            final_wave.append(this_wave)
+            final_flux.append(this_flux)
+            
+            #- extend result further with zeroes up until the next sphinx 
+            #- line, after the last line in the blend. The first step is equal
+            #- to the last step in the Sphinx segment, then steps of 0.001 
+            #- micron are added one by one. The last zero is one step of the
+            #- next line before it.
+            next_wave = waves[i+j]
+            last_wave = np.concatenate([final_wave[-2][-1:],this_wave[-2:]])
+            zero_wave = 2*last_wave[-1]-last_wave[-2]
+            nstep = int(max(0,(next_wave[0]-zero_wave)/0.001)) + 2
+            zero_wave = np.cumsum(np.concatenate([[zero_wave],\
+                                                  np.repeat(0.001,nstep)]))
+            zero_wave = zero_wave[:np.searchsorted(zero_wave[1:],next_wave[0])+1]
+            zero_wave = np.concatenate([zero_wave,\
+                                        [2*next_wave[0]-next_wave[1]]])
+            final_wave.append(zero_wave)
+            final_flux.append(np.zeros(len(zero_wave)))
+            
         #-- Remember overlap_bools contains FALSE if there IS an overlap. 
         #   Counterintuitive, I know. 
         if overlap_bools[-1]:
-            sphinx_final.extend([(w,f) 
-                                 for w,f in zip(sphinx_input[-1][0],\
-                                                sphinx_input[-1][1])])
-        sphinx_final.extend([(sphinx_input[-1][0][-1] + d/100.,0.0) 
-                             for d in xrange(1,1000)])
+            final_wave.append(waves[-1])
+            final_flux.append(fluxes[-1])
+        final_wave.append(waves[-1][-1] + np.arange(1,1000)/100.)
+        final_flux.append(np.zeros(999))
 
         #- No final sort for now, it should be aranged already, even if line 
         #- blends are present
-        return [s[0] 
-                for s in sphinx_final],\
-               [s[1] 
-                for s in sphinx_final]
+        return np.concatenate(final_wave),np.concatenate(final_flux)
                 
         
\ No newline at end of file
@@ -12,7 +12,7 @@ import os
 import subprocess
 import cPickle
 from glob import glob
-from time import gmtime
+from time import gmtime, time
 from scipy import array,argsort,interpolate
 import numpy as np
 
@@ -20,6 +20,7 @@ import cc.path
 from cc.tools.io import DataIO
 from cc.data.instruments.Instrument import Instrument
 from cc.tools.io import Database
+from cc.tools.io import SpectrumStore
 from cc.data import Data
 
 
@@ -284,7 +285,7 @@ class Pacs(Instrument):
     """
     
     def __init__(self,star_name,oversampling,path=None,redo_convolution=0,\
-                 intrinsic=1,path_linefit='',absflux_err=0.2):
+                 intrinsic=1,path_linefit='',absflux_err=0.2,num_workers=1):
         
         '''
         Initializing an instance of Pacs().
@@ -328,6 +329,12 @@ class Pacs(Instrument):
                                
                               (default: 0.2)
         @type absflux_err: float
+        @keyword num_workers: The number of parameter sets of which the Sphinx
+                              output is convolved at the same time, each in a
+                              separate process.
+                              
+                              (default: 1)
+        @type num_workers: int
         
         '''
         
@@ -335,7 +342,8 @@ class Pacs(Instrument):
                                   path_linefit=path_linefit,path=path,\
                                   absflux_err=absflux_err,
                                   oversampling=oversampling,\
-                                  instrument_name='PACS',intrinsic=intrinsic)
+                                  instrument_name='PACS',intrinsic=intrinsic,\
+                                  num_workers=num_workers)
         self.data_wave_list = []
         self.data_flux_list = []
         self.data_ordernames = []
@@ -352,8 +360,12 @@ class Pacs(Instrument):
             self.db = Database.Database(self.db_path)
             DataIO.testFolderExistence(os.path.join(cc.path.gout,'stars',\
                                        self.star_name,'PACS_results'))
+            self.store = SpectrumStore.SpectrumStore(\
+                            os.path.join(cc.path.gout,'stars',self.star_name,\
+                                         'PACS_results','sphinx_store.dat'))
         else:
             self.db = None
+            self.store = None
         self.sphinx_prep_done = 0
         self.readLineFit()
 
@@ -487,7 +499,12 @@ class Pacs(Instrument):
         
         '''
         Prepare Sphinx PACS models by checking if the Star() instance already 
-        has a PACS id associated with it, and if not calling convolveSphinx.
+        has a PACS id associated with it, and if not calling 
+        convolveSphinxModel.
+        
+        The database is checked and new PACS ids are made in the order of the 
+        grid. The convolutions are then done for num_workers parameter sets at 
+        the same time, and added to the database in one go afterwards.
         
         @param star_grid: The parameter sets
         @type star_grid: list[Star()]
@@ -503,19 +520,78 @@ class Pacs(Instrument):
         if not self.sphinx_prep_done or redo_sphinx_prep:
             print '** Loading from database, or convolving with ' + \
                   'Gaussian and rebinning to data wavelength grid.'  
+            tasks = []
+            new_ids = []
             for i,star in enumerate(star_grid):
                 print '* Sphinx model %i out of %i.' %(i+1,len(star_grid))
                 if not star['LAST_GASTRONOOM_MODEL']: 
                     print '* No cooling model found.'
-                else:
-                    self.__convolveSphinx(star=star)
+                    continue
+                filenames_to_do = self.__checkConvolution(star)
+                if not filenames_to_do:
                     if star['LAST_PACS_MODEL']:
                         print '* %s is done!'%star['LAST_PACS_MODEL']
+                    continue
+                if not star['LAST_PACS_MODEL']:
+                    star['LAST_PACS_MODEL'] = self.makeNewId(new_ids)
+                    new_ids.append(star['LAST_PACS_MODEL'])
+                tasks.append((i,(filenames_to_do,)))
+            
+            #-- Set the resolution before the workers are started
+            if tasks and not self.data_delta_list:
+                self.setDataResolution()
+            results = self.runSphinxConvolutions(star_grid,tasks)
+            #-- The workers added the convolutions to the spectrum store
+            self.store.refresh()
+            for (i,args),filenames_done in zip(tasks,results):
+                star = star_grid[i]
+                pacs_id = star['LAST_PACS_MODEL']
+                if not filenames_done:
+                    #-- No Sphinx output: the new PACS id is not used
+                    if pacs_id in new_ids:
+                        star['LAST_PACS_MODEL'] = None
+                    continue
+                if pacs_id in new_ids:
+                    self.db[pacs_id] = \
+                        dict([('filenames',[]),\
+                              ('trans_list',star.getTransList(dtype='PACS')),\
+                              ('cooling_id',star['LAST_GASTRONOOM_MODEL'])])
+                self.db[pacs_id]['filenames'].extend(filenames_done)
+                self.db.addChangedKey(pacs_id)
+                print '* %s is done!'%pacs_id
             self.sphinx_prep_done = 1
             self.db.sync()
                       
 
 
+    def makeNewId(self,taken=[]):
+        
+        '''
+        Make a new PACS id based on the current UTC in seconds since 1970.
+        
+        If the PACS id is in the database or taken already, eg when several ids
+        are made in the same second, the time is moved forward by a second 
+        until it is not. 
+        
+        @keyword taken: PACS ids that are taken, but not yet in the database
+        
+                        (default: [])
+        @type taken: list[string]
+        
+        @return: The new PACS id
+        @rtype: string
+        
+        '''
+        
+        now = time()
+        pacs_id = 'pacs_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'%gmtime(now)[:6]
+        while self.db.has_key(pacs_id) or pacs_id in taken:
+            now += 1
+            pacs_id = 'pacs_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'%gmtime(now)[:6]
+        return pacs_id
+
+
+
     def getSphinxConvolution(self,star,fn):
         
         '''
@@ -523,6 +599,10 @@ class Pacs(Instrument):
         
         Returns None if the convolution is not available. 
         
+        The convolution is read from the spectrum store of the star, without
+        copying. Convolutions made before the store was used are read from 
+        their text file, and added to the store.
+        
         @param star: The Star() object
         @type star: Star()
         @param fn: The filename of the dataset (band) for which the convolution
@@ -538,21 +618,35 @@ class Pacs(Instrument):
         if not this_id:
             return ([],[])
         fn = os.path.split(fn)[1]
-        sphinx_file = os.path.join(cc.path.gout,'stars',self.star_name,\
-                                  'PACS_results',this_id,'%s_%s'%('sphinx',fn))
-        return DataIO.readCols(sphinx_file)
+        flux = self.store.get(this_id,fn)
+        if flux is None:
+            sphinx_file = os.path.join(cc.path.gout,'stars',self.star_name,\
+                                       'PACS_results',this_id,\
+                                       '%s_%s'%('sphinx',fn))
+            wave,flux = DataIO.readCols(sphinx_file)
+            self.store.append(this_id,dict([(fn,flux)]))
+            return (wave,flux)
+        ifn = [os.path.split(f)[1] for f in self.data_filenames].index(fn)
+        return (self.data_wave_list[ifn],flux)
 
 
 
-    def __convolveSphinx(self,star):
+    def __checkConvolution(self,star):
         
         '''
-        Check if sphinx output has already been convolved (pacs db) and do so 
-        if not.
+        Check if sphinx output has already been convolved (pacs db), and 
+        return the filenames of the bands for which it has not.
+        
+        If the convolution is redone, old convolutions in text files are moved
+        to a backup. Those in the spectrum store are replaced when the new 
+        convolutions are added.
         
         @param star: The parameter set
         @type star: Star()
         
+        @return: The filenames of the bands that are to be convolved
+        @rtype: list[string]
+        
         '''     
         
         #- check for which filenames the convolution has already been done
@@ -572,62 +666,63 @@ class Pacs(Instrument):
                 backup = os.path.join(cc.path.gout,'stars',self.star_name,\
                                       'PACS_results',star['LAST_PACS_MODEL'],\
                                       '_'.join(['backup','sphinx',filename]))
-                subprocess.call(['mv %s %s'%(ori,backup)],shell=True)
+                if os.path.isfile(ori):
+                    subprocess.call(['mv %s %s'%(ori,backup)],shell=True)
             self.db[star['LAST_PACS_MODEL']]['filenames'] = []
             finished_conv_filenames = []
-        filenames_to_do = [this_f 
-                           for this_f in [os.path.split(f)[1] 
-                                          for f in self.data_filenames]
-                           if this_f not in finished_conv_filenames]     
-        
-        #-Get sphinx model output and merge, for all star models in star_grid
-        if filenames_to_do:        
-            #- if list is not empty, some filenames still need a convolution    
-            print '* Reading Sphinx model and merging.'
-            merged = star['LAST_GASTRONOOM_MODEL'] \
-                        and self.mergeSphinx(star) \
-                        or [[],[]]
-            sphinx_wave = merged[0]
-            sphinx_flux = merged[1]
-            if not sphinx_wave: 
-                print '* No Sphinx data found.'
-                return
+        return [this_f 
+                for this_f in [os.path.split(f)[1] for f in self.data_filenames]
+                if this_f not in finished_conv_filenames]     
+        
+        
+        
+    def convolveSphinxModel(self,star,filenames):
+        
+        '''
+        Merge and convolve the Sphinx output of a parameter set for PACS bands,
+        and add the convolutions to the spectrum store with its PACS id. 
+        
+        The database is not changed, which makes this method safe to use in 
+        worker processes.
+        
+        @param star: The parameter set, with the PACS id set
+        @type star: Star()
+        @param filenames: The filenames of the bands that are convolved
+        @type filenames: list[string]
+        
+        @return: The filenames of the bands that were convolved, empty if no 
+                 Sphinx output is found
+        @rtype: list[string]
+        
+        '''
+        
+        #-Get sphinx model output and merge
+        print '* Reading Sphinx model and merging.'
+        sphinx_wave,sphinx_flux = self.mergeSphinx(star)
+        if not len(sphinx_wave): 
+            print '* No Sphinx data found.'
+            return []
   
-            #- convolve the model fluxes with a gaussian at central wavelength 
-            #- from data_wave_list for every star, and appropriate sigma
-            print '* Convolving Sphinx model, after correction for v_lsr.'
-            if not self.data_delta_list:
-                self.setDataResolution()
-            for filename in filenames_to_do:
-                i_file = [os.path.split(f)[1] 
-                          for f in self.data_filenames].index(filename)
-                if not star['LAST_PACS_MODEL']:
-                    star['LAST_PACS_MODEL'] = \
-                        'pacs_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'\
-                        %(gmtime()[0],gmtime()[1],gmtime()[2],\
-                          gmtime()[3],gmtime()[4],gmtime()[5])
-                    self.db[star['LAST_PACS_MODEL']] = \
-                        dict([('filenames',[]),\
-                              ('trans_list',star.getTransList(dtype='PACS')),\
-                              ('cooling_id',star['LAST_GASTRONOOM_MODEL'])])
-                    DataIO.testFolderExistence(\
-                        os.path.join(cc.path.gout,'stars',self.star_name,\
-                                     'PACS_results',star['LAST_PACS_MODEL']))
-                #-- Correct for the v_lsr of the central source
-                sphinx_wave_corr = array(sphinx_wave)*(1./(1-self.vlsr/self.c))
-                sph_conv = Data.doConvolution(\
-                                        x_in=sphinx_wave_corr,\
-                                        y_in=sphinx_flux,\
-                                        x_out=self.data_wave_list[i_file],\
-                                        widths=self.data_delta_list[i_file],\
-                                        oversampling=self.oversampling)
-                sph_fn = os.path.join(cc.path.gout,'stars',self.star_name,\
-                                      'PACS_results',star['LAST_PACS_MODEL'],\
-                                      '_'.join(['sphinx',filename])) 
-                DataIO.writeCols(filename=sph_fn,\
-                                 cols=[self.data_wave_list[i_file],sph_conv])
-                self.db[star['LAST_PACS_MODEL']]['filenames'].append(filename)
-                self.db.addChangedKey(star['LAST_PACS_MODEL'])        
+        #- convolve the model fluxes with a gaussian at central wavelength 
+        #- from data_wave_list for every star, and appropriate sigma
+        print '* Convolving Sphinx model, after correction for v_lsr.'
+        if not self.data_delta_list:
+            self.setDataResolution()
+        sph_convs = dict()
+        for filename in filenames:
+            i_file = [os.path.split(f)[1] 
+                      for f in self.data_filenames].index(filename)
+            #-- Correct for the v_lsr of the central source
+            sphinx_wave_corr = array(sphinx_wave)*(1./(1-self.vlsr/self.c))
+            sph_conv = Data.doConvolution(\
+                                    x_in=sphinx_wave_corr,\
+                                    y_in=sphinx_flux,\
+                                    x_out=self.data_wave_list[i_file],\
+                                    widths=self.data_delta_list[i_file],\
+                                    oversampling=self.oversampling)
+            sph_convs[filename] = sph_conv
+        self.store.append(star['LAST_PACS_MODEL'],sph_convs)
+        return filenames
         
         #- Idea:
         #- 1) grab model flux and wavelength, data flux and wavelengthm, 
@@ -8,13 +8,15 @@ Author: R. Lombaert
 """
 
 import os
+import hashlib
 import numpy as np
-from scipy import array,sqrt,trapz,log, argmin
+from scipy import array,sqrt,log
 
 import cc.path
 from cc.data import Data
 from cc.tools.io import Database
 from cc.tools.io import DataIO
+from cc.tools.io import SpectrumStore
 from cc.data.instruments.Instrument import Instrument
 
 
@@ -28,7 +30,7 @@ class Spire(Instrument):
     
     def __init__(self,star_name,resolution,oversampling,\
                  path='codeSep2010',intrinsic=1,path_linefit='',\
-                 absflux_err=0.1):
+                 absflux_err=0.1,num_workers=1):
         
         '''
         Initializing an instance of Spire().
@@ -66,6 +68,12 @@ class Spire(Instrument):
                                
                                (default: 0.1)
         @type absflux_err: float
+        @keyword num_workers: The number of parameter sets of which the Sphinx
+                              output is convolved at the same time, each in a
+                              separate process.
+                              
+                              (default: 1)
+        @type num_workers: int
         
         '''
         
@@ -73,7 +81,8 @@ class Spire(Instrument):
                                    path=path,absflux_err=absflux_err,\
                                    oversampling=oversampling,\
                                    path_linefit=path_linefit,\
-                                   instrument_name='SPIRE',intrinsic=intrinsic)
+                                   instrument_name='SPIRE',intrinsic=intrinsic,\
+                                   num_workers=num_workers)
         #- resolution is given in cm^-1
         self.resolution = float(resolution)
         self.sigma = self.resolution/(2.*sqrt(2.*log(2.)))
@@ -84,6 +93,13 @@ class Spire(Instrument):
         
         #-- Convenience path
         cc.path.gout = os.path.join(cc.path.gastronoom,self.path)
+        
+        #-- The convolutions are kept in a spectrum store for later sessions
+        DataIO.testFolderExistence(os.path.join(cc.path.gout,'stars',\
+                                                self.star_name,'SPIRE_results'))
+        self.store = SpectrumStore.SpectrumStore(\
+                        os.path.join(cc.path.gout,'stars',self.star_name,\
+                                     'SPIRE_results','sphinx_store.dat'))
        
     
     def prepareSphinx(self,star_grid,redo_sphinx_prep=0):
@@ -91,7 +107,9 @@ class Spire(Instrument):
         '''
         
         Prepare Sphinx SPIRE models by checking if the convolved spectrum is 
-        already present in the Spire object and if not calling convolveSphinx.
+        already present in the Spire object or in the spectrum store, and if 
+        not calling convolveSphinxModel, for num_workers parameter sets at the 
+        same time. New convolutions are added to the spectrum store.
         
         @param star_grid: list of Star() instances
         @type star_grid: list[Star()]
@@ -107,19 +125,38 @@ class Spire(Instrument):
         if not self.sphinx_convolution or redo_sphinx_prep:
             print 'Convolving with Gaussian and rebinning to data ' + \
                   'wavelength grid.'            
+            bands = [os.path.split(fn)[1] for fn in self.data_filenames]
+            tasks = []
             for i,star in enumerate(star_grid):
-                print '* Sphinx model %i out of %i.' %(i+1,len(star_grid))
                 if not star['LAST_GASTRONOOM_MODEL']: 
-                    print '* No cooling model found.'
+                    print '* Sphinx model %i out of %i: No cooling model found.'\
+                          %(i+1,len(star_grid))
+                    continue
+                star['LAST_SPIRE_MODEL'] = i
+                store_id = self.getStoreId(star)
+                stored = [self.store.get(store_id,band) for band in bands]
+                #-- Only use stored convolutions on the current data grids 
+                if False not in [flux is not None and len(flux) == len(wav)
+                                 for flux,wav in zip(stored,\
+                                                     self.data_wave_list)]:
+                    self.sphinx_convolution[i] = \
+                        dict(zip(self.data_filenames,stored))
+                    print '* Model %i with cooling id %s is in the store.'\
+                          %(i,star['LAST_GASTRONOOM_MODEL'])
+                else:
+                    tasks.append((i,()))
+            results = self.runSphinxConvolutions(star_grid,tasks)
+            for (i,args),convolution in zip(tasks,results):
+                star = star_grid[i]
+                self.sphinx_convolution[i] = convolution
+                if convolution:
+                    self.store.append(self.getStoreId(star),\
+                                      dict([(os.path.split(fn)[1],flux)
+                                            for fn,flux in convolution.items()]))
+                    print '* Model %i with cooling id %s is done!'\
+                          %(i,star['LAST_GASTRONOOM_MODEL'])
                 else:
-                    self.sphinx_convolution[i] = dict()
-                    star['LAST_SPIRE_MODEL'] = i
-                    self.__convolveSphinx(star=star)
-                    if self.sphinx_convolution[i]:
-                        print '* Model %i with cooling id %s is done!'\
-                              %(i,star['LAST_GASTRONOOM_MODEL'])
-                    else:
-                        star['LAST_SPIRE_MODEL'] = None
+                    star['LAST_SPIRE_MODEL'] = None
                       
                       
                       
@@ -150,63 +187,119 @@ class Spire(Instrument):
 
 
 
-    def __convolveSphinx(self,star):
+    def getStoreId(self,star):
+        
+        '''
+        Return the id of the convolved Sphinx output of a Star() object in the
+        spectrum store. 
+        
+        The id depends on the Sphinx models of the SPIRE transitions, on 
+        the resolution, oversampling and intrinsic settings of this instance,
+        and on the wavelength grids of the data, so convolutions for earlier 
+        reductions of a data file with the same name are not used.
+        
+        @param star: The Star() object
+        @type star: Star()
+        
+        @return: The id
+        @rtype: string
+        
+        '''
+        
+        sphinx_ids = sorted([(str(trans),trans.getModelId())
+                             for trans in star['GAS_LINES'] 
+                             if trans.getModelId() \
+                                and self.instrument.upper() in trans.telescope])
+        data_grids = [(len(wav),hashlib.md5(array(wav,dtype='<f8')\
+                                                .tostring()).hexdigest())
+                      for wav in self.data_wave_list]
+        key = repr((sphinx_ids,self.resolution,self.oversampling,\
+                    bool(self.intrinsic),data_grids))
+        return 'spire_%s'%hashlib.md5(key).hexdigest()
+        
+        
+        
+    def convolveSphinxModel(self,star):
         
         '''
         Convolve the Sphinx output with the SPIRE resolution. The convolution
         is done in wave number (cm^-1).
         
+        The Spire object is not changed, which makes this method safe to use 
+        in worker processes.
+        
         @param star: The Star() object for which Sphinx profiles are loaded
         @type star: Star()
         
+        @return: The convolved Sphinx output for every data filename, empty if
+                 no Sphinx output is found
+        @rtype: dict(string: array)
+        
         '''     
 
         #- Get sphinx model output and merge, for all star models in star_grid
+        sphinx_convolution = dict()
         if not self.resolution: 
             print '* Resolution is undefined. Cannot convolve Sphinx.'
-            return
+            return sphinx_convolution
         print '* Reading Sphinx model and merging.'
         sphinx_wav,sphinx_flux = star['LAST_GASTRONOOM_MODEL'] \
                                         and self.mergeSphinx(star) \
                                         or [[],[]]
-        if not sphinx_wav: 
+        if not len(sphinx_wav): 
             print '* No Sphinx data found.'
-            return
+            return sphinx_convolution
         sphinx_wav = 1./array(sphinx_wav)*10**(4)
         sphinx_flux = array(sphinx_flux)
         sphinx_wav = sphinx_wav[::-1]
         sphinx_flux = sphinx_flux[::-1]
         
         #-- eliminate some of the zeroes in the grid to reduce calculation time
-        #   (can reduce the array by a factor up to 100!!)
+        #   (can reduce the array by a factor up to 100!!). Zeroes are kept 
+        #   within 5 sigma of the closest line center.
         s = self.sigma
         lcs = array(sorted([1./line.wavelength 
                             for line in star['GAS_LINES']]))
-        new_wav, new_flux = [sphinx_wav[0]],[sphinx_flux[0]]
-        for w,f in zip(sphinx_wav[1:],sphinx_flux[1:]):
-            if f != 0 or (w < 5*s+lcs[argmin(abs(lcs-w))] \
-                                and w > lcs[argmin(abs(lcs-w))]-5*s):
-                new_wav.append(w)
-                new_flux.append(f)
-        new_wav, new_flux = array(new_wav), array(new_flux)
+        lcs = lcs[Data.findClosest(lcs,sphinx_wav)]
+        keep = (sphinx_flux != 0) | ((sphinx_wav < 5*s+lcs) \
+                                        & (sphinx_wav > lcs-5*s))
+        keep[0] = True
+        new_wav, new_flux = sphinx_wav[keep], sphinx_flux[keep]
+        if (np.diff(new_wav) < 0).any():
+            isort = np.argsort(new_wav,kind='mergesort')
+            new_wav, new_flux = new_wav[isort], new_flux[isort]
+        
+        #-- Find the sphinx points in the rebinning bin of every data point. 
+        #   Convert wavelengths to wave number for integration, and reverse
+        binsize = self.resolution/self.oversampling
+        windows = []
+        for data_wav in self.data_wave_list:
+            data_cm = data_wav[::-1]
+            data_cm = 1./data_cm*10**4
+            windows.append(Data.findWindows(new_wav,data_cm,binsize))
         
         #-- convolve the model fluxes with a gaussian and constant sigma(spire)
+        #   only where they are rebinned
         print '* Convolving Sphinx model for SPIRE.'
-        convolution = Data.convolveArray(new_wav,new_flux,s)
+        needed = np.zeros(len(new_wav),dtype=bool)
+        for b0,b1 in windows:
+            needed[Data.getRanges(b0,b1)] = True
+        points = np.nonzero(needed)[0]
+        convolution = np.zeros(len(new_wav))
+        convolution[points] = Data.convolveBanded(new_wav,new_flux,s,points)
         
-        for data_wav,fn in zip(self.data_wave_list,self.data_filenames):
-            rebinned = []
-            #-- Convert wavelengths to wave number for integration, and reverse
-            data_cm = data_wav[::-1]
-            data_cm = 1./data_cm*10**4
-            rebinned = [trapz(y=convolution[abs(new_wav-wavi)<=self.resolution/self.oversampling],\
-                              x=new_wav[abs(new_wav-wavi)<=self.resolution/self.oversampling])\
-                            /(self.resolution/self.oversampling)
-                        for wavi in data_cm]
+        #-- Integrate over every bin with the trapezium rule
+        areas = 0.5*(convolution[1:]+convolution[:-1])*np.diff(new_wav)
+        for (b0,b1),fn in zip(windows,self.data_filenames):
+            b1 = np.maximum(b0,b1-1)
+            owner = np.repeat(np.arange(len(b0)),b1-b0)
+            rebinned = np.bincount(owner,\
+                                   weights=areas[Data.getRanges(b0,b1)],\
+                                   minlength=len(b0))/binsize
             #-- Reverse the rebinned fluxes so they match up with the 
             #   wavelength grid.
-            rebinned = array(rebinned)[::-1]
-            self.sphinx_convolution[star['LAST_SPIRE_MODEL']][fn] = rebinned
+            sphinx_convolution[fn] = rebinned[::-1]
+        return sphinx_convolution
 
 
 
@@ -0,0 +1,957 @@
+# -*- coding: utf-8 -*-
+
+"""
+Interface for running the sphinx models of a modeling session outside of the
+session itself, either in the background on this machine or through a batch
+queue system.
+
+"""
+
+import os
+import subprocess
+import Queue
+from time import gmtime, sleep
+from multiprocessing.pool import ThreadPool
+
+import cc.path
+from cc.tools.io import DataIO
+from cc.modeling.codes import Gastronoom
+
+
+
+class Executor(object):
+
+    """
+    The basis for managers that calculate sphinx models for a modeling
+    session, and update the sphinx database on the home disk when they are
+    done.
+
+    Gastronoom() adds the models and transitions to be calculated through
+    addModel, addTrans and queueModel. The progress is checked with
+    checkProgress, and finalizeVic reports on the results at the end of the
+    session.
+
+    By default, the sphinx runs of a model are done in this process when the
+    model is queued. A backend that runs them elsewhere overrides submit and 
+    getFinished, and fetch and clean if output is not written to the home disk
+    directly.
+
+    """
+
+    #-- Folder in the GASTRoNOoM output folder for the result logs
+    results_folder = 'sphinx_results'
+
+    def __init__(self,path='runTest',recover_sphinxfiles=0):
+
+        """
+        Initializing an Executor instance.
+
+        @keyword path: The output folder in the GASTRoNOoM home folder
+
+                       (default: 'runTest')
+        @type path: string
+        @keyword recover_sphinxfiles: Only check if the sphinx files are
+                                      present, rather than calculating them.
+
+                                      (default: 0)
+        @type recover_sphinxfiles: bool
+
+        """
+
+        self.finished = dict()
+        self.failed = dict()
+        self.models = dict()
+        self.command_lists = dict()
+        self.transitions = dict()
+        self.sphinx_model_ids = dict()
+        self.inputfiles = dict()
+        self.trans_in_progress = []
+        self.path = path
+        self.recover_sphinxfiles = recover_sphinxfiles
+        self.current_model = 0
+        self.sph_db = None
+        #-- Queued models known to be finished, but not yet checked
+        self.ready = []
+
+
+
+    def setSphinxDb(self,sph_db):
+
+        '''
+        Set the Sphinx db for this Executor instance.
+
+        @param sph_db: The sphinx database
+        @type sph_db: Database()
+
+        '''
+
+        self.sph_db = sph_db
+
+
+
+    def updateLineSpec(self):
+
+        '''
+        Update telescope.spec files used by sphinx.
+
+        Nothing to be done if sphinx runs on the home disk.
+
+        '''
+
+        pass
+
+
+
+    def addModel(self,model_id,command_list):
+
+        '''
+        Add model to the list of to be processed models.
+
+        Here, dictionaries are initiated to contain information about the
+        modeling session.
+
+        Every entry in the dictionaries have an index number associated with
+        them to uniquely identify a modeling session across the manager.
+
+        The current_model index is the same between a call to the addModel
+        method and the queueModel() OR the reset methods. Anything between uses
+        the same index. queueModel() will move to the next index value, while
+        reset() will reset the current index number.
+
+        @param model_id: The cooling model_id
+        @type model_id: string
+        @param command_list: The parameters for this GASTRoNOoM model
+        @type command_list: dict()
+
+        '''
+
+        if self.models.has_key(self.current_model):
+            raise IOError('%s.addModel() is trying to add a model_id '\
+                          %self.__class__.__name__ + \
+                          'to a session that was already assigned an id. ' + \
+                          'Reset or queue the previous model first.')
+        self.models[self.current_model] = model_id
+        self.command_lists[self.current_model] = dict(command_list)
+        self.transitions[self.current_model] = []
+        self.failed[self.current_model] = []
+        self.finished[self.current_model] = []
+        self.inputfiles[self.current_model] = []
+
+
+
+    def addTransInProgress(self,trans):
+
+        '''
+        Add a transition to the list of transitions in progress. They will be
+        checked at the end of the session to see if they have been correctly
+        calculated.
+
+        This concerns transitions that are requested, but are already present
+        in the sphinx database with an "IN_PROGRESS" keyword included in the
+        transition dictionary. These will not be calculated again.
+
+        @param trans: The transition in progress
+        @type trans: Transition()
+
+        '''
+
+        self.trans_in_progress.append(trans)
+
+
+
+    def addTrans(self,trans):
+
+        '''
+        Add a transition to the transition list of the current model.
+
+        The entries in the transitions dictionary are deleted when the entry
+        has been completely finished.
+
+        @param trans: The transition to be calculated
+        @type trans: Transition()
+
+        '''
+
+        self.transitions[self.current_model].append(trans)
+
+
+
+    def queueModel(self):
+
+        '''
+        Queue the current model, ie submit its transitions to the backend.
+
+        Once everything has been started up, the current model index number is
+        increased by one to allow for a new model to be added.
+        
+        When sphinx files are recovered, nothing is submitted, and the model 
+        is marked as finished right away, so its output is checked at the next
+        progress check.
+
+        '''
+
+        self.sphinx_model_ids[self.current_model] \
+            = list(set([trans.getModelId()
+                        for trans in self.transitions[self.current_model]]))
+        if not self.recover_sphinxfiles:
+            self.submit(self.current_model)
+        else:
+            self.ready.append(self.current_model)
+        self.current_model += 1
+
+
+
+    def reset(self):
+
+        '''
+        If a model has been added, and no transitions were required to be
+        calculated, remove that model entry here.
+
+        '''
+
+        del self.models[self.current_model]
+        del self.transitions[self.current_model]
+
+
+
+    def getQueue(self):
+
+        '''
+        Get a list of unique queue number + cooling model_id for those models
+        that are still in progress.
+
+        @return: The queue numbers and model_ids still in progress.
+        @rtype: list[(int,string)]
+
+        '''
+
+        return [(k,v)
+                for k,v in self.models.items()
+                if self.transitions.has_key(k)]
+
+
+
+    def makeCommandList(self,current_model,trans):
+
+        '''
+        Make the GASTRoNOoM parameters for the sphinx run of a transition.
+
+        The model_id in the output keywords is set to the model_id of the
+        transition, as in Gastronoom.updateModel().
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+        @param trans: The transition
+        @type trans: Transition()
+
+        @return: The parameters
+        @rtype: dict
+
+        '''
+
+        command_list = dict(self.command_lists[current_model])
+        for par in ['OUTPUT_DIRECTORY','PARAMETER_FILE','OUTPUT_SUFFIX']:
+            i = command_list[par].find('model_')
+            command_list[par] = command_list[par]\
+                                    .replace(command_list[par][i:i+25],\
+                                             trans.getModelId(),2)
+        return command_list
+
+
+
+    def makeInputFiles(self,current_model,folder):
+
+        '''
+        Write a sphinx inputfile for every transition of a queued model.
+
+        All filenames with the same sphinx model_id get an increasing number.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+        @param folder: The folder in which the inputfiles are written
+        @type folder: string
+
+        @return: The inputfiles, with the index of their transition in
+                 self.transitions[current_model]
+        @rtype: list[(int,string)]
+
+        '''
+
+        DataIO.testFolderExistence(folder)
+        inputfiles = []
+        counts = dict()
+        for j,trans in enumerate(self.transitions[current_model]):
+            i = counts[trans.getModelId()] = counts.get(trans.getModelId(),0)+1
+            commandfile = Gastronoom.makeSphinxCommands(\
+                                self.makeCommandList(current_model,trans),\
+                                trans.molecule.makeDict(),trans.makeDict())
+            infile = os.path.join(folder,'gastronoom_%s_%i.inp'\
+                                         %(trans.getModelId(),i))
+            DataIO.writeFile(infile,commandfile)
+            inputfiles.append((j,infile))
+        self.inputfiles[current_model] = [f for j,f in inputfiles]
+        return inputfiles
+
+
+
+    def checkProgress(self,wait_qstat=0):
+
+        '''
+        Check progress on all queued models.
+
+        The output of every model that is finished is checked, and the sphinx
+        database is updated. In this method, the self.failed and self.finished
+        keywords are updated, and self.transitions is cleaned up on the go.
+
+        @keyword wait_qstat: Only there for compatibility with Vic(). Use
+                             wait() to wait for models to finish.
+
+                             (default: 0)
+        @type wait_qstat: bool
+
+        @return: Are models still in progress?
+        @rtype: bool
+
+        '''
+
+        for current_model in sorted(self.getFinished()):
+            if not self.transitions.has_key(current_model):
+                continue
+            print 'Currently checking %s...'%self.models[current_model]
+            self.fetch(current_model)
+            self.checkModel(current_model)
+            self.clean(current_model)
+            del self.transitions[current_model]
+        self.sph_db.sync()
+        return bool(self.transitions)
+
+
+
+    def wait(self,timeout):
+
+        '''
+        Wait until a queued model is finished, or until the timeout has passed.
+
+        Nothing to wait for if finished models have not been checked yet. 
+        Otherwise, backends that cannot be notified of finished models simply 
+        sleep.
+
+        @param timeout: The maximum waiting time in seconds
+        @type timeout: float
+
+        '''
+
+        if not self.ready:
+            sleep(timeout)
+
+
+
+    def checkModel(self,current_model):
+
+        '''
+        Check the sphinx output of a finished model, and update the sphinx
+        database in memory.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        gas_session = Gastronoom.Gastronoom(path_gastronoom=self.path,\
+                                            sph_db=self.sph_db)
+        gas_session.model_id = self.models[current_model]
+        gas_session.trans_list = self.transitions[current_model]
+        for trans in gas_session.trans_list:
+            gas_session.checkSphinxOutput(trans)
+        gas_session.finalizeSphinx()
+        self.finished[current_model] = [trans
+                                        for trans in gas_session.trans_list
+                                        if trans.getModelId()]
+        self.failed[current_model] = [trans
+                                      for trans in gas_session.trans_list
+                                      if not trans.getModelId()]
+
+
+
+    def finalizeVic(self):
+
+        '''
+        Finalize the modeling session: successful and failed results are
+        printed to a file, including the transitions.
+
+        This log file can be used as input for ComboCode again by putting
+        LINE_LISTS=2.
+
+        '''
+
+        for trans in self.trans_in_progress:
+            filename = os.path.join(cc.path.gastronoom,\
+                                    self.path,'models',trans.getModelId(),\
+                                    trans.makeSphinxFilename(2))
+            if not os.path.isfile(filename):
+                trans.setModelId('')
+        if self.models.keys():
+            time_stamp = '%.4i-%.2i-%.2ih%.2i:%.2i:%.2i'%gmtime()[:6]
+            results = ['# Successfully calculated models:'] \
+                    + [self.models[current_model]
+                       for current_model in self.models.keys()
+                       if not self.failed.get(current_model)] \
+                    + ['# Unsuccessfully calculated models (see 3 logfiles '+ \
+                       'for these models):'] \
+                    + [self.models[current_model]
+                       for current_model in self.models.keys()
+                       if self.failed.get(current_model)]
+            DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
+                                          self.results_folder,\
+                                          'log_' + time_stamp),\
+                             results)
+            for current_model,model_id in self.models.items():
+                model_results = ['# Successfully calculated transitions:'] + \
+                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans))
+                     for trans in self.finished[current_model]] + \
+                    ['# Unsuccessfully calculated transitions (see 2 other ' + \
+                     'logfiles for these transitions):'] + \
+                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans))
+                     for trans in self.failed[current_model]]
+                DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
+                                              self.results_folder,\
+                                              'log_results%s_%i'\
+                                              %(time_stamp,current_model)),\
+                                 model_results)
+
+
+
+    def submit(self,current_model):
+
+        '''
+        Run the sphinx models of a queued model in this process, one after the
+        other, and mark the model as finished.
+
+        The output of sphinx is written to a log file next to the inputfile.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        folder = os.path.join(cc.path.gastronoom,self.path,'models',\
+                              self.models[current_model],'sphinx_input')
+        inputfiles = self.makeInputFiles(current_model,folder)
+        print 'Running %i sphinx models for %s.'\
+              %(len(inputfiles),self.models[current_model])
+        for j,infile in inputfiles:
+            runSphinx(infile)
+        self.ready.append(current_model)
+
+
+
+    def getFinished(self):
+
+        '''
+        Return the queued models that are known to be finished, and have not 
+        been checked yet.
+
+        @return: The queue numbers of the finished models
+        @rtype: list[int]
+
+        '''
+
+        ready, self.ready = self.ready, []
+        return sorted(set([k for k in ready if self.transitions.has_key(k)]))
+
+
+
+    def fetch(self,current_model):
+
+        '''
+        Copy the sphinx output of a finished model to the home disk.
+
+        Nothing to be done if sphinx writes to the home disk directly.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        pass
+
+
+
+    def clean(self,current_model):
+
+        '''
+        Remove the files made for the sphinx runs of a finished model.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        pass
+
+
+
+class LocalExecutor(Executor):
+
+    """
+    Runs sphinx models in the background on this machine, while the modeling
+    session continues.
+
+    """
+
+    def __init__(self,num_workers=1,**kwargs):
+
+        """
+        Initializing a LocalExecutor instance.
+
+        @keyword num_workers: The maximum number of sphinx runs at the same time
+
+                              (default: 1)
+        @type num_workers: int
+
+        @keyword kwargs: Extra keywords passed to Executor()
+        @type kwargs: dict
+
+        """
+
+        super(LocalExecutor,self).__init__(**kwargs)
+        self.num_workers = int(num_workers)
+        self.pool = None
+        #-- Number of sphinx runs still going on per queued model, and the
+        #   queue through which the pool reports finished runs
+        self.running = dict()
+        self.done = Queue.Queue()
+
+
+
+    def submit(self,current_model):
+
+        '''
+        Write the inputfiles of a queued model and start its sphinx runs.
+
+        The runs are executed in a pool of num_workers threads, each waiting on
+        a sphinx process. The output of sphinx is written to a log file next to
+        the inputfile.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        if self.pool is None:
+            self.pool = ThreadPool(processes=self.num_workers)
+        folder = os.path.join(cc.path.gastronoom,self.path,'models',\
+                              self.models[current_model],'sphinx_input')
+        inputfiles = self.makeInputFiles(current_model,folder)
+        self.running[current_model] = len(inputfiles)
+        for j,infile in inputfiles:
+            self.pool.apply_async(self.runJob,(current_model,infile))
+        print 'Running %i sphinx models for %s in the background.'\
+              %(len(inputfiles),self.models[current_model])
+
+
+
+    def runJob(self,current_model,filename):
+
+        '''
+        Run sphinx for an inputfile in a thread of the pool, and report back 
+        when it is done, whether successful or not.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+        @param filename: The inputfile
+        @type filename: string
+
+        '''
+
+        try:
+            runSphinx(filename)
+        finally:
+            self.done.put(current_model)
+
+
+
+    def getFinished(self):
+
+        '''
+        Return the queued models for which all sphinx runs are finished, as 
+        well as the models marked as finished without being submitted.
+
+        @return: The queue numbers of the finished models
+        @rtype: list[int]
+
+        '''
+
+        while True:
+            try:
+                self.running[self.done.get_nowait()] -= 1
+            except Queue.Empty:
+                break
+        finished = [k for k,v in self.running.items()
+                    if not v and self.transitions.has_key(k)]
+        return sorted(set(finished + \
+                          super(LocalExecutor,self).getFinished()))
+
+
+
+    def wait(self,timeout):
+
+        '''
+        Wait until a sphinx run is finished, or until the timeout has passed.
+        
+        Nothing to wait for if models marked as finished have not been checked
+        yet.
+
+        @param timeout: The maximum waiting time in seconds
+        @type timeout: float
+
+        '''
+
+        if self.ready:
+            return
+        try:
+            current_model = self.done.get(timeout=timeout)
+        except Queue.Empty:
+            return
+        self.running[current_model] -= 1
+
+
+
+class BatchExecutor(Executor):
+
+    """
+    Runs sphinx models through the batch queue system of a cluster.
+
+    Per queued model, all inputfiles, the cooling and mline output and a job
+    script are sent to the cluster as a single archive, and the job is
+    submitted. When the job is done, it leaves a file in the done folder on the
+    cluster. Waiting for models is done by a single command on the cluster,
+    which returns as soon as a job is done. The sphinx output is sent back as
+    a single archive per model as well.
+
+    Commands are run through ssh if a host is given. Otherwise they are run
+    on this machine, eg to test the setup with a submit command such as 'sh'.
+
+    Files outside the output folder of the models, such as data, opacity and
+    abundance files, are expected at the same location on the cluster.
+
+    """
+
+    def __init__(self,host='',remote_path='',submit_command='qsub',**kwargs):
+
+        """
+        Initializing a BatchExecutor instance.
+
+        @keyword host: The login node of the cluster, eg user@cluster. Empty
+                       to run commands on this machine.
+
+                       (default: '')
+        @type host: string
+        @keyword remote_path: The working folder on the cluster. By default, the
+                              folder 'batch' in the GASTRoNOoM output folder.
+
+                              (default: '')
+        @type remote_path: string
+        @keyword submit_command: The command that submits a job script
+
+                                 (default: 'qsub')
+        @type submit_command: string
+
+        @keyword kwargs: Extra keywords passed to Executor()
+        @type kwargs: dict
+
+        """
+
+        super(BatchExecutor,self).__init__(**kwargs)
+        self.host = host
+        self.submit_command = submit_command
+        if not remote_path:
+            remote_path = os.path.join(cc.path.gastronoom,self.path,'batch')
+        self.remote_path = remote_path
+        self.jobs = []
+        #-- Did wait() check the cluster since the last progress check?
+        self.polled = False
+        self.execute('mkdir -p %s %s'%(os.path.join(remote_path,'output'),\
+                                       os.path.join(remote_path,'done')))
+
+
+
+    def execute(self,command,stdin=None,stdout=None):
+
+        '''
+        Run a shell command on the cluster, and wait for it to finish.
+
+        @param command: The command
+        @type command: string
+
+        @keyword stdin: Passed on to subprocess.Popen
+
+                        (default: None)
+        @type stdin: file
+        @keyword stdout: Passed on to subprocess.Popen
+
+                         (default: None)
+        @type stdout: file
+
+        @return: The output of the command, if stdout is subprocess.PIPE
+        @rtype: string
+
+        '''
+
+        process = subprocess.Popen(self.makeCommand(command),stdin=stdin,\
+                                   stdout=stdout)
+        return process.communicate()[0]
+
+
+
+    def makeCommand(self,command):
+
+        '''
+        Make the arguments for subprocess to run a command on the cluster.
+
+        @param command: The command
+        @type command: string
+
+        @return: The arguments
+        @rtype: list[string]
+
+        '''
+
+        if self.host:
+            return ['ssh',self.host,command]
+        return ['sh','-c',command]
+
+
+
+    def getJobName(self,current_model):
+
+        '''
+        Return the name of the job of a queued model, which is also the name
+        of its folder and done file on the cluster.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        @return: The job name
+        @rtype: string
+
+        '''
+
+        return '%s_%i'%(self.models[current_model],current_model)
+
+
+
+    def makeCommandList(self,current_model,trans):
+
+        '''
+        Make the GASTRoNOoM parameters for the sphinx run of a transition,
+        with the output directed to the working folder on the cluster.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+        @param trans: The transition
+        @type trans: Transition()
+
+        @return: The parameters
+        @rtype: dict
+
+        '''
+
+        command_list = dict(self.command_lists[current_model])
+        output = os.path.join(self.remote_path,'output',trans.getModelId())
+        command_list['OUTPUT_DIRECTORY'] = '"%s/"'%output
+        command_list['PARAMETER_FILE'] = '"%s"'\
+                %os.path.join(output,'parameter_file_%s.dat'%trans.getModelId())
+        command_list['OUTPUT_SUFFIX'] = trans.getModelId()
+        return command_list
+
+
+
+    def submit(self,current_model):
+
+        '''
+        Send the inputfiles and the cooling and mline output of a queued model
+        to the cluster, and submit its job.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        job_name = self.getJobName(current_model)
+        models = os.path.join(cc.path.gastronoom,self.path,'models')
+        local_folder = os.path.join(models,self.models[current_model],\
+                                    'batch_input',job_name)
+        remote_folder = os.path.join(self.remote_path,job_name)
+        output = os.path.join(self.remote_path,'output')
+        inputfiles = self.makeInputFiles(current_model,local_folder)
+        jobfile = ['#!/bin/sh'] + \
+                  ['echo %s | sphinx > %s 2>&1'\
+                   %(os.path.join(remote_folder,os.path.split(f)[1]),\
+                     os.path.join(output,self.transitions[current_model][j]\
+                                                .getModelId(),\
+                                  os.path.split(f)[1].replace('.inp','.log')))
+                   for j,f in inputfiles] + \
+                  ['touch %s'%os.path.join(self.remote_path,'done',job_name)]
+        DataIO.writeFile(os.path.join(local_folder,'job_%s.sh'%job_name),\
+                         jobfile)
+        
+        #-- One archive with the inputfiles, the job script and the output of
+        #   the cooling and mline models (links resolved), unpacked in the 
+        #   output folder on the cluster, after which the job folder is moved
+        tar = subprocess.Popen(['tar','-chf','-','--exclude=sph*',\
+                                '-C',os.path.split(local_folder)[0],job_name,\
+                                '-C',models] + \
+                               self.sphinx_model_ids[current_model],\
+                               stdout=subprocess.PIPE)
+        self.execute('tar -xf - -C %s && rm -rf %s && mv %s %s'\
+                     %(output,remote_folder,os.path.join(output,job_name),\
+                       remote_folder),\
+                     stdin=tar.stdout)
+        tar.stdout.close()
+        tar.wait()
+        self.jobs.append(subprocess.Popen(self.makeCommand('cd %s && %s %s'\
+                                    %(remote_folder,self.submit_command,\
+                                      'job_%s.sh'%job_name)),\
+                                          stdout=subprocess.PIPE,\
+                                          stderr=subprocess.STDOUT))
+        print 'Submitted %i sphinx models for %s as job %s.'\
+              %(len(inputfiles),self.models[current_model],job_name)
+
+
+
+    def pollJobs(self,timeout=0):
+
+        '''
+        Return the queued models whose job is done.
+
+        This is checked with a single command on the cluster, which waits until
+        a job is done or until the timeout has passed.
+
+        @keyword timeout: The maximum waiting time in seconds
+
+                          (default: 0)
+        @type timeout: float
+
+        @return: The queue numbers of the finished models
+        @rtype: list[int]
+
+        '''
+
+        #-- Clean up the submit processes that have returned
+        self.jobs = [job for job in self.jobs if job.poll() is None]
+        names = dict([(self.getJobName(k),k) for k,v in self.getQueue()])
+        if not names:
+            return []
+        done = os.path.join(self.remote_path,'done')
+        command = 'cd %s; t=0; '%done + \
+                  'while [ $t -lt %i ] && [ -z "$(ls %s 2> /dev/null)" ]; '\
+                  %(int(timeout),' '.join(names.keys())) + \
+                  'do sleep 5; t=$((t+5)); done; ' + \
+                  'ls %s 2> /dev/null; true'%' '.join(names.keys())
+        output = self.execute(command,stdout=subprocess.PIPE)
+        return [names[f] for f in output.split() if names.has_key(f)]
+
+
+
+    def getFinished(self):
+
+        '''
+        Return the queued models whose job is done.
+
+        The cluster is only checked if wait() did not do so since the last 
+        progress check.
+
+        @return: The queue numbers of the finished models
+        @rtype: list[int]
+
+        '''
+
+        if not self.polled:
+            self.ready.extend(self.pollJobs())
+        self.polled = False
+        return super(BatchExecutor,self).getFinished()
+
+
+
+    def wait(self,timeout):
+
+        '''
+        Wait until a job is done, or until the timeout has passed.
+
+        The finished jobs are remembered for the next progress check.
+
+        @param timeout: The maximum waiting time in seconds
+        @type timeout: float
+
+        '''
+
+        self.ready.extend(self.pollJobs(timeout))
+        self.polled = True
+
+
+
+    def fetch(self,current_model):
+
+        '''
+        Copy the sphinx output and logs of a finished model to the home disk,
+        as a single archive.
+        
+        The logs of the sphinx runs are copied to the model folders.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        models = os.path.join(cc.path.gastronoom,self.path,'models')
+        tar = subprocess.Popen(['tar','-xf','-','-C',models],\
+                               stdin=subprocess.PIPE)
+        self.execute('cd %s && tar -cf - %s'\
+                     %(os.path.join(self.remote_path,'output'),\
+                       ' '.join(['%s/sph* %s/*.log'%(i,i)
+                                 for i in self.sphinx_model_ids\
+                                                  [current_model]])),\
+                     stdout=tar.stdin)
+        tar.stdin.close()
+        tar.wait()
+
+
+
+    def clean(self,current_model):
+
+        '''
+        Remove the job folder and done file of a finished model on the
+        cluster, in a single command.
+
+        @param current_model: The queue number of the model
+        @type current_model: int
+
+        '''
+
+        job_name = self.getJobName(current_model)
+        self.execute('rm -rf %s %s'\
+                     %(os.path.join(self.remote_path,job_name),\
+                       os.path.join(self.remote_path,'done',job_name)))
+
+
+
+def runSphinx(filename):
+
+    '''
+    Run sphinx for an inputfile, writing its output to a log file next to it.
+
+    @param filename: The inputfile
+    @type filename: string
+
+    @return: The return code of sphinx
+    @rtype: int
+
+    '''
+
+    logfile = open(filename.replace('.inp','.log'),'w')
+    try:
+        return subprocess.call('echo %s | sphinx'%filename,shell=True,\
+                               stdout=logfile,stderr=subprocess.STDOUT)
+    finally:
+        logfile.close()
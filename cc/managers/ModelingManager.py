@@ -8,6 +8,7 @@ Author: R. Lombaert
 """
 
 import os
+import multiprocessing
 
 import cc.path
 from cc.modeling.codes.MCMax import MCMax
@@ -16,6 +17,55 @@ from cc.tools.io import Database
 
 
 
+def initGridWorker(manager,star_grid):
+
+    '''
+    Initialize a worker process for a parallel grid calculation. 
+    
+    The worker processes are forked from the ComboCode session, so the model
+    manager and the grid are inherited rather than pickled.
+    
+    @param manager: The model manager that started the grid calculation
+    @type manager: ModelingManager()
+    @param star_grid: The parameter sets of the grid
+    @type star_grid: list[Star()]
+    
+    '''
+    
+    global grid_worker
+    grid_worker = (manager,star_grid)
+    
+    
+    
+def runGridWorker(star_index):
+
+    '''
+    Run the modeling for one parameter set in a worker process. 
+    
+    @param star_index: The index of the Star() object in the grid
+    @type star_index: int
+    
+    @return: The updated Star() object, and the entries added for it to 
+             mline_done_list, trans_bool_list, mcmax_done_list and 
+             star_grid_old of the model manager in the worker process
+    @rtype: tuple
+    
+    '''
+    
+    manager,star_grid = grid_worker
+    star = star_grid[star_index]
+    #-- Other workers may have added models since the worker was started
+    manager.refreshDatabases()
+    lengths = [len(manager.mline_done_list),len(manager.trans_bool_list),\
+               len(manager.mcmax_done_list)]
+    manager.startModeling(star,star_index)
+    return (star,manager.mline_done_list[lengths[0]:],\
+            manager.trans_bool_list[lengths[1]:],\
+            manager.mcmax_done_list[lengths[2]:],\
+            manager.star_grid_old[star_index])
+
+
+
 class ModelingManager():
     
     """ 
@@ -27,7 +77,8 @@ class ModelingManager():
                  mcmax=0,gastronoom=0,sphinx=0,iterative=0,\
                  num_model_sessions=1,vic_manager=None,replace_db_entry=0,\
                  path_gastronoom='runTest',path_mcmax='runTest',\
-                 skip_cooling=0,recover_sphinxfiles=0):
+                 skip_cooling=0,recover_sphinxfiles=0,num_workers=1,\
+                 num_sphinx_workers=1):
         
         """ 
         Initializing a ModelingManager instance.
@@ -95,6 +146,18 @@ class ModelingManager():
         
                                   (default: 'runTest')
         @type path_gastronoom: string
+        @keyword num_workers: The number of parameter sets that are modeled at 
+                              the same time by startGrid, each in a separate 
+                              process. 
+        
+                              (default: 1)
+        @type num_workers: int
+        @keyword num_sphinx_workers: The number of sphinx runs for the 
+                                     transitions of a model that are executed
+                                     at the same time.
+        
+                                     (default: 1)
+        @type num_sphinx_workers: int
         
         """
         
@@ -115,6 +178,8 @@ class ModelingManager():
         self.path_mcmax = path_mcmax
         self.path_gastronoom = path_gastronoom
         self.recover_sphinxfiles = recover_sphinxfiles
+        self.num_workers = int(num_workers)
+        self.num_sphinx_workers = int(num_sphinx_workers)
         
         #-- Convenience paths
         cc.path.gout = os.path.join(cc.path.gastronoom,self.path_gastronoom)
@@ -151,6 +216,77 @@ class ModelingManager():
         
         
         
+    def refreshDatabases(self):
+        
+        '''
+        Read the changes made to the databases of this grid by other sessions.
+        
+        Changes made in this session that were not yet saved are kept. 
+        
+        '''
+        
+        if self.gastronoom:
+            for db in [self.cool_db,self.ml_db,self.sph_db]:
+                db.refresh()
+        if self.mcmax:
+            self.mcmax_db.refresh()
+        
+        
+        
+    def startGrid(self,star_grid):
+        
+        '''
+        Start the modeling process on all model stars of a grid, with 
+        num_workers parameter sets being modeled at the same time. 
+        
+        Every parameter set is modeled with startModeling() in a worker 
+        process. The workers share the databases on the hard disk, which are
+        locked while they are changed, and new model ids are unique across 
+        processes. A new model is reserved in its database before it is 
+        calculated, so a parameter set that requires a model that is being 
+        calculated by a different worker waits for it to finish instead of 
+        calculating it again (see ModelingSession.isReserved()).
+        
+        The Star() objects in star_grid are replaced by the ones updated in the
+        workers, and the results for every parameter set are added to 
+        mline_done_list, trans_bool_list, mcmax_done_list and star_grid_old in
+        the order of the grid, as with sequential modeling.
+        
+        Not available in combination with Vic or the replace_db_entry option, 
+        both of which keep track of models in the current session only.
+        
+        @param star_grid: The parameter sets
+        @type star_grid: list[Star()]
+        
+        '''
+        
+        if self.vic <> None or self.replace_db_entry:
+            raise ValueError('Parallel modeling is not available with Vic ' + \
+                             'or replace_db_entry.')
+        pool = multiprocessing.Pool(processes=self.num_workers,\
+                                    initializer=initGridWorker,\
+                                    initargs=(self,star_grid))
+        try:
+            results = pool.map(runGridWorker,range(len(star_grid)),\
+                               chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for star_index,result in enumerate(results):
+            star,mline_done,trans_bools,mcmax_done,star_old = result
+            star_grid[star_index] = star
+            self.mline_done_list.extend(mline_done)
+            self.trans_bool_list.extend(trans_bools)
+            self.mcmax_done_list.extend(mcmax_done)
+            self.star_grid_old[star_index] = star_old
+        if self.mline_done_list:
+            self.mline_done = bool(self.mline_done_list[-1])
+        if self.mcmax_done_list:
+            self.mcmax_done = bool(self.mcmax_done_list[-1])
+        self.refreshDatabases()
+        
+        
+        
     def startModeling(self,star,star_index):
         
         """ 
@@ -220,7 +356,8 @@ class ModelingManager():
                                         skip_cooling=self.skip_cooling,\
                                         replace_db_entry=self.replace_db_entry,\
                                         new_entries=self.new_entries_cooling,\
-                                        recover_sphinxfiles=self.recover_sphinxfiles)
+                                        recover_sphinxfiles=self.recover_sphinxfiles,\
+                                        num_sphinx_workers=self.num_sphinx_workers)
                     self.mline_done = False
                 if self.mcmax_done:
                     #-- MCMax was ran successfully, in other words, quite a bit 
@@ -8,17 +8,19 @@ Author: R. Lombaert
 """
 
 import os
+import shutil
 from scipy import log10
 import subprocess
-from time import gmtime, sleep
+from time import sleep
 
 import cc.path
 from cc.tools.io import DataIO
 from cc.modeling.codes import Gastronoom
+from cc.managers.Executor import Executor
 
 
 
-class Vic():
+class Vic(Executor):
     
     """ 
     Creating a vic manager which communicates with the Vic3 supercomputer and
@@ -26,6 +28,8 @@ class Vic():
     
     """
     
+    results_folder = 'vic_results'
+    
     def __init__(self,account,path='code23-01-2010',credits_acc=None,\
                  time_per_sphinx=30,recover_sphinxfiles=0):
         
@@ -61,21 +65,12 @@ class Vic():
 
         """
 
-        self.finished = dict()
-        self.failed = dict()
-        self.models = dict()
-        self.command_lists = dict()
-        self.transitions = dict()
-        self.sphinx_model_ids = dict()
-        self.inputfiles = dict()
-        self.trans_in_progress = [] 
-        self.path = path
+        super(Vic,self).__init__(path=path,\
+                                 recover_sphinxfiles=recover_sphinxfiles)
         self.account = account
         self.disk = account[3:6]
         self.uname = os.path.split(os.path.expanduser('~')+'/'.rstrip('/'))[-1]
         self.time_per_sphinx = float(time_per_sphinx)
-        self.recover_sphinxfiles = recover_sphinxfiles
-        self.current_model = 0
         if not credits_acc:
             self.credits_acc = None
         else:
@@ -96,20 +91,6 @@ class Vic():
                         shell=True)
 
 
-    def setSphinxDb(self,sph_db):
-        
-        '''
-        Set the Sphinx db for this Vic instance.
-        
-        @param sph_db: The sphinx database
-        @type sph_db: Database()
-        
-        '''
-        
-        self.sph_db = sph_db    
-
-   
-    
     def updateLineSpec(self):
         
         '''
@@ -125,132 +106,31 @@ class Vic():
         
 
 
-    def addModel(self,model_id,command_list):
-        
-        '''
-        Add model to the list of to be processed models.
-        
-        Here, dictionaries are initiated to contain information about the
-        modeling session. 
-        
-        Every entry in the dictionaries have an index number associated with 
-        them to uniquely identify a modeling session across the vic manager.
-        
-        Dictionaries are kept for model ids, parameter sets, transitions, 
-        failed calculations and finished calculations, and vic inputfiles for 
-        every transition.
-        
-        The current_model index is the same between a call to the addModel 
-        method and the queueModel() OR the reset methods. Anything between uses
-        the same index. queueModel() will move to the next index value, while
-        reset() will reset the current index number.
-        
-        @param model_id: The cooling model_id
-        @type model_id: string
-        @param command_list: The parameters for this GASTRoNOoM model
-        @type command_list: dict()
-         
-        '''
-        
-        if self.models.has_key(self.current_model):
-            raise Error('Vic().addModel() is trying to add a model_id ' + \
-                        'to a session that was already assigned an id. ' + \
-                        'Reset or queue the previous model first.')
-        self.models[self.current_model] = model_id
-        self.command_lists[self.current_model] = command_list
-        self.transitions[self.current_model] = []
-        self.failed[self.current_model] = []
-        self.finished[self.current_model] = []
-        self.inputfiles[self.current_model] = []
-
-
-
-    def addTransInProgress(self,trans):
-        
-        '''
-        Add a transition to the list of transitions in progress. They will be
-        checked at the end of the VIC run to see if they have been correctly 
-        calculated.
-        
-        This concerns transitions that are requested, but are already present 
-        in the sphinx database with an "IN_PROGRESS" keyword included in the 
-        transition dictionary. These will not be calculated again, instead they 
-        are remembered and checked at the end of the full modeling run.
-        
-        @param trans: The transition calculating on Vic3
-        @type trans: Transition()
-        
-        '''
-        
-        self.trans_in_progress.append(trans)
-        
-
-
-    def addTrans(self,trans):
-        
-        '''
-        Add a transition to the vic transition list.
-        
-        These will be calculated on Vic3 and inputfiles will be prepared for 
-        them.
-        
-        The entries in the transitions dictionary are deleted when the entry 
-        has been completely finished. 
-        
-        @param trans: The transition to be calculated on Vic3
-        @type trans: Transition()
-        
-        '''
-        
-        self.transitions[self.current_model].append(trans)
-                
-
-
-    def queueModel(self):
+    def submit(self,current_model):
         
         '''
         Queue the current model on VIC3, which will cp mline and cooling output 
         file to VIC, run the shell script there, and create the necessary input 
         files.
         
-        Once everything has been started up, the current model index number is 
-        increased by one to allow for a new model to be added. You cannot add a 
-        model and then add another model unless you reset or queue the previous
-        model.
+        Called by queueModel(), after which the current model index number is
+        increased by one to allow for a new model to be added.
         
-        '''
-        
-        self.sphinx_model_ids[self.current_model] \
-            = list(set([trans.getModelId() 
-                        for trans in self.transitions[self.current_model]]))
-        if not self.recover_sphinxfiles:
-            printing = self.makeJobFile()
-            self.makeInputFiles()
-            model_id = self.models[self.current_model]
-            jobfile = os.path.join('/user','leuven',self.disk,self.account,\
-                                   'COCode','vic_run_jobs_%s_%i.sh'\
-                                   %(model_id,self.current_model))
-            subprocess.Popen('ssh %s@login.vic3.cc.kuleuven.be %s'\
-                             %(self.account,jobfile),shell=True,\
-                             stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
-            if printing: print '\n'.join(printing)
-        self.current_model += 1
-
-
-  
-    def reset(self):
+        @param current_model: The queue number of the model
+        @type current_model: int
         
         '''
-        If a model has been added, and no transitions were required to be 
-        calculated, remove that model entry here.
         
-        This only removes the self.models and self.transitions entries. The 
-        other dictionaries are re-initiated anyway when adding a model. 
-       
-        '''
-        
-        del self.models[self.current_model]
-        del self.transitions[self.current_model]
+        printing = self.makeJobFile()
+        self.makeVicInputFiles()
+        model_id = self.models[current_model]
+        jobfile = os.path.join('/user','leuven',self.disk,self.account,\
+                               'COCode','vic_run_jobs_%s_%i.sh'\
+                               %(model_id,current_model))
+        subprocess.Popen('ssh %s@login.vic3.cc.kuleuven.be %s'\
+                         %(self.account,jobfile),shell=True,\
+                         stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        if printing: print '\n'.join(printing)
         
 
 
@@ -341,10 +221,10 @@ class Vic():
             to_be_copied.extend(['ml*_%s.dat'%molec 
                                  for molec in these_molecules 
                                  if molec != 'sampling'])
-            for filecopy in to_be_copied:
-                subprocess.call(['scp %s %s:%s.'\
-                                 %(os.path.join(local_folder,filecopy),\
-                                   vic_server,vic_folder)], shell=True)
+            subprocess.call(['scp %s %s:%s.'\
+                             %(' '.join([os.path.join(local_folder,filecopy)
+                                         for filecopy in to_be_copied]),\
+                               vic_server,vic_folder)], shell=True)
             
             #- number of nodes*number of cpus=amount of times to queue it
             printing.append('Running %i jobs with %i models each for ID %s.' \
@@ -397,7 +277,7 @@ class Vic():
                 
   
 
-    def makeInputFiles(self):
+    def makeVicInputFiles(self):
         
         '''
         Make the input files with just one line request in each.
@@ -448,15 +328,9 @@ class Vic():
                        %(self.disk,self.account)
                 molec_dict = trans.molecule.makeDict(path)
                 starfiles.append(molec_dict.pop('STARFILE',''))
-                commandfile = \
-                     ['%s=%s'%(k,v) 
-                      for k,v in sorted(actual_command_list.items()) 
-                      if k != 'R_POINTS_MASS_LOSS'] + ['####'] + \
-                     ['%s=%s'%(k,v) 
-                      for k,v in sorted(molec_dict.items())] + ['####'] + \
-                     ['%s=%s'%(k,v) 
-                      for k,v in sorted(trans.makeDict().items())] + \
-                     ['######']
+                commandfile = Gastronoom.makeSphinxCommands(\
+                                        actual_command_list,molec_dict,\
+                                        trans.makeDict())
                 for key,fkey in zip(['ENHANCE_ABUNDANCE_FACTOR',     
                                      'SET_KEYWORD_CHANGE_ABUNDANCE',
                                      'SET_KEYWORD_CHANGE_TEMPERATURE'],\
@@ -467,11 +341,6 @@ class Vic():
                           custom_files.append((getattr(trans.molecule,\
                                                        fkey.lower()),\
                                                molec_dict[fkey].strip('"')))
-                if actual_command_list.has_key('R_POINTS_MASS_LOSS'):
-                    commandfile.extend(['%s=%s'%('R_POINTS_MASS_LOSS',v) 
-                                        for v in actual_command_list\
-                                                 ['R_POINTS_MASS_LOSS']] + \
-                                       ['####'])
                 infile = '_'.join(['gastronoom',trans.getModelId(),\
                                    '%i.inp'%(i+1)])
                 DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
@@ -502,11 +371,13 @@ class Vic():
             opacity_files = [f 
                              for f in set(opacity_files)
                              if f != 'temdust.kappa']
-            for filename in opacity_files:
-                full_path = os.path.join(cc.path.gdata,filename)
+            if opacity_files:
+                full_paths = [os.path.join(cc.path.gdata,filename)
+                              for filename in opacity_files]
                 full_path_vic = '/user/leuven/'+self.disk+'/'+self.account + \
                                 '/COCode/data/.'
-                subprocess.call(['scp ' + full_path + ' ' + self.account + \
+                subprocess.call(['scp ' + ' '.join(full_paths) + ' ' + \
+                                 self.account + \
                                  '@login.vic3.cc.kuleuven.be:'+full_path_vic],\
                                 shell=True)
             for filename,vicfile in set(custom_files):
@@ -545,55 +416,23 @@ class Vic():
         
         '''
         
-        for trans in self.trans_in_progress:
-            filename = os.path.join(cc.path.gastronoom,\
-                                    self.path,'models',trans.getModelId(),\
-                                    trans.makeSphinxFilename(2))
-            if not os.path.isfile(filename):              
-                trans.setModelId('') 
-        if self.models.keys():
-            time_stamp = '%.4i-%.2i-%.2ih%.2i:%.2i:%.2i' \
-                         %(gmtime()[0],gmtime()[1],gmtime()[2],\
-                           gmtime()[3],gmtime()[4],gmtime()[5])
-            results = ['# Successfully calculated models:'] \
-                    + [self.models[current_model] 
-                       for current_model in self.models.keys() 
-                       if current_model not in self.failed.keys()] \
-                    + ['# Unsuccessfully calculated models (see 3 logfiles '+ \
-                       'for these models):'] \
-                    + [self.models[current_model] 
-                       for current_model in self.models.keys() 
-                       if current_model in self.failed.keys()]
-            DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
-                                          'vic_results','log_' + time_stamp),\
-                             results)
-            for current_model,model_id in self.models.items():
-                model_results = ['# Successfully calculated transitions:'] + \
-                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans)) 
-                     for trans in self.finished[current_model]] + \
-                    ['# Unsuccessfully calculated transitions (see 2 other ' + \
-                     'logfiles for these transitions):'] + \
-                    ['Sphinx %s: %s' %(trans.getModelId(),str(trans)) 
-                     for trans in self.failed[current_model]]
-                DataIO.writeFile(os.path.join(cc.path.gastronoom,self.path,\
-                                              'vic_results','log_results%s_%i'\
-                                              %(time_stamp,current_model)),\
-                                 model_results)
-                for this_id in self.sphinx_model_ids[current_model]:
-                    sphinx_files = os.path.join(cc.path.gastronoom,self.path,\
-                                                'models',this_id,'sph*')
-                    subprocess.call(['chmod a+r %s'%sphinx_files],shell=True)
+        super(Vic,self).finalizeVic()
+        for current_model in self.models.keys():
+            for this_id in self.sphinx_model_ids[current_model]:
+                sphinx_files = os.path.join(cc.path.gastronoom,self.path,\
+                                            'models',this_id,'sph*')
+                subprocess.call(['chmod a+r %s'%sphinx_files],shell=True)
         
 
 
     def checkProgress(self,wait_qstat=0):
         
         '''
-        Checks progress on all queued model_ids by checking if the output has 
-        been copied to the local disk from VIC3.
+        Checks progress on all queued model_ids, and copies the output of the 
+        finished ones from VIC3 to the local disk.
         
         In this method, the self.failed and self.finished keywords are updated,
-        and the self.inputfiles and self.transitions is cleaned up on the go.
+        and the self.transitions is cleaned up on the go.
         
         @keyword wait_qstat: wait 10 seconds before checking the qstat query on
                              vic, in order to make sure that the qeueu command 
@@ -605,114 +444,139 @@ class Vic():
                              (default: 0)
         @type wait_qstat: bool
         
-        @return: Have all models been finished on Vic3? 
+        @return: Are models still in progress on Vic3? 
         @rtype: bool
         
         '''
         
-        #- iteration op self.transitions, not self.models since the latter is 
-        #- not updated as progress is checked...
-        for current_model in self.transitions.keys():     
-            model_id = self.models[current_model]
-            print 'Currently checking %s...' %model_id
-            lsprocess = subprocess.Popen('ssh %s@login.vic3.cc.kuleuven.be '\
-                                         %self.account + \
-                                         'ls /data/leuven/%s/%s/COCode/%s_%i/'\
-                                         %(self.disk,self.account,model_id,\
-                                           current_model),\
-                                         shell=True,stdout=subprocess.PIPE)
-            lsfile = lsprocess.communicate()[0].split('\n')
-            lsfile = [f 
-                      for f in lsfile 
-                      if f[-9:] != '.inp.done' and f != 'jobs.log' and f]
-            if wait_qstat:
-                sleep(10)    
-            qstatprocess = subprocess.Popen(\
-                    'ssh %s@login.vic3.cc.kuleuven.be qstat | grep %s'\
-                    %(self.account,self.account),shell=True,\
-                    stdout=subprocess.PIPE)
-            qstatfile = qstatprocess.communicate()[0].split('\n')
-            if not lsfile or qstatfile == ['']:
-                for model_id_sphinx in self.sphinx_model_ids[current_model]:
-                    trans_strings = [trans.makeSphinxFilename() 
-                                     for trans in self.transitions\
-                                                        [current_model]
-                                     if trans.getModelId() == model_id_sphinx]
-                    heresph = os.path.join(cc.path.gastronoom,self.path,\
-                                           'models',model_id_sphinx)
-                    for trans_string in trans_strings:
-                        vicsph = '/data/leuven/%s/%s/COCode/output/%s/%s'\
-                                 %(self.disk,self.account,model_id_sphinx,\
-                                   trans_string)
-                        subprocess.call('scp %s@login.vic3.cc.kuleuven.be:%s '\
-                                        %(self.account,vicsph)+'%s/.'%heresph,\
-                                        shell=True,stdout=subprocess.PIPE,\
-                                        stderr=subprocess.PIPE)
-                    vicjob = '/data/leuven/%s/%s/COCode/%s_%i/jobs.log'\
-                             %(self.disk,self.account,model_id,current_model)
-                    subprocess.call('scp %s@login.vic3.cc.kuleuven.be:%s '\
-                                    %(self.account,vicjob) + \
-                                    '%s/log_vic_jobs'%(heresph),\
-                                    shell=True,stdout=subprocess.PIPE)
-                    gas_session = Gastronoom.Gastronoom(\
-                                        path_gastronoom=self.path,\
-                                        sph_db=self.sph_db)
-                    gas_session.model_id = model_id
-                    gas_session.trans_list \
-                        = [trans 
-                           for trans in self.transitions[current_model] 
-                           if trans.getModelId() == model_id_sphinx]
-                    for trans in gas_session.trans_list:
-                        gas_session.checkSphinxOutput(trans)
-                    gas_session.finalizeSphinx()
-                    self.finished[current_model] \
-                        = [trans 
-                           for trans in gas_session.trans_list 
-                           if trans.getModelId()]
-                    self.failed[current_model] \
-                        = [trans 
-                           for trans in gas_session.trans_list 
-                           if not trans.getModelId()]
-                    vicjob = '/user/leuven/%s/%s/COCode/vic_job_%s.sh*'\
-                             %(self.disk,self.account,model_id_sphinx)
-                    subprocess.call(['ssh %s@login.vic3.cc.kuleuven.be rm %s'\
-                                     %(self.account,vicjob)],shell=True)
-                del self.transitions[current_model]
-                while self.inputfiles[current_model]:
-                    subprocess.call([' '.join(\
-                        ['ssh','%s@login.vic3.cc.kuleuven.be'%self.account,\
-                         'rm'] + \
-                        [self.inputfiles[current_model].pop() 
-                         for i in range(len(self.inputfiles[current_model]) \
-                                                < 100\
-                                            and len(self.inputfiles\
-                                                        [current_model])\
-                                            or 100)])],\
-                                    shell=True,stdout=subprocess.PIPE)
-                vicjobfile = '/user/leuven/%s/%s/COCode/vic_run_jobs_%s_%i.sh'\
-                             %(self.disk,self.account,model_id,current_model)
-                subprocess.call(['ssh %s@login.vic3.cc.kuleuven.be rm %s'\
-                                 %(self.account,vicjobfile)],shell=True)
-        self.sph_db.sync()
-        if self.transitions:
-            return True
-        else:
-            return False
-
-    
-      
-    def getQueue(self):
+        if wait_qstat:
+            sleep(10)
+        return super(Vic,self).checkProgress()
+        
+        
+        
+    def execute(self,command,stdin=None,stdout=None):
+        
+        '''
+        Run a shell command on VIC3 through ssh, and wait for it to finish.
+        
+        @param command: The command
+        @type command: string
+        
+        @keyword stdin: Passed on to subprocess.Popen
+        
+                        (default: None)
+        @type stdin: file
+        @keyword stdout: Passed on to subprocess.Popen
+        
+                         (default: None)
+        @type stdout: file
+        
+        @return: The output of the command, if stdout is subprocess.PIPE
+        @rtype: string
+        
+        '''
+        
+        process = subprocess.Popen(['ssh','%s@login.vic3.cc.kuleuven.be'\
+                                          %self.account,command],\
+                                   stdin=stdin,stdout=stdout)
+        return process.communicate()[0]
+        
+        
+        
+    def getFinished(self):
+        
+        '''
+        Return the queued models that are finished on VIC3.
+        
+        A model is finished when its folder on VIC3 only holds finished 
+        inputfiles and the job log, or when the queue on VIC3 is empty. Both 
+        are checked for all models with a single ssh command.
+        
+        @return: The queue numbers of the finished models
+        @rtype: list[int]
+        
+        '''
+        
+        folders = dict([('%s_%i'%(model_id,k),k) 
+                        for k,model_id in self.getQueue()])
+        if not folders:
+            return []
+        command = 'qstat | grep -c %s; cd /data/leuven/%s/%s/COCode; '\
+                  %(self.account,self.disk,self.account) + \
+                  'for d in %s; do echo $d $(ls $d 2> /dev/null '\
+                  %' '.join(folders.keys()) + \
+                  '| grep -v -e "\\.inp\\.done$" -e "^jobs\\.log$" '+\
+                  '| wc -l); done'
+        output = self.execute(command,stdout=subprocess.PIPE).split('\n')
+        try:
+            queue_empty = not int(output[0])
+        except ValueError:
+            queue_empty = False
+        finished = [folders[line.split()[0]]
+                    for line in output[1:]
+                    if len(line.split()) == 2 \
+                        and folders.has_key(line.split()[0]) \
+                        and (queue_empty or line.split()[1] == '0')]
+        return sorted(finished)
+        
+        
+        
+    def fetch(self,current_model):
+        
+        '''
+        Copy the sphinx output and the job log of a finished model from VIC3 to
+        the local disk, as a single archive.
+        
+        The job log is copied to the folder of every sphinx model id as 
+        log_vic_jobs.
+        
+        @param current_model: The queue number of the model
+        @type current_model: int
+        
+        '''
+        
+        models = os.path.join(cc.path.gastronoom,self.path,'models')
+        folder = '%s_%i'%(self.models[current_model],current_model)
+        members = ['%s/%s'%(trans.getModelId(),trans.makeSphinxFilename())
+                   for trans in self.transitions[current_model]]
+        tar = subprocess.Popen(['tar','-xf','-','-C',models],\
+                               stdin=subprocess.PIPE)
+        self.execute('cd /data/leuven/%s/%s/COCode/output && '\
+                     %(self.disk,self.account) + \
+                     'tar -cf - %s -C ../%s jobs.log 2> /dev/null'\
+                     %(' '.join(members),folder),\
+                     stdout=tar.stdin)
+        tar.stdin.close()
+        tar.wait()
+        joblog = os.path.join(models,'jobs.log')
+        if os.path.isfile(joblog):
+            for model_id_sphinx in self.sphinx_model_ids[current_model]:
+                shutil.copyfile(joblog,os.path.join(models,model_id_sphinx,\
+                                                    'log_vic_jobs'))
+            os.remove(joblog)
+        
+        
+        
+    def clean(self,current_model):
         
         '''
-        Get a list of unique queue number + cooling model_id for those models
-        that are still in progress on VIC.
+        Remove the inputfiles and job files of a finished model on VIC3, in a 
+        single ssh command.
         
-        @return: The queue numbers and model_ids still in progress.
-        @rtype: list[(int,string)]
+        @param current_model: The queue number of the model
+        @type current_model: int
         
         '''
         
-        return [(k,v) 
-                for k,v in self.models.items() 
-                if self.transitions.has_key(k)]
-                
\ No newline at end of file
+        model_id = self.models[current_model]
+        user_folder = '/user/leuven/%s/%s/COCode'%(self.disk,self.account)
+        files = [os.path.join('/data','leuven',self.disk,self.account,\
+                              'COCode','%s_%i'%(model_id,current_model),\
+                              'gastronoom_*')] + \
+                [os.path.join(user_folder,'vic_job_%s.sh*'%model_id_sphinx)
+                 for model_id_sphinx in self.sphinx_model_ids[current_model]]+\
+                [os.path.join(user_folder,'vic_run_jobs_%s_%i.sh'\
+                                          %(model_id,current_model))]
+        self.execute('rm -f %s'%' '.join(files),stdout=subprocess.PIPE)
+        self.inputfiles[current_model] = []
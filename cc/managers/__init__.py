@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["ModelingManager","PlottingManager","Vic"]
+__all__ = ["ModelingManager","PlottingManager","Vic","Executor"]
@@ -8,7 +8,10 @@ Author: R. Lombaert
 """
 
 import os
-from time import gmtime
+import fcntl
+import errno
+import socket
+from time import gmtime, time
 import types
 
 import cc.path
@@ -22,6 +25,10 @@ class ModelingSession(object):
     The basic modeling environment. Inherited by MCMax() and Gastronoom().
     
     """
+    
+    #-- Seconds between two checks of a model that is being calculated in a
+    #   different session
+    wait_interval = 10
       
     def __init__(self,code,path,replace_db_entry=0,new_entries=[]):
         
@@ -54,6 +61,9 @@ class ModelingSession(object):
         self.model_id = ''
         self.replace_db_entry = replace_db_entry
         self.new_entries = new_entries
+        #-- Abundance parameters ignored for mline when ignoreAbun is requested
+        self.abun_keywords = ['ABUN_MOLEC','ABUN_MOLEC_RINNER',\
+                              'ABUN_MOLEC_RE','RMAX_MOLEC']
         mutablefile = os.path.join(cc.path.aux,\
                                    'Mutable_Parameters_%s.dat'%code)
         self.mutable = [line[0] 
@@ -62,6 +72,10 @@ class ModelingSession(object):
         self.mutable = [line for line in self.mutable if line[0] != '#']
         fout = os.path.join(getattr(cc.path,self.code.lower()),self.path)
         DataIO.testFolderExistence(os.path.join(fout,'models'))
+        #-- Keeps the last model_id given out in the output folder
+        self.id_file = os.path.join(fout,'model_ids.lock')
+        #-- Locked while the databases are checked and models are reserved
+        self.db_lock_file = os.path.join(fout,'databases.lock')
         
 
 
@@ -70,11 +84,125 @@ class ModelingSession(object):
         '''
         Make a new model_id based on the current UTC in seconds since 1970.
         
+        The last model_id given out in the output folder is kept in the file 
+        model_ids.lock, which is locked while a new model_id is made. If the 
+        current time does not give a later model_id, eg when sessions running 
+        in parallel ask for one in the same second, the time is moved forward 
+        by a second until it does. Every model_id is thus given out only once.
+        
+        @return: The new model_id
+        @rtype: string
+        
+        '''
+        
+        idfile = os.open(self.id_file,os.O_RDWR|os.O_CREAT)
+        try:
+            fcntl.flock(idfile,fcntl.LOCK_EX)
+            last_id = os.read(idfile,64).strip()
+            now = time()
+            model_id = 'model_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'%gmtime(now)[:6]
+            while model_id <= last_id:
+                now += 1
+                model_id = 'model_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i'\
+                           %gmtime(now)[:6]
+            os.lseek(idfile,0,os.SEEK_SET)
+            os.ftruncate(idfile,0)
+            os.write(idfile,model_id)
+        finally:
+            #-- Closing the file releases the lock
+            os.close(idfile)
+        return model_id
+                  
+                  
+                  
+    def lockDatabases(self):
+        
+        '''
+        Acquire an exclusive lock for checking the databases in the output 
+        folder and reserving new models in them.
+        
+        The lock is set on the file databases.lock in the output folder. Only 
+        one session at a time checks the databases, so two sessions never 
+        reserve the same model under different model_ids. The call blocks 
+        until the lock is granted.
+        
+        @return: The open lock file, to be passed to unlockDatabases()
+        @rtype: file
+        
+        '''
+        
+        lockfile = open(self.db_lock_file,'a')
+        fcntl.flock(lockfile.fileno(),fcntl.LOCK_EX)
+        return lockfile
+        
+        
+        
+    def unlockDatabases(self,lockfile):
+        
+        '''
+        Release the lock acquired with lockDatabases().
+        
+        @param lockfile: The lock file returned by lockDatabases()
+        @type lockfile: file
+        
         '''
         
-        return 'model_%.4i-%.2i-%.2ih%.2i-%.2i-%.2i' \
-                %(gmtime()[0],gmtime()[1],gmtime()[2],\
-                  gmtime()[3],gmtime()[4],gmtime()[5])
+        fcntl.flock(lockfile.fileno(),fcntl.LOCK_UN)
+        lockfile.close()
+        
+        
+        
+    def makeReservation(self):
+        
+        '''
+        Return the value of the IN_PROGRESS key in a database entry reserved by
+        this session, ie the host name and the process id of this session.
+        
+        The entry is added to the database before the model is calculated, so 
+        other sessions that require the same model wait for it to finish. 
+        
+        @return: The IN_PROGRESS value
+        @rtype: string
+        
+        '''
+        
+        return '%s:%i'%(socket.gethostname(),os.getpid())
+        
+        
+        
+    def isReserved(self,entry):
+        
+        '''
+        Check if a database entry is reserved by a different session that is 
+        still calculating the model.
+        
+        A reservation is no longer valid if it was made by a session on this 
+        host that is not running anymore, or by this session itself. The 
+        IN_PROGRESS value set by older versions of ComboCode does not identify
+        a session, and is never valid. Sessions on a different host are 
+        assumed to be running.
+        
+        @param entry: The database entry
+        @type entry: dict
+        
+        @return: Is the entry reserved by a different running session?
+        @rtype: bool
+        
+        '''
+        
+        marker = entry.get('IN_PROGRESS')
+        if type(marker) is not types.StringType or ':' not in marker:
+            return False
+        host,pid = marker.rsplit(':',1)
+        if host <> socket.gethostname():
+            return True
+        if int(pid) == os.getpid():
+            return False
+        try:
+            os.kill(int(pid),0)
+        except OSError,e:
+            return e.errno == errno.EPERM
+        return True
                   
                   
                   
@@ -180,13 +308,13 @@ class ModelingSession(object):
             keywords = set(this_list.keys()+modellist.keys())
             if 'dust_species' in keywords:
                 keywords.remove('dust_species')
+            keywords.discard('IN_PROGRESS')
         else:
             keywords = getattr(self,code + '_keywords')
         if code == 'mline' and ignoreAbun:
             keywords = [key 
                         for key in keywords 
-                        if key not in ['ABUN_MOLEC','ABUN_MOLEC_RINNER',\
-                                       'ABUN_MOLEC_RE','RMAX_MOLEC']]        
+                        if key not in self.abun_keywords]
         for keyword in keywords:
             if keyword == 'STEP_RS_RIN':
                 if this_list.has_key(keyword) \
@@ -11,16 +11,52 @@ import os
 import cPickle 
 from glob import glob
 import subprocess      
+from multiprocessing.pool import ThreadPool
+from time import sleep
 from scipy import array
 
 import cc.path
 from cc.tools.io import DataIO
 from cc.tools.io import Atmosphere
+from cc.tools.io import DatabaseIndex
 from cc.modeling.ModelingSession import ModelingSession
 from cc.modeling.objects.Molecule import Molecule
 
 
 
+def makeSphinxCommands(command_list,molec_dict,trans_dict):
+    
+    '''
+    Make the lines of a sphinx inputfile.
+    
+    @param command_list: The GASTRoNOoM parameters, with the model_id of the 
+                         transition set in the output keywords
+    @type command_list: dict
+    @param molec_dict: The molecule parameters
+    @type molec_dict: dict
+    @param trans_dict: The transition parameters
+    @type trans_dict: dict
+    
+    @return: The lines of the inputfile
+    @rtype: list[string]
+    
+    '''
+    
+    commandfile = ['%s=%s'%(k,v) 
+                   for k,v in sorted(command_list.items()) 
+                   if k != 'R_POINTS_MASS_LOSS'] + ['####'] + \
+                  ['%s=%s'%(k,v) for k,v in sorted(molec_dict.items())] + \
+                  ['####'] + \
+                  ['%s=%s'%(k,v) for k,v in sorted(trans_dict.items())] + \
+                  ['######']
+    if command_list.has_key('R_POINTS_MASS_LOSS'):
+        commandfile.extend(['%s=%s'%('R_POINTS_MASS_LOSS',v) 
+                            for v in command_list['R_POINTS_MASS_LOSS']] + \
+                           ['####'])
+    return commandfile
+    
+    
+
 class Gastronoom(ModelingSession):
     
     """ 
@@ -31,7 +67,7 @@ class Gastronoom(ModelingSession):
     def __init__(self,path_gastronoom='runTest',vic=None,sphinx=0,\
                  replace_db_entry=0,cool_db=None,ml_db=None,sph_db=None,\
                  skip_cooling=0,recover_sphinxfiles=0,\
-                 new_entries=[]):
+                 new_entries=[],num_sphinx_workers=1):
     
         """ 
         Initializing an instance of a GASTRoNOoM modeling session.
@@ -89,6 +125,13 @@ class Gastronoom(ModelingSession):
         
                          (default: None)
         @type sph_db: Database()
+        @keyword num_sphinx_workers: The maximum number of sphinx runs for the
+                                     transitions of a model that are executed
+                                     at the same time on this machine. Not 
+                                     used when sphinx is run through vic.
+        
+                                     (default: 1)
+        @type num_sphinx_workers: int
         
         """
         
@@ -134,6 +177,7 @@ class Gastronoom(ModelingSession):
         self.cool_db = cool_db
         self.ml_db = ml_db
         self.sph_db = sph_db
+        self.num_sphinx_workers = int(num_sphinx_workers)
         #self.pacs_db = pacs_db
         
 
@@ -256,6 +300,16 @@ class Gastronoom(ModelingSession):
         """
         Checking cooling database.
         
+        Only the models returned by the parameter index of the database are 
+        compared, in sorted order.
+        
+        The database is checked while holding the lock of lockDatabases(). If 
+        no match is found, the model_id of this session is reserved in the 
+        database right away, with an IN_PROGRESS key. If the match is reserved
+        by a different session that is still calculating it, the database is 
+        checked again once every ModelingSession.wait_interval seconds until it
+        is finished. A reservation of a session that stopped is removed.
+        
         @param molec_dict: molecule info for this cooling model, ie CO and H2O
         @type molec_dict: dict()
         
@@ -264,24 +318,56 @@ class Gastronoom(ModelingSession):
         
         """
         
-        for model_id,cool_dict in sorted(self.cool_db.items()):
-            model_bool = self.compareCommandLists(self.command_list.copy(),\
-                                                  cool_dict,'cooling',\
-                                                  extra_dict=molec_dict)
-            if model_bool:
-                if self.replace_db_entry \
+        cool_index = DatabaseIndex.getIndex(self.cool_db,'cooling',\
+                                            keywords=self.cooling_keywords)
+        query = self.command_list.copy()
+        query.update(molec_dict)
+        waiting = ''
+        while True:
+            lockfile = self.lockDatabases()
+            try:
+                self.cool_db.refresh()
+                model_id = ''
+                for (db_id,) in cool_index.lookup(query):
+                    if self.compareCommandLists(self.command_list.copy(),\
+                                                self.cool_db[db_id],'cooling',\
+                                                extra_dict=molec_dict):
+                        model_id = db_id
+                        break
+                if model_id and self.cool_db[model_id].has_key('IN_PROGRESS')\
+                        and not self.isReserved(self.cool_db[model_id]):
+                    print 'Removing cooling database entry for ID %s, '\
+                          %model_id + \
+                          'which was not finished by its session.'
+                    del self.cool_db[model_id]
+                    model_id = ''
+                elif model_id and self.replace_db_entry \
                         and model_id not in self.new_entries: 
                     self.deleteCoolingId(model_id)
+                    model_id = ''
+                if not model_id:
+                    print 'No match found in GASTRoNOoM cooling database. ' + \
+                          'Calculating new model.'
+                    self.cool_db[self.model_id] = molec_dict.copy()
+                    self.cool_db[self.model_id].update(self.command_list)
+                    self.cool_db[self.model_id]['IN_PROGRESS'] = \
+                            self.makeReservation()
+                    self.cool_db.sync()
                     return False
-                else:
+                if not self.cool_db[model_id].has_key('IN_PROGRESS'):
                     print 'GASTRoNOoM cooling model has been calculated ' + \
                           'before with ID %s.'%model_id
                     self.model_id = model_id
                     self.updateModel()
                     return True
-        print 'No match found in GASTRoNOoM cooling database. Calculating ' + \
-              'new model.'
-        return False
+            finally:
+                self.unlockDatabases(lockfile)
+            if model_id <> waiting:
+                print 'GASTRoNOoM cooling model is currently being ' + \
+                      'calculated in a different CC modeling session ' + \
+                      'with ID %s. Waiting for it to finish.'%model_id
+                waiting = model_id
+            sleep(self.wait_interval)
 
 
 
@@ -290,6 +376,145 @@ class Gastronoom(ModelingSession):
         """
         Check mline database.
         
+        The database is checked while holding the lock of lockDatabases(). The
+        mline models that are not found are reserved in the database right 
+        away, with an IN_PROGRESS key. If a match is reserved by a different 
+        session that is still calculating it, the database is checked again 
+        once every ModelingSession.wait_interval seconds until it is finished.
+        A reservation of a session that stopped is removed.
+        
+        @return: The presence of mline models in the database, equivalent with 
+                 self.molec_list
+        @rtype: list[bool]
+        
+        """
+        
+        waiting = ()
+        while True:
+            lockfile = self.lockDatabases()
+            try:
+                self.ml_db.refresh()
+                reserved = self.__findReservedMline()
+                if not reserved:
+                    model_bools = self.__reserveMline()
+                    self.ml_db.sync()
+                    return model_bools
+            finally:
+                self.unlockDatabases(lockfile)
+            if reserved <> waiting:
+                print 'Mline model for %s is currently being calculated '\
+                      %reserved[0] + \
+                      'in a different CC modeling session with ID %s. '\
+                      %reserved[1] + \
+                      'Waiting for it to finish.'
+                waiting = reserved
+            sleep(self.wait_interval)
+            
+            
+            
+    def __matchMline(self,molec):
+        
+        """
+        Find the mline models in the database that match a molecule, for the 
+        cooling model_id of this session.
+        
+        @param molec: The molecule
+        @type molec: Molecule()
+        
+        @return: The mline ids of the matching models, in sorted order
+        @rtype: list[string]
+        
+        """
+        
+        #-- The index depends on which keywords are compared
+        if molec.molecule in self.no_ab_molecs:
+            ml_index = DatabaseIndex.getIndex(self.ml_db,'mline_noabun',\
+                keywords=[k 
+                          for k in self.mline_keywords 
+                          if k not in self.abun_keywords],\
+                depth=3,group=[0,2])
+        else:
+            ml_index = DatabaseIndex.getIndex(self.ml_db,'mline',\
+                                              keywords=self.mline_keywords,\
+                                              depth=3,group=[0,2])
+        ml_dict = self.ml_db[self.model_id]
+        return [molec_id
+                for (cool_id,molec_id,molecule) \
+                    in ml_index.lookup(molec.makeDict(),\
+                                       group=(self.model_id,molec.molecule))
+                if self.compareCommandLists(this_list=molec.makeDict(),\
+                                            modellist=ml_dict[molec_id]\
+                                                             [molec.molecule],\
+                                            code='mline',\
+                                            ignoreAbun=molec.molecule \
+                                                        in self.no_ab_molecs)]
+        
+        
+        
+    def __findReservedMline(self):
+        
+        """
+        Find a molecule for which the only matching mline models in the 
+        database are reserved by a different session that is still calculating
+        them. 
+        
+        Reservations of sessions that stopped are removed from the database in
+        memory.
+        
+        @return: The molecule and the mline id of the reserved model, empty if
+                 no molecule has to wait for a reserved model
+        @rtype: tuple
+        
+        """
+        
+        if not self.ml_db.has_key(self.model_id):
+            return ()
+        for molec in self.molec_list:
+            reserved = ()
+            for molec_id in self.__matchMline(molec):
+                entry = self.ml_db[self.model_id][molec_id][molec.molecule]
+                if not entry.has_key('IN_PROGRESS'):
+                    reserved = ()
+                    break
+                elif self.isReserved(entry):
+                    if not reserved:
+                        reserved = (molec.molecule,molec_id)
+                else:
+                    print 'Removing mline database entry for %s with ID %s, '\
+                          %(molec.molecule,molec_id) + \
+                          'which was not finished by its session.'
+                    del self.ml_db[self.model_id][molec_id][molec.molecule]
+                    self.ml_db.addChangedKey(self.model_id)
+            if reserved:
+                return reserved
+        return ()
+        
+        
+        
+    def __reserveMolecule(self,molec):
+        
+        """
+        Reserve the mline model of a molecule in the database in memory, with 
+        an IN_PROGRESS key. 
+        
+        @param molec: The molecule, with the new mline id already set
+        @type molec: Molecule()
+        
+        """
+        
+        entry = molec.makeDict()
+        entry['IN_PROGRESS'] = self.makeReservation()
+        self.ml_db[self.model_id][molec.getModelId()][molec.molecule] = entry
+        self.ml_db.addChangedKey(self.model_id)
+        
+        
+        
+    def __reserveMline(self):
+        
+        """
+        Retrieve the mline models from the database, and reserve the ones that
+        are not present. Called by checkMlineDatabase.
+        
         @return: The presence of mline models in the database, equivalent with 
                  self.molec_list
         @rtype: list[bool]
@@ -297,27 +522,25 @@ class Gastronoom(ModelingSession):
         """
         
         if not self.ml_db.has_key(self.model_id):
-            [molec.setModelId(self.model_id) for molec in self.molec_list]
             self.ml_db[self.model_id] = dict([(self.model_id,dict())])
+            for molec in self.molec_list:
+                molec.setModelId(self.model_id)
+                self.__reserveMolecule(molec)
             return [False]*len(self.molec_list)
         model_bools = []
         new_molec_id = ''
         for molec in self.molec_list:
-            for molec_id in [k for k,v in sorted(self.ml_db[self.model_id].items())
-                               if molec.molecule in v.keys()]:
-                if self.compareCommandLists(this_list=molec.makeDict(),\
-                                         modellist=self.ml_db[self.model_id]\
-                                                             [molec_id]\
-                                                             [molec.molecule],\
-                                            code='mline',\
-                                            ignoreAbun=molec.molecule \
-                                                        in self.no_ab_molecs):
-                    molec.setModelId(molec_id)
-                    model_bools.append(True)
-                    print 'Mline model has been calculated before for %s'\
-                           %molec.molecule + \
-                           ' with ID %s.'%(molec.getModelId())         
-                    break
+            for molec_id in [k 
+                             for k in self.__matchMline(molec)
+                             if not self.ml_db[self.model_id][k]\
+                                              [molec.molecule]\
+                                              .has_key('IN_PROGRESS')]:
+                molec.setModelId(molec_id)
+                model_bools.append(True)
+                print 'Mline model has been calculated before for %s'\
+                       %molec.molecule + \
+                       ' with ID %s.'%(molec.getModelId())         
+                break
             if molec.getModelId() is None:
                 model_bools.append(False)
                 [molec.setModelId(k) 
@@ -331,9 +554,8 @@ class Gastronoom(ModelingSession):
                         self.makeIdLog(new_id=new_molec_id)
                         self.copyOutput(molec,self.model_id,new_molec_id)
                         self.ml_db[self.model_id][new_molec_id] = dict()
-                        self.ml_db.addChangedKey(self.model_id)
-                        self.ml_db.sync()
                     molec.setModelId(new_molec_id)    
+                self.__reserveMolecule(molec)
                 print 'Mline model for %s '%molec.molecule + \
                       'has not been calculated before. Calculate anew with '+ \
                       'ID %s.'%(molec.getModelId())
@@ -349,8 +571,35 @@ class Gastronoom(ModelingSession):
         The presence of the sphinx models in the database is saved in 
         self.trans_bools, equivalent to self.trans_list
         
+        The database is checked while holding the lock of lockDatabases(), and
+        the transitions that are not found are reserved in the database right 
+        away, with an IN_PROGRESS key. Transitions that are reserved by a 
+        different session are waited for in finalizeSphinx(). Unless sphinx is
+        run through vic, a reservation of a session that stopped is removed.
+        
+        """
+        
+        lockfile = self.lockDatabases()
+        try:
+            self.sph_db.refresh()
+            self.__reserveSphinx()
+            #-- Reserve the new transitions in the database in one go
+            self.sph_db.sync()
+        finally:
+            self.unlockDatabases(lockfile)
+        
+        
+        
+    def __reserveSphinx(self):
+        
         """
+        Retrieve the sphinx models from the database, and reserve the ones that
+        are not present in the database in memory. Called by 
+        checkSphinxDatabase.
         
+        """
+        
+        reservation = self.makeReservation()
         if not self.sph_db.has_key(self.model_id):
             self.sph_db[self.model_id] = dict()
         new_trans_id = ''
@@ -364,19 +613,31 @@ class Gastronoom(ModelingSession):
             elif not self.sph_db[self.model_id].has_key(molec_id):
                 trans.setModelId(molec_id)
                 self.sph_db[self.model_id][molec_id] = \
-                    dict([(molec_id,dict([(str(trans),trans.makeDict(1))]))])
+                    dict([(molec_id,dict([(str(trans),\
+                                           trans.makeDict(reservation))]))])
                 self.sph_db.addChangedKey(self.model_id)
                 self.trans_bools.append(False)
-                self.sph_db.sync()
             else:    
                 for trans_id in [k for k,v in sorted(self.sph_db[self.model_id]\
                                                         [molec_id].items())
                                    if str(trans) in v.keys()]:
                     db_trans_dict = self.sph_db[self.model_id][molec_id]\
                                                [trans_id][str(trans)].copy()
-                    if self.compareCommandLists(this_list=trans.makeDict(),\
+                    model_bool = self.compareCommandLists(\
+                                                this_list=trans.makeDict(),\
                                                 modellist=db_trans_dict,\
-                                                code='sphinx'):
+                                                code='sphinx')
+                    if model_bool and self.vic is None \
+                            and db_trans_dict.has_key('IN_PROGRESS') \
+                            and not self.isReserved(db_trans_dict):
+                        print 'Removing sphinx database entry for %s of %s '\
+                              %(str(trans),trans.molecule.molecule) + \
+                              'with ID %s, which was not finished by its '\
+                              %trans_id + 'session.'
+                        del self.sph_db[self.model_id][molec_id][trans_id]\
+                                       [str(trans)]
+                        self.sph_db.addChangedKey(self.model_id)
+                    elif model_bool:
                         trans.setModelId(trans_id)
                         self.trans_bools.append(True)
                         if self.vic <> None \
@@ -427,9 +688,8 @@ class Gastronoom(ModelingSession):
                         self.copyOutput(trans,molec_id,trans.getModelId())
                         molecules_copied_to_new_id.append(trans.molecule) 
                     self.sph_db[self.model_id][molec_id][trans.getModelId()]\
-                            [str(trans)] = trans.makeDict(1)
+                            [str(trans)] = trans.makeDict(reservation)
                     self.sph_db.addChangedKey(self.model_id)
-                    self.sph_db.sync()
 
 
     def copyOutput(self,entry,old_id,new_id):
@@ -561,6 +821,8 @@ class Gastronoom(ModelingSession):
             else:
                 print 'Cooling model calculation failed. No entry is added '+ \
                       'to the database.'
+                del self.cool_db[self.model_id]
+                self.cool_db.sync()
                 self.model_id = ''
                     
 
@@ -612,6 +874,10 @@ class Gastronoom(ModelingSession):
                     print 'Mline model calculation failed for'\
                           '%s. No entry is added to the database.'\
                           %(molec.molecule)
+                    del self.ml_db[self.model_id][molec.getModelId()]\
+                                  [molec.molecule]
+                    self.ml_db.addChangedKey(self.model_id)
+                    self.ml_db.sync()
                     molec.setModelId('')
         if set([molec.getModelId() for molec in self.molec_list]) == set(['']):  
             #- no mline models calculated: stop GASTRoNOoM here
@@ -644,6 +910,7 @@ class Gastronoom(ModelingSession):
         print '%i transitions out of %i not yet calculated.'\
               %(len([boolean for boolean in self.trans_bools if not boolean]),\
                 len(self.trans_bools))
+        sphinx_jobs = []
         for i,(trans_bool,trans) in enumerate(zip(self.trans_bools,self.trans_list)):
             if not trans_bool and trans.getModelId():
                 if not self.sphinx:
@@ -657,33 +924,26 @@ class Gastronoom(ModelingSession):
                     self.vic.addTrans(trans)
                 elif self.recover_sphinxfiles: 
                     self.checkSphinxOutput(trans)
+                elif self.num_sphinx_workers > 1:
+                    #- Every transition needs its own inputfile when they are
+                    #- calculated at the same time
+                    filename = os.path.join(cc.path.gout,'models',\
+                                            'gastronoom_%s_%i.inp'\
+                                            %(trans.getModelId(),i+1))
+                    DataIO.writeFile(filename,self.makeSphinxInput(trans))
+                    sphinx_jobs.append((i,trans,filename))
                 else:
-                    self.updateModel(trans.getModelId())
-                    commandfile = ['%s=%s'%(k,v) 
-                                   for k,v in sorted(self.command_list.items()) 
-                                   if k != 'R_POINTS_MASS_LOSS'] + ['####'] + \
-                                  ['%s=%s'%(k,v) 
-                                   for k,v in sorted(trans.molecule.makeDict()\
-                                                                .items())] + \
-                                  ['####'] + \
-                                  ['%s=%s'%(k,v) 
-                                   for k,v in sorted(trans.makeDict()\
-                                                                .items())] + \
-                                  ['######']
-                    if self.command_list.has_key('R_POINTS_MASS_LOSS'):
-                        commandfile.extend(['%s=%s'%('R_POINTS_MASS_LOSS',v) 
-                                            for v in self.command_list\
-                                                    ['R_POINTS_MASS_LOSS']] + \
-                                           ['####'])
                     filename = os.path.join(cc.path.gout,'models',\
                                             'gastronoom_%s.inp'\
                                             %trans.getModelId())
-                    DataIO.writeFile(filename,commandfile)                
+                    DataIO.writeFile(filename,self.makeSphinxInput(trans))
                     print 'Starting calculation for transition %i out of %i.'\
                           %(i+1,len(self.trans_bools))
                     self.execGastronoom(subcode='sphinx',filename=filename)
                     self.checkSphinxOutput(trans)
                     self.sph_db.sync()
+        if sphinx_jobs:
+            self.runSphinxJobs(sphinx_jobs)
                     
         #- check if at least one of the transitions was calculated: then 
         #- self.model_id doesnt have to be changed
@@ -702,6 +962,85 @@ class Gastronoom(ModelingSession):
             
  
  
+    def makeSphinxInput(self,trans):
+        
+        '''
+        Make the sphinx inputfile for a transition. 
+        
+        The model_id in the command list is set to the model_id of the 
+        transition.
+        
+        @param trans: The transition
+        @type trans: Transition()
+        
+        @return: The lines of the inputfile
+        @rtype: list[string]
+        
+        '''
+        
+        self.updateModel(trans.getModelId())
+        return makeSphinxCommands(self.command_list,\
+                                  trans.molecule.makeDict(),trans.makeDict())
+        
+        
+        
+    def runSphinxJobs(self,sphinx_jobs):
+        
+        '''
+        Run sphinx for several transitions at the same time.
+        
+        At most self.num_sphinx_workers sphinx processes are running at any 
+        time. The output of every transition is checked with 
+        checkSphinxOutput as soon as its run is finished. The sphinx database
+        is synchronized once per self.num_sphinx_workers finished transitions,
+        and once more when all are done.
+        
+        @param sphinx_jobs: The index in self.trans_list, the transition and the
+                            inputfile for every sphinx run
+        @type sphinx_jobs: list[tuple]
+        
+        '''
+        
+        print 'Starting calculation for %i transitions, %i at a time.'\
+              %(len(sphinx_jobs),self.num_sphinx_workers)
+        pool = ThreadPool(processes=min(self.num_sphinx_workers,\
+                                        len(sphinx_jobs)))
+        try:
+            for j,(i,trans) in enumerate(pool.imap_unordered(\
+                                            self.__runSphinxJob,sphinx_jobs)):
+                print 'Finished calculation for transition %i out of %i.'\
+                      %(i+1,len(self.trans_bools))
+                self.checkSphinxOutput(trans)
+                if (j+1)%self.num_sphinx_workers == 0:
+                    self.sph_db.sync()
+        finally:
+            pool.close()
+            pool.join()
+        self.sph_db.sync()
+        
+        
+        
+    def __runSphinxJob(self,sphinx_job):
+        
+        '''
+        Run sphinx for a single transition. Called in a worker thread by 
+        runSphinxJobs.
+        
+        @param sphinx_job: The index in self.trans_list, the transition and the
+                           inputfile
+        @type sphinx_job: tuple
+        
+        @return: The index in self.trans_list and the transition
+        @rtype: tuple
+        
+        '''
+        
+        i,trans,filename = sphinx_job
+        self.execGastronoom(subcode='sphinx',filename=filename)
+        return (i,trans)
+        
+        
+        
     def finalizeSphinx(self):
         
         '''
@@ -709,17 +1048,62 @@ class Gastronoom(ModelingSession):
         
         if not, self.model_id is set to "". 
         
+        Transitions that are being calculated in a different session are 
+        waited for first: the sphinx database is refreshed, and again once 
+        every ModelingSession.wait_interval seconds until none of them is 
+        reserved anymore. Those that failed or whose session stopped get an empty 
+        model_id.
+        
         '''
         
-        if set([trans.getModelId() for trans in self.trans_list]) == set(['']):
-            self.model_id = ''
+        if self.trans_in_progress:
+            self.sph_db.refresh()
+        reserved = [trans 
+                    for trans in self.trans_in_progress 
+                    if self.__isTransReserved(trans)]
+        if reserved:
+            print 'Waiting for %i sphinx models that are currently being '\
+                  %len(reserved) + \
+                  'calculated in a different CC modeling session.'
+        while reserved:
+            sleep(self.wait_interval)
+            self.sph_db.refresh()
+            reserved = [trans 
+                        for trans in reserved
+                        if self.__isTransReserved(trans)]
         for trans in self.trans_in_progress:
             if not self.sph_db[self.model_id][trans.molecule.getModelId()]\
                               [trans.getModelId()].has_key(str(trans)) \
                     or self.sph_db[self.model_id][trans.molecule.getModelId()]\
                                   [trans.getModelId()][str(trans)]\
                                   .has_key('IN_PROGRESS'):
+                print 'Sphinx model calculation failed in a different CC ' + \
+                      'modeling session for %s of %s with id %s.'\
+                      %(str(trans),trans.molecule.molecule,trans.getModelId())
                 trans.setModelId('')  
+        if set([trans.getModelId() for trans in self.trans_list]) == set(['']):
+            self.model_id = ''
+                
+                
+                
+    def __isTransReserved(self,trans):
+        
+        '''
+        Check if a transition in progress is reserved in the sphinx database 
+        by a different session that is still calculating it.
+        
+        @param trans: The transition in progress
+        @type trans: Transition()
+        
+        @return: Is the transition reserved by a different running session?
+        @rtype: bool
+        
+        '''
+        
+        trans_dict = self.sph_db[self.model_id][trans.molecule.getModelId()]\
+                                [trans.getModelId()]
+        return trans_dict.has_key(str(trans)) \
+                    and self.isReserved(trans_dict[str(trans)])
                 
 
 
@@ -10,9 +10,10 @@ Author: R. Lombaert
 import os
 import subprocess
 from glob import glob
+from time import sleep
 
 import cc.path
-from cc.tools.io import DataIO, Database
+from cc.tools.io import DataIO, Database, DatabaseIndex
 from cc.modeling.ModelingSession import ModelingSession
 
 
@@ -406,30 +407,70 @@ class MCMax(ModelingSession):
     def checkDatabase(self):
 
         """
-        Checking cooling database.
+        Checking MCMax database.
+        
+        Only the models returned by the parameter index of the database are 
+        compared, in sorted order.
+        
+        The database is checked while holding the lock of lockDatabases(). If 
+        no match is found, a new model_id is reserved in the database right 
+        away, with an IN_PROGRESS key. If the match is reserved by a different
+        session that is still calculating it, the database is checked again 
+        once every ModelingSession.wait_interval seconds until it is finished. 
+        A reservation of a session that stopped is removed.
         
         @return: The presence of the MCMax model in the database
         @rtype: bool
         
         """
         
-        for model_id,cool_dict in sorted(self.db.items()):
-            model_bool = self.compareCommandLists(self.command_list.copy(),\
-                                                  cool_dict)
-            if model_bool:
-                if self.replace_db_entry \
+        mcmax_index = DatabaseIndex.getIndex(self.db,'mcmax')
+        waiting = ''
+        while True:
+            lockfile = self.lockDatabases()
+            try:
+                self.db.refresh()
+                model_id = ''
+                for (db_id,) in mcmax_index.lookup(self.command_list):
+                    if self.compareCommandLists(self.command_list.copy(),\
+                                                self.db[db_id]):
+                        model_id = db_id
+                        break
+                if model_id and self.db[model_id].has_key('IN_PROGRESS') \
+                        and not self.isReserved(self.db[model_id]):
+                    print 'Removing MCMax database entry for ID %s, '\
+                          %model_id + \
+                          'which was not finished by its session.'
+                    del self.db[model_id]
+                    model_id = ''
+                elif model_id and self.replace_db_entry \
                         and model_id not in self.new_entries: 
                     print 'Replacing MCMax database entry for old ID %s.'\
                           %model_id
                     del self.db[model_id]
+                    model_id = ''
+                if not model_id:
+                    print 'No match found in MCMax database. Calculating ' + \
+                          'new model.'
+                    self.model_id = self.makeNewId()
+                    self.db[self.model_id] = self.command_list.copy()
+                    self.db[self.model_id]['IN_PROGRESS'] = \
+                            self.makeReservation()
+                    self.db.sync()
                     return False
-                else:
+                if not self.db[model_id].has_key('IN_PROGRESS'):
                     print 'MCMax model has been calculated ' + \
                           'before with ID %s.'%model_id
                     self.model_id = model_id
                     return True
-        print 'No match found in MCMax database. Calculating new model.'
-        return False
+            finally:
+                self.unlockDatabases(lockfile)
+            if model_id <> waiting:
+                print 'MCMax model is currently being calculated in a ' + \
+                      'different CC modeling session with ID %s. '%model_id+\
+                      'Waiting for it to finish.'
+                waiting = model_id
+            sleep(self.wait_interval)
         
         
             
@@ -546,10 +587,10 @@ class MCMax(ModelingSession):
         #-- Check the MCMax database if the model was calculated before
         modelbool = self.checkDatabase()
                 
-        #-- if no match found in database, calculate new model with new model id 
-        #-- if the calculation did not fail, add entry to database for new model
+        #-- if no match found in database, calculate new model with the new 
+        #-- model id reserved in the database. If the calculation did not fail,
+        #-- the reservation is replaced by the entry for the new model
         if not modelbool:
-            self.model_id = self.makeNewId()
             input_dict = self.command_list.copy()
             del input_dict['photon_count']
             del input_dict['dust_species']
@@ -609,6 +650,8 @@ class MCMax(ModelingSession):
                 print '** Model calculation failed. No entry is added to ' + \
                       'the database and LAST_MCMAX_MODEL in STAR dictionary '+\
                       'is not updated.'
+                del self.db[self.model_id]
+                self.db.sync()
                 self.model_id = ''
                 
         #- add/change 'LAST_MCMAX_MODEL' entry
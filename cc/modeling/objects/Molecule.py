@@ -333,11 +333,15 @@ class Molecule():
                 else:
                     filename = os.path.join(cc.path.gdata,\
                                             '%s_indices.dat'%self.molecule)
-                rf = DataIO.readFile(filename,' ')
-                self.radiat_indices = [[int(i) for i in line] for line in rf]
+                self.radiat_indices,self.radiat_levels = \
+                            Radiat.readIndices(filename)
+            else:
+                self.radiat_indices = None
+                self.radiat_levels = None
         else:
             self.radiat = None
             self.radiat_indices = None
+            self.radiat_levels = None
         self.starfile = starfile
 
 
@@ -18,11 +18,12 @@ from scipy import argmin,argmax, empty
 from scipy.interpolate import interp1d
 import operator
 from numpy import savetxt
+import numpy as np
 
 import cc.path
 from cc.data import Data
 from cc.tools.io import Database
-from cc.tools.io import DataIO, Atmosphere
+from cc.tools.io import DataIO, Atmosphere, FileCache
 from cc.tools.numerical import Interpol
 from cc.modeling.objects import Molecule
 from cc.modeling.objects import Transition
@@ -30,6 +31,11 @@ from cc.modeling.tools import ColumnDensity
 from cc.modeling.codes import MCMax
 
 
+#-- Profiles read from model output by the Star.getDust* and Star.getGas* 
+#   methods, shared by all Star() objects. The memory budget is in MB.
+profile_cache = FileCache.FileCache(max_size=100)
+
+
 def getStar(star_grid,modelid,idtype='GASTRONOOM'):
     
     '''
@@ -158,6 +164,11 @@ class Star(dict):
         
         self.dust_list = None
         
+        #-- Index of GAS_LINES on the transition keys, and the list and number
+        #   of transitions that are indexed
+        self.__trans_index = dict()
+        self.__trans_indexed = (None,0)
+        
         
 
     def __getitem__(self,key):
@@ -363,13 +374,40 @@ class Star(dict):
         
         '''
         Read the kappas.dat file of an MCMax model.
+        
+        The file is read once and kept in the profile_cache of this module, as
+        long as it does not change.
+        
+        @return: The wavelength grid, and the absorption followed by the 
+                 scattering coefficients of every dust species
+        @rtype: (array,list[array])
+    
+        '''
+        
+        opas = self.getKappaMatrix()
+        return opas[0],list(opas[1:])
+        
+        
+        
+    def getKappaMatrix(self):
+        
+        '''
+        Return the kappas.dat file of an MCMax model as a matrix.
+        
+        The file is read once and kept in the profile_cache of this module, as
+        long as it does not change.
+        
+        @return: The wavelength grid in the first row, followed by the 
+                 absorption and then the scattering coefficients of every dust 
+                 species
+        @rtype: array
     
         '''
         
-        opas = DataIO.readCols(os.path.join(cc.path.mout,'models',\
-                                            self['LAST_MCMAX_MODEL'],\
-                                            'kappas.dat'))
-        return opas.pop(0),opas
+        filename = os.path.join(cc.path.mout,'models',\
+                                self['LAST_MCMAX_MODEL'],'kappas.dat')
+        return self.__getProfile('KAPPAS',filename,\
+                                 lambda: DataIO.readCols(filename))
                             
 
     #OBSOLETE. NOT USED. PERHAPS IN THE FUTURE. DONT CALL THIS UPON INITIALIZATION OF STAR()
@@ -749,15 +787,41 @@ class Star(dict):
         
         '''
          
-        i = 0
-        while i < len(self['GAS_LINES']) and sample != self['GAS_LINES'][i]:
-            i += 1
-        if i == len(self['GAS_LINES']):
+        i = self.__indexTransitions().get(sample.getKey())
+        if i is None:
             return None
         else:
             return self['GAS_LINES'][i]
         
     
+    
+    def __indexTransitions(self):
+        
+        '''
+        Return the index of GAS_LINES, from the key of a transition to its 
+        position in the list.
+        
+        The index is brought up to date first. Transitions added at the end of
+        the list since the last call are added to the index. If the list was 
+        replaced or shortened, the index is made anew. The first occurrence of
+        a transition is indexed, as with a linear search.
+        
+        @return: The index
+        @rtype: dict
+        
+        '''
+        
+        lines = self['GAS_LINES']
+        indexed,n = self.__trans_indexed
+        if indexed is not lines or len(lines) < n:
+            self.__trans_index = dict()
+            n = 0
+        for i in xrange(n,len(lines)):
+            self.__trans_index.setdefault(lines[i].getKey(),i)
+        self.__trans_indexed = (lines,len(lines))
+        return self.__trans_index
+        
+        
      
     def getTransList(self,**kwargs):
         
@@ -854,8 +918,10 @@ class Star(dict):
         if not self['LAST_MCMAX_MODEL']: return empty(0)
     
         fn = self.getDustFn(species)
-        rad = array(DataIO.getMCMaxOutput(incr=int(self['NRAD']),\
-                                          keyword='RADIUS',filename=fn))
+        rad = self.__getProfile('RADIUS',fn,\
+                                lambda: DataIO.getMCMaxOutput(\
+                                            incr=int(self['NRAD']),\
+                                            keyword='RADIUS',filename=fn))
         
         unit = str(unit).lower()
         if unit == 'au':
@@ -895,9 +961,12 @@ class Star(dict):
         #   over the azimuthal coordinate.
         fn = self.getDustFn(species)
         incr = int(self['NRAD'])*int(self['NTHETA'])
-        dens_ori = DataIO.getMCMaxOutput(filename=fn,incr=incr,\
-                                         keyword='DENSITY')
-        dens = Data.reduceArray(dens_ori,self['NTHETA'])
+        dens = self.__getProfile('DENSITY',fn,\
+                                 lambda: Data.reduceArray(\
+                                            DataIO.getMCMaxOutput(\
+                                                filename=fn,incr=incr,\
+                                                keyword='DENSITY'),\
+                                            self['NTHETA']))
         
         return dens         
          
@@ -940,9 +1009,12 @@ class Star(dict):
         #   over the azimuthal coordinate.
         fn = self.getDustFn(species)
         incr = int(self['NRAD'])*int(self['NTHETA'])
-        temp_ori = DataIO.getMCMaxOutput(incr=incr,keyword='TEMPERATURE',\
-                                         filename=fn)
-        temp = Data.reduceArray(temp_ori,self['NTHETA'])
+        temp = self.__getProfile('TEMPERATURE',fn,\
+                                 lambda: Data.reduceArray(\
+                                            DataIO.getMCMaxOutput(\
+                                                filename=fn,incr=incr,\
+                                                keyword='TEMPERATURE'),\
+                                            self['NTHETA']))
 
         if add_key:
             key = '$T_{\mathrm{d, avg}}$ for %s'\
@@ -984,8 +1056,10 @@ class Star(dict):
         else:
             kws['keyword'] = 'N(H2)'
         
-        nmol = DataIO.getGastronoomOutput(filename=fgr_file,return_array=1,\
-                                          **kws)
+        nmol = self.__getProfile(kws['keyword'],fgr_file,\
+                                 lambda: DataIO.getGastronoomOutput(\
+                                            filename=fgr_file,\
+                                            return_array=1,**kws))
                                               
         return nmol
     
@@ -1009,8 +1083,10 @@ class Star(dict):
         
         if not self['LAST_GASTRONOOM_MODEL']: return empty(0)
         fgr_file = self.getCoolFn(**kwargs)
-        vel = DataIO.getGastronoomOutput(filename=fgr_file,keyword='VEL',\
-                                         return_array=1)
+        vel = self.__getProfile('VEL',fgr_file,\
+                                lambda: DataIO.getGastronoomOutput(\
+                                            filename=fgr_file,keyword='VEL',\
+                                            return_array=1))
         return vel
         
         
@@ -1031,8 +1107,10 @@ class Star(dict):
         
         if not self['LAST_GASTRONOOM_MODEL']: return empty(0)
         fgr_file = self.getCoolFn(**kwargs)
-        temp = DataIO.getGastronoomOutput(filename=fgr_file,keyword='TEMP',\
-                                          return_array=1)
+        temp = self.__getProfile('TEMP',fgr_file,\
+                                 lambda: DataIO.getGastronoomOutput(\
+                                            filename=fgr_file,keyword='TEMP',\
+                                            return_array=1))
         return temp
     
 
@@ -1069,8 +1147,10 @@ class Star(dict):
         
         unit = str(unit).lower()
         fgr_file = self.getCoolFn(ftype=ftype,**kwargs)
-        rad = DataIO.getGastronoomOutput(filename=fgr_file,keyword='RADIUS',\
-                                         return_array=1)
+        rad = self.__getProfile('RADIUS',fgr_file,\
+                                lambda: DataIO.getGastronoomOutput(\
+                                            filename=fgr_file,\
+                                            keyword='RADIUS',return_array=1))
         #-- fgr_all gives radius in cm. Others in rstar. Convert others to cm
         if ftype != 'fgr_all':
             rad = rad*self['R_STAR']*self.Rsun
@@ -1085,6 +1165,38 @@ class Star(dict):
         
         
     
+    def __getProfile(self,quantity,filename,read):
+        
+        '''
+        Return a profile read from a model output file. 
+        
+        Profiles are kept in the profile_cache of this module, keyed on the 
+        quantity and the output file, which identifies the model id, the file 
+        type and the molecule or dust species. A cached profile is used as long
+        as the output file does not change.
+        
+        @param quantity: The name of the profile, eg 'TEMPERATURE'
+        @type quantity: str
+        @param filename: The model output file that holds the profile
+        @type filename: str
+        @param read: Reads the profile from the output file when called 
+                     without arguments.
+        @type read: function
+        
+        @return: A copy of the profile
+        @rtype: array
+        
+        '''
+        
+        key = (quantity,filename)
+        profile = profile_cache.get(key,filename)
+        if profile is None:
+            profile = array(read())
+            profile_cache.set(key,filename,profile)
+        return array(profile)
+        
+        
+    
     def getCoolFn(self,ftype='fgr_all',mstr='',modelid=''):
         
         '''
@@ -3045,8 +3157,9 @@ class Star(dict):
             wave_index = argmin(abs(wave_list-wavelength))
             return integrate.trapz(y=dens*kappas[wave_index],x=rad)
         else:
-            return (wave_list,array([integrate.trapz(y=dens*kappas[i],x=rad)
-                                     for i in xrange(len(wave_list))]))
+            #-- Integrate over the radial grid for all wavelengths at once
+            return (wave_list,integrate.trapz(y=kappas[:,None]*dens[None,:],\
+                                              x=rad,axis=1))
         
     
     def calcINCLUDE_SCAT_GAS(self):
@@ -3082,21 +3195,17 @@ class Star(dict):
         
         '''
         
-        wave_list,kappas = self.readKappas()
+        opas = self.getKappaMatrix()
+        weights = [float(self['A_%s'%(species)]) 
+                   for species in self.getDustList()]
         if self['INCLUDE_SCAT_GAS']:
             #-- First the absorption coefficients of all dust species are given 
-            #   Then the scattering coefficients. So iterate twice over the 
-            #   dust list.
-            wkappas = [sum([float(self['A_%s'%(species)])*float(kappas[i][j])
-                            for i,species in enumerate(self.getDustList()*2)])
-                       for j in xrange(len(kappas[0]))]
-        else: 
-            #-- Only iterate once over the dust list to just take the 
-            #   absorption coefficients.
-            wkappas = [sum([float(self['A_%s'%(species)])*float(kappas[i][j])
-                            for i,species in enumerate(self.getDustList())])
-                       for j in xrange(len(kappas[0]))]
-        return array(wave_list),array(wkappas)
+            #   Then the scattering coefficients. So take the dust list twice.
+            weights = weights*2
+        #-- Otherwise only take the absorption coefficients.
+        weights = array(weights)
+        wkappas = np.dot(weights,opas[1:len(weights)+1])
+        return opas[0],wkappas
         
         
     
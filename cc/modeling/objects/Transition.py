@@ -13,6 +13,7 @@ import scipy
 import subprocess
 from glob import glob
 from scipy import pi, exp, linspace, argmin, array, diff, mean, isfinite
+import numpy as np
 from scipy.interpolate import interp1d
 from scipy.integrate import trapz
 import types
@@ -28,6 +29,10 @@ from cc.tools.numerical import Interpol
 from cc.statistics import BasicStats as bs
 from cc.data import LPTools
 
+#-- The transitions selected from a radiat file per molecule and range, see
+#   selectTransitionsFromRadiat
+line_lists = dict()
+
 def getLineStrengths(trl,mode='dint',nans=1,n_data=0):
     
     '''
@@ -650,49 +655,89 @@ def makeTransitionsFromRadiat(molec,telescope,ls_min,ls_max,ls_unit='GHz',\
     
     '''
     
+    selection = selectTransitionsFromRadiat(molec=molec,ls_min=ls_min,\
+                                            ls_max=ls_max,ls_unit=ls_unit,\
+                                            no_vib=no_vib)
+    nl = [Transition(molecule=molec,telescope=telescope,offset=offset,\
+                     n_quad=n_quad,use_maser_in_sphinx=use_maser_in_sphinx,\
+                     path_gastronoom=path_gastronoom,radiat_index=radi,\
+                     **quantum_dict)
+          for radi,quantum_dict in selection]
+    return nl
+
+
+
+def selectTransitionsFromRadiat(molec,ls_min,ls_max,ls_unit='GHz',no_vib=0):
+    
+    '''
+    Select the transitions from a Radiat file of a molecule within a given 
+    wavelength/frequency range, with the quantum numbers of their levels.
+    
+    The selection is done on the arrays of the radiat file, and is remembered
+    in line_lists for every molecule and range, so it is shared between all
+    Star() objects in a grid that use the same radiat and indices files. 
+    
+    @param molec: The molecule for which the line list is made.
+    @type molec: Molecule()
+    @param ls_min: The minimum allowed wavelength/frequency for the transitions
+    @type ls_min: float
+    @param ls_max: The maximum allowed wavelength/frequency for the transitions
+    @type ls_max: float
+    
+    @keyword ls_unit: The unit of the wavelength/frequency range. Can be: GHz, 
+                      MHz, Hz, MICRON, MM, CM, M
+    
+                      (default: 'GHz')
+    @type ls_unit: string
+    @keyword no_vib: Do not include vibrational states in the output list.
+                     
+                     (default: 0)
+    @type no_vib: bool
+    
+    @return: The radiat index and the quantum numbers (as keywords for 
+             Transition()) of the selected transitions. The list is shared 
+             and must not be changed.
+    @rtype: list[(int,dict)]
+    
+    '''
+    
     radiat = molec.radiat
-    wave = radiat.getFrequency(unit=ls_unit)
-    low = radiat.getLowerStates()
-    up = radiat.getUpperStates()
+    indices = molec.radiat_indices
+    key = (molec.molecule,ls_min,ls_max,ls_unit.upper(),bool(no_vib),\
+           bool(molec.spec_indices))
+    #-- The radiat and indices data are shared between molecules that use 
+    #   the same files, and replaced when the files change.
+    if line_lists.has_key(key):
+        radiat_dict,radiat_indices,selection = line_lists[key]
+        if radiat_dict is radiat.dict and radiat_indices is indices:
+            return selection
+    radi = radiat.selectTransitions(ls_min=ls_min,ls_max=ls_max,unit=ls_unit)
+    up = radiat.arrays['UPPER'][radi]
+    low = radiat.arrays['LOWER'][radi]
     if not molec.spec_indices:
         #- molec.ny_low is the number of levels in gs vib state
         #- molec.ny_up is the number of levels above gs vib state
         #- generally ny_up/ny_low +1 is the number of vib states
         ny_low = molec.ny_low
-        n_vib = int(molec.ny_up/ny_low) + 1 
-        indices = [[i+1,int(i/ny_low),i-ny_low*int(i/ny_low)]
-                    for i in xrange(molec.ny_low*n_vib)]
-        nl = [Transition(molecule=molec,telescope=telescope,\
-                         vup=int(indices[u-1][1]),\
-                         jup=int(indices[u-1][2]),\
-                         vlow=int(indices[l-1][1]),\
-                         jlow=int(indices[l-1][2]),\
-                         offset=offset,n_quad=n_quad,\
-                         use_maser_in_sphinx=use_maser_in_sphinx,\
-                         path_gastronoom=path_gastronoom)
-              for l,u,w in zip(low,up,wave)
-              if w > ls_min and w < ls_max]
+        quantum = ['v','j']
+        q_up = array([(up-1)//ny_low,(up-1)%ny_low]).T
+        q_low = array([(low-1)//ny_low,(low-1)%ny_low]).T
     else:
-        indices = molec.radiat_indices
-        quantum = ['v','j','ka','kc']
-        nl = [] 
-        for l,u,w in zip(low,up,wave):
-            if w > ls_min and w < ls_max:
-                quantum_dict = dict()
-                #- some molecs only have 2 or 3 quantum numbers
-                for i in xrange(1,len(indices[0])):    
-                    quantum_dict[quantum[i-1]+'up'] = \
-                                            int(indices[u-1][i])
-                    quantum_dict[quantum[i-1]+'low'] = \
-                                            int(indices[l-1][i])
-                nl.append(Transition(molecule=molec,n_quad=n_quad,\
-                                     telescope=telescope,offset=offset,\
-                                     use_maser_in_sphinx=use_maser_in_sphinx,\
-                                     path_gastronoom=path_gastronoom,\
-                                     **quantum_dict))
+        #- some molecs only have 2 or 3 quantum numbers
+        quantum = ['v','j','ka','kc'][:len(indices[0])-1]
+        index_array = array(indices)
+        q_up = index_array[up-1,1:]
+        q_low = index_array[low-1,1:]
     if no_vib:
-        nl = [line for line in nl if line.vup == 0]
-    return nl
+        keep = q_up[:,0] == 0
+        radi,q_up,q_low = radi[keep],q_up[keep],q_low[keep]
+    selection = []
+    for ri,qu,ql in zip(radi,q_up,q_low):
+        quantum_dict = dict([(q+'up',int(v)) for q,v in zip(quantum,qu)])
+        quantum_dict.update([(q+'low',int(v)) for q,v in zip(quantum,ql)])
+        selection.append((int(ri),quantum_dict))
+    line_lists[key] = (radiat.dict,indices,selection)
+    return selection
 
 
 
@@ -728,6 +773,164 @@ def checkUniqueness(trans_list):
     
     
 
+def scanVlsr(vel,tmb,mfilters,noise,vexp,oversampling=1):
+    
+    '''
+    Find the source velocity for which filtered sphinx profiles best match a
+    dataset, for a set of models at once.
+    
+    The models are shifted on the data velocity grid in the interval 
+    [-0.5*vexp,0.5*vexp], in steps of the data bin size divided by the 
+    oversampling. The shift with the smallest chi^2 is the best shift. All 
+    models are compared with the data at once for every shift.
+    
+    @param vel: The data velocity grid
+    @type vel: array
+    @param tmb: The data Tmb profile
+    @type tmb: array
+    @param mfilters: The sphinx Tmb profiles filtered onto the data velocity 
+                     grid at the vlsr of the data, one per row.
+    @type mfilters: array
+    @param noise: The noise of the data
+    @type noise: float
+    @param vexp: The gas terminal velocity from the line profile fit
+    @type vexp: float
+    
+    @keyword oversampling: The number of steps per data bin size. Sub-bin 
+                           steps shift the models by linear interpolation.
+                               
+                           (default: 1)
+    @type oversampling: int
+    
+    @return: The minimum chi^2 of every model, the velocity by which the vlsr 
+             is to be reduced for the best match, and the shifted models for 
+             the best match.
+    @rtype: (array,array,array)
+    
+    '''
+    
+    mfilters = array(mfilters,dtype=float)
+    res = vel[1]-vel[0]
+    #-- Number of values tested is int(0.5*vexp/res+1),0.5*vexp on one side 
+    #   and on the other side
+    nstep = int(0.5*vexp/res+1)
+    
+    #-- Check if there are enough zeroes in the model flux grid
+    #   ie if either of the following 2 statements evaluate to True, a non-
+    #   zero element is found, and the technique used here for matching 
+    #   different vlsr cannot be used
+    if mfilters[:,:nstep].any() or mfilters[:,-nstep:].any():
+        raise ValueError('Warning! Not enough zeroes in the grid! ' + \
+                         'Talk to Robin!')
+    
+    #-- Since usually the data velocity grid extends far beyond what's 
+    #   given by the sphinx velocity grid, we can just shift by adding and
+    #   removing elements at the start and end of the list. The shifts are 
+    #   done in the order 0, 1, -1, 2, -2, ... (in units of bins). A positive
+    #   shift moves the model to lower velocity.
+    nshift = (nstep-1)*oversampling
+    steps = np.arange(1,nshift+1)/float(oversampling)
+    shifts = np.concatenate([[0.],np.array([steps,-steps]).T.ravel()])
+    
+    #-- Calculate the chi squared for every shift of all filtered models. The
+    #   selection with compress keeps the rows contiguous.
+    dsel = tmb>=-3*noise
+    chisquared = array([bs.calcChiSquared(data=tmb[dsel],noise=noise,\
+                                          model=LPTools.shiftLP(flux=mfilters,\
+                                                                shifts=[shift],\
+                                                                vel=vel)[0]\
+                                                       .compress(dsel,axis=-1))
+                        for shift in shifts])
+    
+    #-- Get the minimum chi squared and the associated shift for every model
+    imin = argmin(chisquared,axis=0)
+    chi2 = chisquared.min(axis=0)
+    best_mfilters = array([LPTools.shiftLP(flux=mfilter,shifts=[shifts[i]],\
+                                           vel=vel)[0]
+                           for i,mfilter in zip(imin,mfilters)])
+    return chi2, shifts[imin]*res, best_mfilters
+    
+    
+
+def getSphinxStats(trans_list,use_bestvlsr=1,index=0):
+    
+    '''
+    Calculate the integrated and peak Tmb, and the loglikelihood of the sphinx
+    profiles of a list of Transition() objects with the same data, in one go.
+    
+    The results are the same as those of getIntTmbSphinx, getPeakTmbSphinx 
+    and getLoglikelihood for every transition, but the sphinx profiles are 
+    filtered onto the data velocity grid only once, and are compared with the 
+    data as one array of models. The best vlsr is set for every transition if 
+    requested. 
+    
+    The data are taken from the first transition, and are assumed to be set
+    for all transitions, e.g. with setData().
+    
+    @param trans_list: The transitions for the same line, with different 
+                       sphinx models 
+    @type trans_list: list[Transition()]
+    
+    @keyword use_bestvlsr: Use the fitted best-guess for the v_lsr when 
+                           determining the velocity grid for the model. If 
+                           not, the vlsr from the Star.dat file or the fits
+                           file is used. 
+                           
+                           (default: 1)
+    @type use_bestvlsr: bool
+    @keyword index: The data list index of the requested dataset
+    
+                    (default: 0)
+    @type index: int
+    
+    @return: The integrated Tmb, peak Tmb, and loglikelihood of the sphinx 
+             profiles, in the order of trans_list
+    @rtype: (array,array,array)
+    
+    '''
+    
+    minttmb = array([t.getIntTmbSphinx() for t in trans_list])
+    mpeaktmb = array([t.getPeakTmbSphinx() for t in trans_list])
+    if not trans_list:
+        return minttmb, mpeaktmb, array([])
+    dt = trans_list[0]
+    dt.readData()
+    if dt.unresolved or not dt.lpdata \
+            or None in [t.sphinx for t in trans_list]:
+        lll = array([t.getLoglikelihood(use_bestvlsr=use_bestvlsr,index=index)
+                     for t in trans_list])
+        return minttmb, mpeaktmb, lll
+        
+    #-- Filter the sphinx models that are needed onto the data grid once
+    if use_bestvlsr:
+        todo = [t for t in trans_list if t.best_vlsr is None]
+    else:
+        todo = trans_list
+    mfilters = array([t.getFilteredSphinx(index=index) for t in todo])
+    if use_bestvlsr and todo:
+        chi2,dvlsr,best_mfilters = scanVlsr(vel=dt.lpdata[index].getVelocity(),\
+                                            tmb=dt.lpdata[index].getFlux(),\
+                                            mfilters=mfilters,\
+                                            noise=dt.getNoise(index=index),\
+                                            vexp=dt.getVexp(index=index))
+        for t,ci,dvi,bmi in zip(todo,chi2,dvlsr,best_mfilters):
+            t.chi2_best_vlsr = ci
+            t.best_vlsr = t.getVlsr(index=index) - dvi
+            t.best_mfilter = bmi
+    if use_bestvlsr:
+        mfilters = array([t.best_mfilter for t in trans_list])
+    
+    #-- Rescale the models to the integrated data Tmb, and compare all of them 
+    #   with the data at once
+    vsel,dsel,num = dt.getLoglikelihoodData(index=index)
+    shift_factor = num/minttmb
+    msel = mfilters.compress(vsel,axis=-1)*shift_factor[:,None]
+    lll = bs.calcLoglikelihood(data=dsel,model=msel,\
+                               noise=dt.getNoise(index=index))
+    return minttmb, mpeaktmb, lll
+    
+    
+
 class Transition():
     
     '''
@@ -739,7 +942,7 @@ class Transition():
                  nup=None,vlow=0,jlow=0,kalow=0,kclow=0,nlow=None,offset=0.0,\
                  frequency=None,exc_energy=None,int_intensity_log=None,\
                  n_quad=100,use_maser_in_sphinx=0,vibrational='',\
-                 path_gastronoom=None):
+                 path_gastronoom=None,radiat_index=None):
         
         '''
         
@@ -876,6 +1079,7 @@ class Transition():
         self.n_quad = int(n_quad)
         self.use_maser_in_sphinx = int(use_maser_in_sphinx)
         self.__model_id = None
+        self.__key = None
         if nup is None or nlow is None:
             self.nup = self.kaup            
             self.nlow = self.kalow
@@ -895,7 +1099,7 @@ class Transition():
         self.radiat_trans = None
         if frequency is None:
              #-- sets frequency from GASTRoNOoM input in s^-1
-            self.__setIndices()  
+            self.__setIndices(radiat_index)  
         else:
             self.frequency = frequency
         self.c = 2.99792458e10          #in cm
@@ -941,8 +1145,8 @@ class Transition():
         '''
         Compare two transitions and return true if equal.
         
-        The condition is the dictionary of this Transition() returned by the 
-        makeDict() method.
+        The condition is the key of this Transition() returned by the getKey()
+        method, which holds the same information as makeDict().
         
         @return: The comparison
         @rtype: bool
@@ -950,10 +1154,7 @@ class Transition():
         '''
         
         try:        
-            if self.makeDict() == other.makeDict():
-                return True
-            else:
-                return False
+            return self.getKey() == other.getKey()
         except AttributeError:
             return False
                 
@@ -964,8 +1165,8 @@ class Transition():
         '''
         Compare two transitions and return true if not equal.
         
-        The condition is the dictionary of this Transition() returned by the 
-        makeDict() method.
+        The condition is the key of this Transition() returned by the getKey()
+        method, which holds the same information as makeDict().
         
         @return: The negative comparison
         @rtype: bool
@@ -973,10 +1174,7 @@ class Transition():
         '''
         
         try:
-            if self.makeDict() != other.makeDict():
-                return True
-            else:
-                return False
+            return self.getKey() != other.getKey()
         except AttributeError:
             return True
 
@@ -985,16 +1183,37 @@ class Transition():
     def __hash__(self):
         
         '''
-        Return a hash number based on the string of the transition, but make 
-        sure that every comparison includes the isTransition method of the 
-        trans.
+        Return a hash number based on the key of the transition, so that equal
+        transitions have the same hash.
         
         @return: The hash number:
         @rtype: int
         
         '''
         
-        return hash(str(self.makeDict()))
+        return hash(self.getKey())
+
+
+
+    def getKey(self):
+        
+        '''
+        Return the canonical key of this transition.
+        
+        The key consists of the transition string, N_QUAD and 
+        USE_MASER_IN_SPHINX, ie the values in the dict returned by makeDict().
+        It is made once, since these do not change after a transition is 
+        created.
+        
+        @return: The key
+        @rtype: tuple
+        
+        '''
+        
+        if self.__key is None:
+            self.__key = (str(self).replace('TRANSITION=',''),self.n_quad,\
+                          self.use_maser_in_sphinx)
+        return self.__key
 
 
 
@@ -1127,16 +1346,19 @@ class Transition():
 
 
 
-    def makeDict(self,in_progress=0):
+    def makeDict(self,in_progress=''):
         
         '''
         Return a dict with transition string, and other relevant parameters.
         
-        @keyword in_progress: add an extra dict entry "IN_PROGRESS" if the 
-                              transition is still being calculated on Vic.
+        @keyword in_progress: add an extra dict entry "IN_PROGRESS" with this
+                              value if the transition is still being 
+                              calculated. The value identifies the session 
+                              that calculates it, see 
+                              ModelingSession.makeReservation().
                               
-                              (default: 0)
-        @type in_progress: bool
+                              (default: '')
+        @type in_progress: string
         
         @return: The transition dictionary including all relevant, defining 
                  information
@@ -1144,11 +1366,11 @@ class Transition():
         
         '''
         
-        if int(in_progress):
+        if in_progress:
             return dict([('TRANSITION',str(self).replace('TRANSITION=','')),\
                          ('N_QUAD',self.n_quad),\
                          ('USE_MASER_IN_SPHINX',self.use_maser_in_sphinx),\
-                         ('IN_PROGRESS',1)])
+                         ('IN_PROGRESS',in_progress)])
         else:
             return dict([('TRANSITION',str(self).replace('TRANSITION=','')),\
                          ('N_QUAD',self.n_quad),\
@@ -1283,13 +1505,19 @@ class Transition():
 
 
 
-    def __setIndices(self):
+    def __setIndices(self,radiat_index=None):
          
         '''
         Set the index of this transition in the radiat file of GASTRoNOoM.
         
         The index from the indices file for lower and upper state are set.
         
+        @keyword radiat_index: The index of the transition in the radiat file,
+                               if known. 
+                               
+                               (default: None)
+        @type radiat_index: int
+        
         '''
         #- For 12C16O and 13C16O:
         #- indices = [i<60 and [i+1,0,i] or [i+1,1,i-60] for i in range(120)]
@@ -1297,7 +1525,10 @@ class Transition():
         #- index (1-60) and v=0, the next 60 (60-119) j's are associated with 
         #- index (61-120) and v=1 
 
-        if not self.molecule.spec_indices:
+        if radiat_index is not None:
+            self.up_i = self.molecule.radiat.getUpperStates()[radiat_index]
+            self.low_i = self.molecule.radiat.getLowerStates()[radiat_index]
+        elif not self.molecule.spec_indices:
             self.up_i = self.jup + self.vup*self.molecule.ny_low + 1
             self.low_i = self.jlow + self.vlow*self.molecule.ny_low + 1
         else:
@@ -1314,10 +1545,14 @@ class Transition():
             #- Get index of the transition quantum numbers in the indices list
             #- If not present in list, ValueError is raised: probably caused 
             #- by using a linelist that doesn't include this transition.
-            self.up_i  = indices[[i[1:] 
-                                for i in indices].index(quantum_up)][0]
-            self.low_i = indices[[i[1:] 
-                                for i in indices].index(quantum_low)][0]
+            levels = self.molecule.radiat_levels
+            try:
+                self.up_i = levels[tuple(quantum_up)]
+                self.low_i = levels[tuple(quantum_low)]
+            except KeyError:
+                raise ValueError('Quantum numbers %s or %s not found in the '\
+                                 %(str(quantum_up),str(quantum_low)) + \
+                                 'indices file.')
         self.radiat_trans = self.molecule.radiat.getTransInfo(low_i=self.low_i,\
                                                               up_i=self.up_i)
         if self.radiat_trans is False:
@@ -1588,7 +1823,7 @@ class Transition():
             self.fittedlprof = []
             
         for k in sorted(datadict.keys()):
-            if datadict[k] <> None:
+            if datadict[k] <> None and not datadict[k].get('fit_failed'):
                 if not os.path.split(k)[0]: 
                     self.datafiles.append(os.path.join(cc.path.dradio,k))
                 else: 
@@ -1747,7 +1982,7 @@ class Transition():
             return None
   
             
-    def getBestVlsr(self,index=0):
+    def getBestVlsr(self,index=0,oversampling=1):
         
         """ 
         If self.best_vlsr is None, the best source velocity will be guessed by
@@ -1774,6 +2009,14 @@ class Transition():
         
                         (default: 0)
         @type index: int
+        @keyword oversampling: The number of steps per data bin size with which
+                               the source velocity is varied. Sub-bin steps 
+                               shift the model by linear interpolation. Only 
+                               used the first time the best vlsr is 
+                               calculated.
+                               
+                               (default: 1)
+        @type oversampling: int
         
         @return: the best guess vlsr, or the initial guess if no sphinx or data
                  are available [will return vlsr included in fitsfiles if 
@@ -1799,66 +2042,23 @@ class Transition():
         if self.unresolved or not self.lpdata or not self.sphinx:
             return self.getVlsr(index=index)
         
-        #-- get all the profiles and noise values
-        noise = self.getNoise(index=index)
-        dvel = self.lpdata[index].getVelocity()
-        dtmb = self.lpdata[index].getFlux()
-        mvel = self.sphinx.getVelocity()
-        mtmb = self.sphinx.getLPTmb()
-        
         #-- Finding the best vlsr:
         #   1) filter the sphinx model onto the data grid, after rescaling the
         #      sphinx velocity grid to the given vlsr of the data.
         #   2) Check in the interval [vlsr-0.5vexp:vlsr+0.5*vexp] with steps 
         #      equial to the data bin size if there is a better match between
         #      model and data. This gives the 'best_vlsr'
-        res = dvel[1]-dvel[0]
-        mtmb_filter = filtering.filter_signal(x=mvel+self.getVlsr(index=index),
-                                              y=mtmb,ftype='box',\
-                                              x_template=dvel,window_width=res)
-        #-- Number of values tested is int(0.5*vexp/res+1),0.5*vexp on one side 
-        #   and on the other side
-        nstep = int(0.5*self.getVexp(index=index)/res+1)
-        
-        #-- Check if there are enough zeroes in the model flux grid
-        #   ie if either of the following 2 statements evaluate to True, a non-
-        #   zero element is found, and the technique used here for matching 
-        #   different vlsr cannot be used
-        if mtmb_filter[1][:nstep].any() or mtmb_filter[1][-nstep:].any():
-            raise ValueError('Warning! Not enough zeroes in the grid! ' + \
-                             'Talk to Robin!')
-        #-- Since usually the data velocity grid extends far beyond what's 
-        #   given by the sphinx velocity grid, we can just shift by adding and
-        #   removing elements at the start and end of the list.
-        mtmb_grid = [mtmb_filter[1]]
-        
-        for i in range(1,nstep):
-            mtmbi_left = mtmb_filter[1][i:]
-            while len(mtmbi_left) < len(dtmb):
-                mtmbi_left = scipy.append(mtmbi_left,0)
-            mtmbi_right = mtmb_filter[1][:-i]
-            while len(mtmbi_right) < len(dtmb):
-                mtmbi_right = scipy.insert(mtmbi_right,0,0)
-            mtmb_grid.extend([mtmbi_left,mtmbi_right])
-            
-        #-- Calculate the chi squared for every filtered model
-        chisquared = [bs.calcChiSquared(data=dtmb[dtmb>=-3*noise],\
-                                        model=mtmbi[dtmb>=-3*noise],\
-                                        noise=noise)
-                      for mtmbi in mtmb_grid]
-                      
-        #-- Get the minimum chi squared, set the best_vlsr and set the best 
-        #   filtered model profile
-        self.chi2_best_vlsr = min(chisquared)
-        #-- Tracing back the step associated with the index (uses int division)
-        #   0 gives 0 again. 1 gives 1, 2 gives 1. 3 gives 2, 4 gives 2. etc.
-        imin = argmin(chisquared)
-        best_step = (imin-1)/2+1
-        #-- Determining whether to add or subtract best_step*res from the vlsr
-        modifier = imin%2 == 0 and 1 or -1
-        self.best_vlsr = self.getVlsr(index=index) + modifier*best_step*res
+        mtmb_filter = self.getFilteredSphinx(index=index)
+        chi2,dvlsr,mfilter = scanVlsr(vel=self.lpdata[index].getVelocity(),\
+                                      tmb=self.lpdata[index].getFlux(),\
+                                      mfilters=[mtmb_filter],\
+                                      noise=self.getNoise(index=index),\
+                                      vexp=self.getVexp(index=index),\
+                                      oversampling=oversampling)
+        self.chi2_best_vlsr = chi2[0]
+        self.best_vlsr = self.getVlsr(index=index) - dvlsr[0]
         #-- Note that the velocity grid of best_mfilter is the data velocity
-        self.best_mfilter = mtmb_grid[imin]
+        self.best_mfilter = mfilter[0]
         
         #print "Best V_lsr: %f km/s, "%self.best_vlsr + \
               #"original V_lsr: %f km/s for transition %s, %s."\
@@ -1866,6 +2066,40 @@ class Transition():
         return self.best_vlsr
     
     
+    def getFilteredSphinx(self,index=0):
+        
+        """
+        Filter the sphinx Tmb profile onto the velocity grid of a dataset, 
+        after shifting the sphinx velocity grid to the vlsr of the dataset.
+        
+        Returns None if sphinx or data profile are not available. 
+        
+        @keyword index: The data list index of the requested dataset
+        
+                        (default: 0)
+        @type index: int
+        
+        @return: The filtered, continuum subtracted sphinx Tmb profile on the 
+                 data velocity grid
+        @rtype: array
+        
+        """
+        
+        self.readData()
+        self.readSphinx()
+        if not self.lpdata or self.sphinx is None:
+            return
+        vel = self.lpdata[index].getVelocity()
+        mvel = self.sphinx.getVelocity()
+        mtmb = self.sphinx.getLPTmb()
+        res = vel[1]-vel[0]
+        mtmb_filter = filtering.filter_signal(x=mvel+self.getVlsr(index=index),
+                                              y=mtmb,ftype='box',\
+                                              x_template=vel,window_width=res)
+        return mtmb_filter[1]
+        
+        
+        
     def getIntIntIntSphinx(self,units='si'):
         
         """
@@ -2172,6 +2406,52 @@ class Transition():
         
     
     
+    def getLoglikelihoodData(self,index=0):
+        
+        """
+        Return the data used for the loglikelihood of the sphinx profile, see
+        self.getLoglikelihood().
+        
+        The data are selected in the integration window of the line profile
+        fit, around the vlsr. If an absorption component was detected, the 
+        fitted line profile is used instead of the data.
+        
+        @keyword index: The data list index of the requested dataset
+        
+                        (default: 0)
+        @type index: int
+        
+        @return: The selection on the data velocity grid, the selected data, 
+                 and the integrated data Tmb to which the sphinx profile is 
+                 rescaled
+        @rtype: (array[bool],array,float)
+        
+        """
+        
+        vel = self.lpdata[index].getVelocity()
+        window = self.fittedlprof[index]['intwindow']
+        vexp = self.getVexp(index=index)
+        vlsr = self.getVlsr(index=index)
+        vsel = abs(vel-vlsr)<=window*vexp
+        if self.fittedlprof[index]['fitabs'] <> None:
+            pars = array(self.fittedlprof[index]['fitprof'][1])
+            functype = self.fittedlprof[index]['fitprof'][0]
+            dsel = funclib.evaluate(functype,vel,pars)
+            dsel = dsel[vsel]
+        else:
+            dsel = self.lpdata[index].getFlux()[vsel]
+        if self.getPeakTmbData(index=index) <= 5.*self.getNoise(index=index):
+            #-- If the data are very noisy, use the fitted line profile to 
+            #   determine the shift_factor, instead of the data themself.
+            num = self.fittedlprof[index]['fgintint']
+        else:
+            #-- Note that even if data are not noisy, the fitted lprof is still
+            #   used here, in case an absorption is detected. 
+            num = self.getIntTmbData(index=index)
+        return vsel,dsel,num
+        
+        
+        
     def getLoglikelihood(self,use_bestvlsr=1,index=0):
         
         """
@@ -2221,40 +2501,13 @@ class Transition():
             print 'Using standard v_lsr from Star.dat or fits file for LLL.'
             use_bestvlsr = 0
             
-        vel = self.lpdata[index].getVelocity()
-        noise = self.getNoise(index=index)
-        window = self.fittedlprof[index]['intwindow']
-        vexp = self.getVexp(index=index)
-        vlsr = self.getVlsr(index=index)
-        if self.fittedlprof[index]['fitabs'] <> None:
-            pars = array(self.fittedlprof[index]['fitprof'][1])
-            functype = self.fittedlprof[index]['fitprof'][0]
-            dsel = funclib.evaluate(functype,vel,pars)
-            dsel = dsel[abs(vel-vlsr)<=window*vexp]
-        else:
-            dsel = self.lpdata[index].getFlux()[abs(vel-vlsr)<=window*vexp]
-        if self.getPeakTmbData(index=index) <= 5.*self.getNoise(index=index):
-            #-- If the data are very noisy, use the fitted line profile to 
-            #   determine the shift_factor, instead of the data themself.
-            num = self.fittedlprof[index]['fgintint']
-            shift_factor = num/self.getIntTmbSphinx()
-        else:
-            #-- Note that even if data are not noisy, the fitted lprof is still
-            #   used here, in case an absorption is detected. 
-            num = self.getIntTmbData(index=index)
-            shift_factor = num/self.getIntTmbSphinx()
-        
+        vsel,dsel,num = self.getLoglikelihoodData(index=index)
+        shift_factor = num/self.getIntTmbSphinx()
         if use_bestvlsr:
-            msel = self.best_mfilter[abs(vel-vlsr)<=window*vexp]
-            msel = msel*shift_factor
+            msel = self.best_mfilter[vsel]
         else:
-            mvel = self.sphinx.getVelocity()
-            mtmb = self.sphinx.getLPTmb()
-            res = vel[1]-vel[0]
-            mtmb_filter = filtering.filter_signal(x=mvel+vlsr,y=mtmb,\
-                                                  ftype='box',x_template=vel,\
-                                                  window_width=res)
-            msel = mtmb_filter[1][abs(vel-vlsr)<=window*vexp]
-            msel = msel*shift_factor
-
+            msel = self.getFilteredSphinx(index=index)[vsel]
+        msel = msel*shift_factor
+        noise = self.getNoise(index=index)
+        
         return bs.calcLoglikelihood(data=dsel,model=msel,noise=noise)
\ No newline at end of file
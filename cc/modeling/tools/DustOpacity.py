@@ -12,9 +12,11 @@ from glob import glob
 from math import pi
 import os
 import types
+import numpy as np
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.tools.io import KappaReader
 from cc.tools.numerical import Interpol
 
 
@@ -112,17 +114,13 @@ def mergeOpacity(species,lowres='nom_res',highres='high_res'):
         hdfile = os.path.join(path,highres,f)
         ldfile = os.path.join(path,lowres,f)
         if os.path.isfile(ldfile) and os.path.isfile(hdfile):
-            hd = DataIO.readCols(hdfile)
-            ld = DataIO.readCols(ldfile)
-            hdw = hd[0]
-            ldw = ld[0]
+            hdw,hdk = KappaReader.readOpacities(hdfile)
+            ldw,ldk = KappaReader.readOpacities(ldfile)
             wmin = hdw[0]
             wmax = hdw[-1]
-            ld_low = [list(col[ldw<wmin]) for col in ld]
-            ld_high = [list(col[ldw>wmax]) for col in ld]
-            hd = [list(col) for col in hd]
-            merged = [ld_low[i] + hd[i] + ld_high[i] 
-                      for i in range(len(hd))]
+            hd = np.vstack([hdw,hdk])
+            ld = np.vstack([ldw,ldk])
+            merged = np.hstack([ld[:,ldw<wmin],hd,ld[:,ldw>wmax]])
             DataIO.writeCols(filename=os.path.join(path,f),cols=merged)
 
 
@@ -164,8 +162,8 @@ class CustomOpacity():
         self.filename =  DataIO.getInputData(keyword='PART_FILE',\
                                              filename='Dust.dat',\
                                              rindex=self.index)
-        fn = os.path.join(cc.path.mopac,self.filename)
-        self.input_data = DataIO.readFile(filename=fn,delimiter=' ') 
+        self.fn = os.path.join(cc.path.mopac,self.filename)
+        self.input_data = DataIO.readFile(filename=self.fn,delimiter=' ') 
         
         
         
@@ -276,9 +274,8 @@ class CustomOpacity():
         
         #- Select relevant inputlines (not saving the scattering matrices)
         self.opacity_file = True
-        inputsel = [line for line in self.input_data if len(line) == 4]
-        inputsel = array([[float(f) for f in line] for line in inputsel])
-        wl = inputsel[:,0]
+        wl,kappas = KappaReader.readOpacities(self.fn)
+        inputsel = np.vstack([wl,kappas]).T
         function = function.lower()
         
         #- Select the extrapolation and interpolation regions.
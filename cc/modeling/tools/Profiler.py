@@ -84,8 +84,8 @@ def waterFraction1StepProfiler(model_id,path_gastronoom,fraction,rfrac):
     fraction = float(fraction)
     filename = os.path.join(cc.path.gastronoom,path_gastronoom,'models',\
                             model_id,'coolfgr_all%s.dat'%model_id)
-    rad = Gastronoom.getGastronoomOutput(filename=filename,keyword='RADIUS',\
-                                         return_array=1)
+    rad = DataIO.getGastronoomOutput(filename=filename,keyword='RADIUS',\
+                                     return_array=1)
     fraction_profile = scipy.ones(len(rad))
     step_index = scipy.argmin(abs(rad-rfrac))
     fraction_profile[step_index:] = fraction
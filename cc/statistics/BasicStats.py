@@ -18,23 +18,27 @@ def calcChiSquared(data,model,noise):
     Calculate the chi-squared value of a data array minus a model array, taking 
     into account the noise in the data array.
     
+    Multiple models can be given at once as a 2D array, with one model per 
+    row. The chi-squared values of all models are then returned as an array.
+    
     @param data: The data set. Must have same dimensions as model!
     @type data: array
-    @param model: The model array. Must have same dimensions as data!
+    @param model: The model array. Must have same dimensions as data! Or a 2D
+                  array with one such model per row.
     @type model: array
     @param noise: the noise in the data array. Give one value for overall noise
                   or individual values for every entry in data/model. 
     @type noise: float/array
 
-    @return: The chi squared value
-    @rtype: float
+    @return: The chi squared value, or an array of values for multiple models
+    @rtype: float/array
     
     """
     
     if type(data) not in [types.ListType,scipy.ndarray]:
         data = [data]
     data, model, noise = array(data), array(model), array(noise) 
-    return sqrt(((data - model)**2./noise**2.).sum())/len(data)
+    return sqrt(((data - model)**2./noise**2.).sum(axis=-1))/len(data)
     
     
 
@@ -44,20 +48,26 @@ def calcLoglikelihood(data,model,noise):
     Calculate the loglikelihood value of a data array minus a model array,  
     taking into account the noise in the data array.
     
+    Multiple models can be given at once as a 2D array, with one model per 
+    row. The loglikelihoods of all models are then returned as an array.
+    
     @param data: The data set. Must have same dimensions as model!
     @type data: array
-    @param model: The model array. Must have same dimensions as data!
+    @param model: The model array. Must have same dimensions as data! Or a 2D
+                  array with one such model per row.
     @type model: array
     @param noise: the noise in the data array. 
     @type noise: float/array
 
-    @return: The loglikelihood value
-    @rtype: float
+    @return: The loglikelihood value, or an array of values for multiple 
+             models
+    @rtype: float/array
     
     """
     
     data, model, noise = array(data), array(model), array(noise) 
-    lll = (-log(sqrt(2.*pi)) - log(noise) - 1./2.*((data-model)/noise)**2.).sum()
+    lll = (-log(sqrt(2.*pi)) - log(noise) - 1./2.*((data-model)/noise)**2.)\
+                .sum(axis=-1)
     return lll
     
     
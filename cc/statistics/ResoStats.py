@@ -17,6 +17,7 @@ import types
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.modeling.objects import Transition
 from cc.statistics.Statistics import Statistics
 
 
@@ -242,11 +243,12 @@ class ResoStats(Statistics):
             for mt in self.trans_models[st]: 
                 mt.setData(st)
                 
-            #-- Collect the model integrated and peak Tmbs
-            self.minttmb[st] = array([mt.getIntTmbSphinx() 
-                                      for mt in self.trans_models[st]])
-            self.mpeaktmb[st] = array([mt.getPeakTmbSphinx() 
-                                       for mt in self.trans_models[st]])
+            #-- Collect the model integrated and peak Tmbs, and the 
+            #   loglikelihoods for all models. This is done for all models at 
+            #   once, with the same results as for every model separately.
+            stats = Transition.getSphinxStats(self.trans_models[st],\
+                                              use_bestvlsr=use_bestvlsr)
+            self.minttmb[st],self.mpeaktmb[st],self.loglikelihood[st] = stats
             
             #-- Set the data integrated and peak Tmb for this dataset
             self.dinttmb[st] = st.getIntTmbData()
@@ -257,10 +259,6 @@ class ResoStats(Statistics):
             else: 
                 self.noisy[ist] = False
             
-            #-- Collect the loglikelihoods for all models
-            self.loglikelihood[st] = array([mt.getLoglikelihood(use_bestvlsr) 
-                                            for mt in self.trans_models[st]])
-            
             #-- Calculate the ratios for integrated and peak Tmbs (model/data)
             self.ratioint[st] = self.minttmb[st]/self.dinttmb[st]
             self.ratiopeak[st] = self.mpeaktmb[st]/self.dpeaktmb[st]
@@ -9,11 +9,13 @@ Author: R. Lombaert
 
 import os
 import scipy
-from scipy import argmin,array,sqrt,log10
+from scipy import argmin,array,sqrt,log10,zeros
+import numpy as np
 import operator
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.data import Data
 from cc.modeling.objects import Transition
 from cc.statistics.Statistics import Statistics
 from cc.statistics import BasicStats as bs
@@ -72,6 +74,11 @@ class UnresoStats(Statistics):
         self.chi2_inttot = dict()
         self.chi2_con = dict()
         
+        #-- Remember the convolved models of all stars, read once per band.
+        #   key: filename
+        #   value: list[(wavelength array, flux array)] following star_grid
+        self.mconv = dict()
+        
         
     
     def setInstrument(self,instrument_name,*args,**kwargs):
@@ -134,6 +141,9 @@ class UnresoStats(Statistics):
             #   Doppler shift due to vlsr of the central source. In micron.
             self.central_mwav[fn] = [t.wavelength*10**4*1./(1-inst.vlsr/t.c)
                                      for t in self.sample_trans[fn]]
+            #-- Read the convolved models once for the peak ratios and chi^2
+            self.mconv[fn] = [inst.getSphinxConvolution(star,fn)
+                              for star in self.star_grid]
             
             self.__setPeakRatios(ifn,fn)
             if inst.linefit <> None:
@@ -180,12 +190,17 @@ class UnresoStats(Statistics):
                 dstd = self.data_stats[fn]['std']
                 #-- Cannot return empty list as the selection of existing 
                 #   convolutions is done in Statistics.setModels()
-                mflux = inst.getSphinxConvolution(star,fn)[1]
-                all_dflux.extend(dflux[mflux>0])
-                all_mflux.extend(mflux[mflux>0])
-                all_dstd.extend([dstd]*len(mflux[mflux>0]))
-            self.chi2_con[this_id] = bs.calcChiSquared(all_dflux,all_mflux,\
-                                                       all_dstd)
+                if self.mconv.has_key(fn):
+                    mflux = self.mconv[fn][istar][1]
+                else:
+                    mflux = inst.getSphinxConvolution(star,fn)[1]
+                all_dflux.append(dflux[mflux>0])
+                all_mflux.append(mflux[mflux>0])
+                all_dstd.append(zeros(len(mflux[mflux>0]))+dstd)
+            self.chi2_con[this_id] = bs.calcChiSquared(\
+                                            np.concatenate(all_dflux),\
+                                            np.concatenate(all_mflux),\
+                                            np.concatenate(all_dstd))
             
             
     def __setIntRatios(self,ifn,fn,chi2_type='normal'):
@@ -222,60 +237,81 @@ class UnresoStats(Statistics):
         #   Comparisons only made per filename! 
         inst.intIntMatch(trans_list=self.sample_trans[fn],ifn=ifn)
         
-        for star in self.star_grid:
-            #--  From here on, we start extracting the model specific int ints.
-            this_id = star['LAST_%s_MODEL'%inst.instrument.upper()]
-            mtrans = array([star.getTransition(t) 
-                            for t in self.sample_trans[fn]])
-            these_ratios = []
-            these_errs = []
-            self.chi2_intsi[fn][this_id] = []
-            for mt,st in zip(mtrans,self.sample_trans[fn]):
+        #-- Collect the data integrated intensities of the sample transitions.
+        #   If dintint is negative, it is a blend due to large FWHM! If blends
+        #   is not None, multiple sample trans have been found in the 
+        #   wavelength resolution bin of the fitted line and also indicates a 
+        #   blend.
+        strans = self.sample_trans[fn]
+        dint = [st.getIntIntUnresolved(fn) for st in strans]
+        dintint = zeros(len(strans))
+        dintinterr = zeros(len(strans))
+        for i,(dii,dierr,blends) in enumerate(dint):
+            if dii is None or dii == 'inblend':
+                continue
+            if blends is None:
+                dintint[i] = dii
+            else:
+                dintint[i] = -1.*abs(dii)
+            dintinterr[i] = dierr
+        
+        #-- Collect the model integrated intensities of all models in one 
+        #   array (n_models x n_lines), and keep track of which are available
+        #   and which are compared with the data in the chi^2.
+        mintint = zeros((len(self.star_grid),len(strans)))
+        available = zeros(mintint.shape,dtype=bool)
+        compared = zeros(mintint.shape,dtype=bool)
+        for istar,star in enumerate(self.star_grid):
+            for iline,(st,(dii,dierr,blends)) in enumerate(zip(strans,dint)):
                 #   4) No trans == sample_trans found for this model, or sample
                 #      trans does not contain a PACS integrated intensity.
-                if mt is None or st.getIntIntUnresolved(fn)[0] is None or \
-                        st.getIntIntUnresolved(fn)[0] == 'inblend':
-                    these_ratios.append(None)
-                    these_errs.append(None)
-               
-                #   5) Match found with a wave_fit value. Get int ratio 
-                #      m/d. If dintint is negative, it is a blend due to large
-                #      FWHM! If blends is not None, multiple sample trans have 
-                #      been found in the wavelength resolution bin of the 
-                #      fitted line and also indicates a blend.
+                mt = star.getTransition(st)
+                if mt is None or dii is None or dii == 'inblend':
+                    continue
+                #   5) Match found with a wave_fit value. Get the model int
+                #      int.
+                if blends is None:
+                    mintint[istar,iline] = mt.getIntIntIntSphinx() 
                 else:
-                    dintint, dintinterr, blends = st.getIntIntUnresolved(fn)
-                    if blends is None:
-                        mintint = mt.getIntIntIntSphinx() 
-                    else:
-                        #-- blends is a list of sample transitions that refers
-                        #   to the transitions involved in the blend, so get 
-                        #   these from the model grid, add them up and make 
-                        #   sure the ratio will be negative to indicate a blend
-                        blendlines = [star.getTransition(t) 
-                                      for t in blends
-                                      if star.getTransition(t) <> None]
-                        mintint = sum([t.getIntIntIntSphinx() 
-                                       for t in blendlines])
-                        dintint = -1.*abs(dintint)
-                    if dintint > 0 and not mt.sphinx.nans_present:
-                        if chi2_type == 'log':
-                            ichi2 = bs.calcChiSquared(log10(dintint),\
-                                                      log10(mintint),\
-                                                      log10(dintint*dintinterr))
-                        else:
-                            ichi2 = bs.calcChiSquared(dintint,\
-                                                      mintint,\
-                                                      dintint*dintinterr)
-                        #ichi2 = bs.calcLoglikelihood(dintint,\
-                        #                             mintint,\
-                        #                             dintint*dintinterr)
-                        self.chi2_intsi[fn][this_id].append(ichi2)
-                    this_ratio = mintint/dintint
-                    these_ratios.append(this_ratio)
-                    these_errs.append(abs(this_ratio)*dintinterr)
+                    #-- blends is a list of sample transitions that refers
+                    #   to the transitions involved in the blend, so get 
+                    #   these from the model grid, add them up and make 
+                    #   sure the ratio will be negative to indicate a blend
+                    blendlines = [star.getTransition(t) 
+                                  for t in blends
+                                  if star.getTransition(t) <> None]
+                    mintint[istar,iline] = sum([t.getIntIntIntSphinx() 
+                                                for t in blendlines])
+                available[istar,iline] = True
+                compared[istar,iline] = dintint[iline] > 0 \
+                                            and not mt.sphinx.nans_present
+        
+        #-- Calculate the ratios m/d, their errors, and the chi^2 of every 
+        #   single comparison for all models at once.
+        dintint = dintint*np.ones(mintint.shape)
+        dintinterr = dintinterr*np.ones(mintint.shape)
+        ratios = zeros(mintint.shape)
+        ratios[available] = mintint[available]/dintint[available]
+        errs = abs(ratios)*dintinterr
+        dsel,msel = dintint[compared],mintint[compared]
+        nsel = dsel*dintinterr[compared]
+        if chi2_type == 'log':
+            dsel,msel,nsel = log10(dsel),log10(msel),log10(nsel)
+        #-- The same as bs.calcChiSquared for every single comparison
+        chi2 = sqrt((dsel-msel)**2./nsel**2.)
+        #ichi2 = bs.calcLoglikelihood(dintint,mintint,dintint*dintinterr)
+        chi2 = np.split(chi2,np.cumsum(compared.sum(axis=1))[:-1])
+        
+        for istar,star in enumerate(self.star_grid):
+            this_id = star['LAST_%s_MODEL'%inst.instrument.upper()]
+            these_ratios = [None]*len(strans)
+            these_errs = [None]*len(strans)
+            for iline in np.nonzero(available[istar])[0]:
+                these_ratios[iline] = ratios[istar,iline]
+                these_errs[iline] = errs[istar,iline]
             self.int_ratios[fn][this_id] = these_ratios
             self.int_ratios_err[fn][this_id] = these_errs        
+            self.chi2_intsi[fn][this_id] = list(chi2[istar])
             
 
 
@@ -306,47 +342,48 @@ class UnresoStats(Statistics):
         d_sigma = self.data_stats[fn]['sigma']
         
         self.peak_ratios[fn] = dict()
-    
-        for star in self.star_grid:
+        
+        #-- Calculate the peak-to-peak ratios. 
+        #   1) Central wavelengths of mtrans are set in previous method
+        #   2) Get the central data flux, at the Doppler shifted central 
+        #      wavelength expected from the model. The maximum flux is 
+        #      taken in the wavelength bin tolerance*wav_resolution/2.
+        #      allowing for small wave shifts due to instrumental effects.
+        #      This does not depend on the model.
+        central_mwav = self.central_mwav[fn]
+        idwav = Data.findClosest(dwav,central_mwav)
+        central_dflux = [max(dflux[abs(dwav-wav)<= \
+                                   self.tolerance/2.*(dwav[i+1]-dwav[i])])
+                         for wav,i in zip(central_mwav,idwav)]
+        #   3) Check if the data flux point is actually significant 
+        #      compared to the noise in the spectrum. Compare with dstd, 
+        #      given d_sigma from path_combocode/usr/Data.dat .
+        #      Insignificant values are multiplied by -1, to indicate they
+        #      are upper limits in the data at that wavelength.
+        central_dflux = array([d >= d_mean+(d_std*d_sigma) \
+                                  and d \
+                                  or -1*abs(d_mean+(d_std*d_sigma)) 
+                               for d in central_dflux])
+        
+        for istar,star in enumerate(self.star_grid):
             #-- Read the convolved sphinx model
-            mwav, mflux = inst.getSphinxConvolution(star,fn)
+            mwav, mflux = self.mconv[fn][istar]
             if list(mflux[mflux < 0]) != []: 
                 print 'There are negative sphinx flux values! They will '+\
                       'not be taken into account.'
             
-            #-- Calculate the peak-to-peak ratios. 
-            #   1) Central wavelengths of mtrans are set in previous method
-            #   2) Get the central model flux, which should coincide exactly 
+            #   4) Get the central model flux, which should coincide exactly 
             #      with the Doppler shifted rest wavelength of the line. If the 
             #      model flux is negative, the value is not used.
-            central_mflux = [mflux[argmin(abs(mwav-wav))] > 0 \
-                                and mflux[argmin(abs(mwav-wav))] \
-                                or None
-                             for wav in self.central_mwav[fn]]
-            #   3) Get the central data flux, at the Doppler shifted central 
-            #      wavelength expected from the model. The maximum flux is 
-            #      taken in the wavelength bin tolerance*wav_resolution/2.
-            #      allowing for small wave shifts due to instrumental effects.
-            central_dflux = [max(dflux[abs(dwav-wav)<= \
-                             self.tolerance/2.*( dwav[argmin(abs(dwav-wav))+1]\
-                                                -dwav[argmin(abs(dwav-wav))])])
-                             for wav in self.central_mwav[fn]]
-            #   4) Check if the data flux point is actually significant 
-            #      compared to the noise in the spectrum. Compare with dstd, 
-            #      given d_sigma from path_combocode/usr/Data.dat .
-            #      Insignificant values are multiplied by -1, to indicate they
-            #      are upper limits in the data at that wavelength.
-            central_dflux = [d >= d_mean+(d_std*d_sigma) \
-                                and d \
-                                or -1*abs(d_mean+(d_std*d_sigma)) 
-                             for d in central_dflux]
-            #   5) Calculate the ratios, only if the model flux is not None 
-            #      (was a negative model flux value: We don't want that)
+            central_mflux = mflux[Data.findClosest(mwav,central_mwav)]
+            #   5) Calculate the ratios, only if the model flux is positive 
+            #      (a negative model flux value: We don't want that)
             #      Negative ratios are possible, in case of ratio lower limits 
+            these_ratios = [None]*len(central_mwav)
+            for i in np.nonzero(central_mflux > 0)[0]:
+                these_ratios[i] = central_mflux[i]/central_dflux[i]
             this_id = star['LAST_%s_MODEL'%inst.instrument.upper()]
-            self.peak_ratios[fn][this_id] = [m <> None and m/d or None
-                                             for m,d in zip(central_mflux,\
-                                                            central_dflux)]
+            self.peak_ratios[fn][this_id] = these_ratios
             
                                                                                 
     def getRatios(self,this_id,sel_type='peak_ratios',\
@@ -11,10 +11,21 @@ import os
 import subprocess
 from glob import glob
 from scipy import array,zeros
+import numpy as np
 import types
 from matplotlib import mlab
 
 import cc.path
+from cc.tools.io import FileCache
+
+
+#-- Output files parsed by readMCMaxOutput and readGastronoomOutput. The 
+#   memory budget is in MB.
+output_cache = FileCache.FileCache(max_size=200)
+
+#-- Columns of the usr and aux tables read by getInputData. The files are 
+#   checked for changes at most once per second.
+table_cache = FileCache.FileCache(max_size=50,check_interval=1)
 
 
 def getMCMaxOutput(incr,filename,keyword='RADIUS',single=1):
@@ -44,23 +55,27 @@ def getMCMaxOutput(incr,filename,keyword='RADIUS',single=1):
                      (default: 1)
     @type single: bool
     
-    @return: The requested data from MCMax output
-    @rtype: list[]
+    @return: The requested data from MCMax output, as an array if single is
+             True
+    @rtype: list[]/array
     
     """
     
     keyword = keyword.upper()
-    data = readFile(filename,' ')
-    i = 1
-    while ' '.join(data[i-1]).upper().find(keyword) == -1:
+    data,column,headers,sections = readMCMaxOutput(filename)
+    if not sections.has_key(keyword):
+        sections[keyword] = [i 
+                             for i,line in headers 
+                             if line.find(keyword) != -1][0]
+    i = sections[keyword]
+    if incr:
         i += 1
-    if not incr:
-        i -= 1
+    else:
         incr = 1
     if single:
-        return [float(line[0]) for line in data[i:i+int(incr)]]
+        return array(column[i:i+int(incr)])
     else:
-        return [line for line in data[i:i+int(incr)]]
+        return [list(line) for line in data[i:i+int(incr)]]
 
 
 
@@ -98,25 +113,128 @@ def getGastronoomOutput(filename,keyword='RADIUS',begin_index=0,\
     """
     
     keyword = keyword.upper()
-    data = readFile(filename,' ')
-    data_col_1 = [d[0] for d in data]
-    key_i = findString(begin_index,data_col_1)
-    key_j = findFloat(key_i,data_col_1)
+    keys,table = readGastronoomOutput(filename,begin_index)
     if not key_index:
-        keys = ' '.join([' '.join(d).replace('\n','') 
-                         for d in data[key_i:key_j]]).split()
         key_index = [key[:len(keyword)].upper() for key in keys].index(keyword)
-    #- Data never start on the first line
-    #- Starting from 1st float, all floats into list, until EOF OR end of block
-    data_i = key_j
-    #- Data may end at EOF or before a new block of data (sphinx fi)
-    data_j = findString(data_i,data_col_1)     
+    column = table[table.dtype.names[key_index]]
     if return_array:
-        return array([float(line[key_index]) 
-                      for line in data[data_i:data_j]])
+        return array(column)
     else:   
-        return [float(line[key_index]) 
-                for line in data[data_i:data_j]]
+        return column.tolist()
+
+
+
+def readMCMaxOutput(filename):
+
+    '''
+    Read an MCMax output file, split into words on every line, and convert the
+    first word of every line to float.
+    
+    Lines of which the first word is not a number are the section headers, 
+    eg RADIUS or DENSITY in denstemp.dat and STELLAR TEMPERATURE in log.dat.
+    The line index of the first header that contains a keyword is kept in the
+    sections dictionary once it is looked up by getMCMaxOutput. 
+    
+    The file is parsed only once, as long as it does not change, so all 
+    quantities in a file such as denstemp.dat are read from the same parsed 
+    lines and array. None of them must be changed by the caller, except for
+    adding keywords to the sections.
+    
+    @param filename: name and path of the MCMax output file
+    @type filename: string
+    
+    @return: The lines split into words, the first word of every line as 
+             float (nan for headers), the line index and upper case line of 
+             every header, and the header line index for every keyword 
+             looked up so far
+    @rtype: (list[list[string]],array,list[(int,string)],dict)
+    
+    '''
+    
+    cache_key = ('MCMax',filename)
+    output = output_cache.get(cache_key,filename)
+    if output is None:
+        data = readFile(filename,' ')
+        column = []
+        headers = []
+        for i,line in enumerate(data):
+            value = convertFloat(line[0])
+            if type(value) is types.StringType:
+                headers.append((i,' '.join(line).upper()))
+                value = np.nan
+            column.append(value)
+        output = (data,array(column,dtype=float),headers,dict())
+        output_cache.set(cache_key,filename,output)
+    return output
+
+
+
+def readGastronoomOutput(filename,begin_index=0):
+
+    '''
+    Read a block of GASTRoNOoM output into a structured array.
+    
+    The block starts with the header lines that give the column keys, at or 
+    after the line with begin_index, and ends at the first line that does not 
+    start with a number. All columns are converted to float at once. The field
+    names of the array are the header keys of the columns, with underscores 
+    appended to keys that occur more than once.
+    
+    The file is parsed only once, as long as it does not change, so all 
+    quantities in a file such as coolfgr_all.dat are read from the same 
+    array. The array must not be changed by the caller.
+    
+    @param filename: The filename of the relevant output GASTRoNOoM file
+    @type filename: string
+    
+    @keyword begin_index: start looking for the header at row with begin_index
+                          (empty lines not counted)
+                    
+                          (default: 0)
+    @type begin_index: int
+    
+    @return: All header keys of the block, which can be more than the number 
+             of columns, and the data with a float field for every column
+    @rtype: (list[string],array)
+    
+    '''
+    
+    cache_key = ('GASTRoNOoM',filename,begin_index)
+    output = output_cache.get(cache_key,filename)
+    if output is not None:
+        return output
+    FILE = open(filename,'r')
+    lines = [line for line in FILE.read().splitlines() if line.split()]
+    FILE.close()
+    data_col_1 = [line.split(None,1)[0] for line in lines]
+    key_i = findString(begin_index,data_col_1)
+    key_j = findFloat(key_i,data_col_1)
+    data_j = findString(key_j,data_col_1)
+    keys = ' '.join(lines[key_i:key_j]).split()
+    
+    #-- Convert the whole block at once. If that fails, the rows differ in 
+    #   length or contain values that are not numbers: convert row by row.
+    ncol = key_j < data_j and len(lines[key_j].split()) or len(keys)
+    nrow = data_j-key_j
+    values = np.fromstring(' '.join(lines[key_j:data_j]),sep=' ')
+    if values.size != nrow*ncol:
+        values = np.empty((nrow,ncol))
+        values.fill(np.nan)
+        for i,line in enumerate(lines[key_j:data_j]):
+            row = [convertFloat(val,nans=1) for val in line.split()[:ncol]]
+            values[i,:len(row)] = row
+    values = values.reshape(nrow,ncol)
+    
+    names = []
+    for i in xrange(ncol):
+        name = i < len(keys) and keys[i] or 'COLUMN%i'%(i+1)
+        while name in names:
+            name += '_'
+        names.append(name)
+    table = values.view(dtype=[(name,float) for name in names])[:,0]
+    output = (keys,table)
+    output_cache.set(cache_key,filename,output)
+    return output
 
 
 
@@ -128,6 +246,9 @@ def getInputData(path=cc.path.usr,keyword='STAR_NAME',filename='Star.dat',\
     as well)
     
     Includes files such as Dust.dat, Star.dat, Indices.dat, Molecule.dat.
+    
+    Every file is parsed once, and every column is kept in the table cache 
+    once requested, until the file changes.
 
     @keyword path: Location of the input file
     
@@ -170,11 +291,70 @@ def getInputData(path=cc.path.usr,keyword='STAR_NAME',filename='Star.dat',\
     """
     
     keyword = keyword.upper()
-    data = [line 
-            for line in readFile(os.path.join(path,filename),' ')
-            if ''.join(line).strip()]
+    filename = os.path.join(path,filename)
+    column_key = ('column',filename,keyword,int(start_index),\
+                  bool(make_float),bool(remove_underscore))
+    elements = table_cache.get(column_key,filename)
+    if elements is None:
+        elements = readInputColumn(filename,keyword,start_index,make_float,\
+                                   remove_underscore)
+        table_cache.set(column_key,filename,elements)
+    if rindex <> None:
+        return elements[rindex]
+    else:
+        return list(elements)
+
+
+
+def readInputTable(filename):
+
+    '''
+    Read a usr or aux table such as Molecule.dat, split into words on every 
+    line.
+    
+    The table is read once and kept in the table cache as long as the file 
+    does not change. It must not be changed by the caller.
+    
+    @param filename: The full filename of the table
+    @type filename: string
+    
+    @return: The non-empty lines split into words, and the lines joined again 
+             for searching keywords
+    @rtype: (list[list[string]],list[string])
+    
+    '''
+    
+    table_key = ('table',filename)
+    table = table_cache.get(table_key,filename)
+    if table is None:
+        data = [line 
+                for line in readFile(filename,' ')
+                if ''.join(line).strip()]
+        table = (data,[' '.join(line) for line in data])
+        table_cache.set(table_key,filename,table)
+    return table
+
+
+
+def readInputColumn(filename,keyword,start_index=1,make_float=1,\
+                    remove_underscore=0):
+
+    '''
+    Read a column of a usr or aux table. See getInputData for the keywords.
+    
+    @param filename: The full filename of the table
+    @type filename: string
+    @param keyword: The column header, in upper case
+    @type keyword: string
+    
+    @return: The column
+    @rtype: list
+    
+    '''
+    
+    data,lines = readInputTable(filename)
     i = int(start_index)
-    while ' '.join(data[i-1]).find(keyword) == -1:
+    while lines[i-1].find(keyword) == -1:
         i += 1
     data_index = [line.strip('#') 
                   for line in data[i-1]
@@ -201,10 +381,7 @@ def getInputData(path=cc.path.usr,keyword='STAR_NAME',filename='Star.dat',\
             elements = [line[data_index] 
                         for line in data[i:end_index] 
                         if line[0]]
-    if rindex <> None:
-        return elements[rindex]
-    else:
-        return elements
+    return elements
 
 
 def readFile(filename,delimiter=None,replace_spaces=1):
@@ -9,14 +9,24 @@ Author: Robin Lombaert
 
 import os
 import cPickle
-import time
+import cStringIO
+import fcntl
 import subprocess
+import shutil
 from glob import glob
 
 import cc.path
 from cc.tools.io import DataIO
 
 
+#-- First record of a database saved as a log. A database starting with a dict
+#   instead is saved in the old format.
+LOG_HEADER = ('ComboCode.Database','log',1)
+
+#-- Placeholder for a value that is not present, used when merging entries.
+MISSING = object()
+
+
 def updateDustMCMaxDatabase(filename):
 
     '''
@@ -260,6 +270,104 @@ def addUseStarfileToMline(db_fn):
     
     
 
+def convertDatabaseToLog(db_path):
+    
+    '''
+    Convert a database saved in the old format (a single pickled dict) to the
+    append-only log format used by Database(). 
+    
+    A copy of the old database is kept as db_path_legacy.
+    
+    @param db_path: The filename and path of the database.
+    @type db_path: string
+    
+    '''
+    
+    if not os.path.isfile(db_path):
+        raise IOError('No database present at %s.'%db_path)
+    db = Database(db_path)
+    if not db.isLegacy():
+        print 'Database at %s is already in the log format.'%db_path
+        return
+    print '** Converting database at %s to the log format...'%db_path
+    shutil.copy2(db_path,'%s_legacy'%db_path)
+    db.compact()
+    print '** Done!'
+    
+    
+
+def convertDatabaseFolderToLog(folder):
+    
+    '''
+    Convert all databases (*.db) in a folder to the log format. 
+    
+    For instance, all GASTRoNOoM databases of an output folder are converted
+    by passing os.path.join(cc.path.gastronoom,path_gastronoom).
+    
+    @param folder: The folder that contains the databases.
+    @type folder: string
+    
+    '''
+    
+    for db_path in sorted(glob(os.path.join(folder,'*.db'))):
+        convertDatabaseToLog(db_path)
+    
+    
+
+def mergeValues(base,ours,theirs):
+    
+    '''
+    Merge two versions of a database entry that were changed concurrently.
+    
+    This is a three-way merge with respect to the version both started from. 
+    Dictionaries are merged key by key, recursively, so that entries added by 
+    either version are kept, eg model ids added to the same cooling model by 
+    two ComboCode sessions. Entries changed by both versions are taken from 
+    ours. An entry removed by one version is only removed if the other one did
+    not change it.
+    
+    If the common version is not known, it is given as MISSING. Entries that 
+    are present in only one of both versions are then kept.
+    
+    @param base: The version both started from, MISSING if not known.
+    @type base: any
+    @param ours: The version in memory, MISSING if deleted.
+    @type ours: any
+    @param theirs: The version on the hard disk, MISSING if deleted.
+    @type theirs: any
+    
+    @return: The merged version, MISSING if the entry is removed.
+    @rtype: any
+    
+    '''
+    
+    def equal(a,b):
+        #-- Comparisons of array values are ambiguous; treat them as different
+        try:
+            return bool(a == b)
+        except ValueError:
+            return False
+    
+    if equal(ours,theirs) or equal(theirs,base):
+        return ours
+    if equal(ours,base):
+        return theirs
+    if ours is MISSING:
+        return theirs
+    if not isinstance(ours,dict) or not isinstance(theirs,dict):
+        return ours
+    if not isinstance(base,dict):
+        base = dict()
+    merged = dict()
+    for k in set(ours.keys()+theirs.keys()):
+        value = mergeValues(base.get(k,MISSING),ours.get(k,MISSING),\
+                            theirs.get(k,MISSING))
+        if value is not MISSING:
+            merged[k] = value
+    return merged
+    
+    
+
 class Database(dict):
     
     '''
@@ -270,9 +378,22 @@ class Database(dict):
     It functions as a python dictionary with the extra option of synchronizing
     the database instance with the dictionary saved on the hard disk. 
     
-    No changes will be made to the hard disk copy, unless Database.sync() is 
+    No changes will be made to the hard disk copy, unless Database.sync() is
     called.
-    
+
+    The hard disk copy is an append-only log: every sync() appends one record
+    per changed or deleted key, so the cost of a sync scales with the size of
+    the change rather than with the size of the database. The log is compacted
+    (ie rewritten with a single record per key) once it holds too many
+    superseded records. Databases in the old format, a single pickled dict,
+    can still be read and are converted to the log format upon the first
+    sync(). Use convertDatabaseToLog() to convert them beforehand.
+
+    Several instances, also in different processes, can work with the same 
+    database. Reading and writing the hard disk copy is protected by an 
+    advisory lock on db_path.lock. Concurrent changes to the same key are 
+    merged upon sync(), rather than one overwriting the other.
+
     Note that changes made on a deeper level than the (key,value) pairs of the 
     Database (for instance in the case where value is a dict() type itself) 
     will not be automatically taken into account when calling the sync() 
@@ -342,10 +463,14 @@ class Database(dict):
     >>> db2.read()
     >>> print db2['test3']
     defval
-    >>> os.system('rm %s'%filename)
+    >>> os.system('rm %s %s.lock'%(filename,filename))
     0
     '''
     
+    #-- The log is compacted once it holds more than compact_factor records per
+    #   key in the database, plus min_log records.
+    compact_factor = 2
+    min_log = 1000
     
     def __init__(self,db_path):
         
@@ -355,7 +480,8 @@ class Database(dict):
         Upon initialization, the class will read the dictionary saved at the 
         db_path given as a dictionary.
         
-        Note that cPickle is used to write and read these dictionaries.
+        Note that cPickle is used to write and read the records of the 
+        database log.
         
         If no database exists at db_path, a new dictionary will be created.
         
@@ -367,9 +493,30 @@ class Database(dict):
         super(Database, self).__init__()
         self.path = db_path
         self.folder = os.path.split(self.path)[0]
-        self.read()
         self.__changed = []
         self.__deleted = []
+        #-- Position up to which the log on the hard disk has been read, the 
+        #   inode of the log file at that time, and the number of records read
+        #   so far (ie including superseded ones)
+        self.__offset = 0
+        self.__inode = None
+        self.__nrecords = 0
+        self.__legacy = False
+        #-- Version of every key as last read from the hard disk, and the 
+        #   position in the log of the record that set its value. Versions are
+        #   drawn from a counter for the whole database, so they are never 
+        #   reused. The log id identifies the database across compactions.
+        self.__versions = dict()
+        self.__positions = dict()
+        self.__maxversion = 0
+        self.__logid = None
+        #-- Keys updated from or saved to the hard disk, in order. Starts anew
+        #   (with a new generation) whenever the database is read in full.
+        self.__updates = []
+        self.__generation = 0
+        #-- Indices built on this database by name, see DatabaseIndex.getIndex
+        self.indices = dict()
+        self.read()
       
       
       
@@ -533,34 +680,222 @@ class Database(dict):
         initialisation, a new Database is made by saving an empty dict() at the
         requested location.        
         
-        Reading and saving of the database is done by cPickle-ing the dict(). 
+        The full log is replayed while holding a shared lock on the database. 
+        Reading and saving of the records is done by cPickle-ing them.
         
         '''
         
+        self.clear()
+        self.__offset = 0
+        self.__inode = None
+        self.__nrecords = 0
+        self.__legacy = False
+        self.__versions = dict()
+        self.__positions = dict()
+        self.__maxversion = 0
+        self.__logid = None
+        self.__updates = []
+        self.__generation += 1
+        if os.path.isfile(self.path):
+            lockfile = self.__lock(fcntl.LOCK_SH)
+        else:
+            lockfile = self.__lock(fcntl.LOCK_EX)
         try:
-            while True:
-                dbfile = open(self.path,'r')
-                try:
-                    try:
-                        db = cPickle.load(dbfile)
-                        dbfile.close()
-                        break
-                    except ValueError:
-                        print 'Loading database failed: ValueError ~ ' + \
-                              'insecure string pickle. Waiting 5 seconds ' + \
-                              'and trying again.' 
-                        dbfile.close()
-                        time.sleep(5)
-                except EOFError:
-                    print 'Loading database failed: EOFError. Waiting 5 ' + \
-                          'seconds and trying again.'
-                    dbfile.close()
-                    time.sleep(5)
-            self.clear()
-            super(Database,self).update(db)
-        except IOError:
-            print 'No database present at %s. Creating a new one.'%self.path
-            self.__save()
+            if os.path.isfile(self.path):
+                self.__replay()
+            else:
+                print 'No database present at %s. Creating a new one.'\
+                      %self.path
+                self.__compact()
+        finally:
+            self.__unlock(lockfile)
+
+
+
+    def refresh(self):
+
+        '''
+        Apply the changes made to the database on the hard disk by other
+        instances since the last read, while keeping the changes in memory.
+
+        Unlike read(), only the records appended to the log since the last read
+        are applied, while holding a shared lock on the database. Nothing is 
+        written to the hard disk. Keys changed in memory that were changed by
+        another instance as well are merged right away, as in sync(), and are
+        saved by the next sync(). A key deleted in memory that was changed by 
+        another instance in the mean time is not deleted.
+
+        '''
+
+        pending = set(self.__changed).union(self.__deleted)
+        current_db = dict([(k,v) for k,v in self.items() if k in pending])
+        versions = dict([(k,self.__versions.get(k)) for k in pending])
+        positions = dict([(k,self.__positions.get(k)) for k in pending])
+        inode = self.__inode
+        lockfile = self.__lock(fcntl.LOCK_SH)
+        try:
+            self.__replay()
+            for key in pending:
+                if self.__versions.get(key) == versions[key]:
+                    if current_db.has_key(key):
+                        super(Database,self).__setitem__(key,current_db[key])
+                    else:
+                        super(Database,self).pop(key,None)
+                elif current_db.has_key(key):
+                    base = MISSING
+                    if positions[key] is not None and inode == self.__inode:
+                        base = self.__readRecord(positions[key])[2]
+                    value = mergeValues(base,current_db[key],\
+                                        self.get(key,MISSING))
+                    super(Database,self).__setitem__(key,value)
+                else:
+                    self.__deleted = [k for k in self.__deleted if k != key]
+        finally:
+            self.__unlock(lockfile)
+
+
+
+    def __lock(self,mode):
+        
+        '''
+        Acquire an advisory lock on the database.
+        
+        Only called by Database() internally. The lock is set on a separate 
+        file, db_path.lock, because the database file itself is replaced when 
+        the log is compacted. The call blocks until the lock is granted.
+        
+        @param mode: The lock mode, fcntl.LOCK_SH for reading and 
+                     fcntl.LOCK_EX for writing.
+        @type mode: int
+        
+        @return: The open lock file, to be passed to __unlock().
+        @rtype: file
+        
+        '''
+        
+        lockfile = open('%s.lock'%self.path,'a')
+        fcntl.flock(lockfile.fileno(),mode)
+        return lockfile
+        
+        
+        
+    def __unlock(self,lockfile):
+        
+        '''
+        Release an advisory lock on the database.
+        
+        Only called by Database() internally. 
+        
+        @param lockfile: The lock file returned by __lock().
+        @type lockfile: file
+        
+        '''
+        
+        fcntl.flock(lockfile.fileno(),fcntl.LOCK_UN)
+        lockfile.close()
+        
+        
+    
+    def __replay(self):
+        
+        '''
+        Apply the records appended to the log on the hard disk since the last 
+        time it was read.
+        
+        Only called by Database() internally, while holding a lock. If the log 
+        file was replaced in the mean time (ie compacted by another instance), 
+        the full log is replayed. 
+        
+        The version of every key and the position of the record that set its 
+        value are remembered, for conflict checks in sync(). 
+        
+        Databases in the old format are always read in full. An empty file is 
+        treated as an empty database in the old format.
+        
+        @return: False if the log ends with an incomplete record, which can 
+                 only be left behind by an instance that crashed while writing.
+        @rtype: bool
+        
+        '''
+        
+        dbfile = open(self.path,'rb')
+        try:
+            inode = os.fstat(dbfile.fileno()).st_ino
+            if inode != self.__inode or self.__legacy:
+                super(Database,self).clear()
+                self.__offset = 0
+                self.__nrecords = 0
+                self.__inode = inode
+                self.__versions = dict()
+                self.__positions = dict()
+                self.__maxversion = 0
+                self.__updates = []
+                self.__generation += 1
+            dbfile.seek(self.__offset)
+            data = dbfile.read()
+        finally:
+            dbfile.close()
+        buf = cStringIO.StringIO(data)
+        if self.__offset == 0:
+            if not data:
+                self.__legacy = True
+                return True
+            try:
+                header = cPickle.load(buf)
+            except (EOFError,ValueError,cPickle.UnpicklingError):
+                raise IOError('Database at %s is corrupted: '%self.path + \
+                              'its first entry cannot be read.')
+            if isinstance(header,dict):
+                self.__legacy = True
+                super(Database,self).update(header)
+                return True
+            self.__legacy = False
+            if len(header) > len(LOG_HEADER):
+                self.__maxversion,self.__logid = header[len(LOG_HEADER):]
+        end = buf.tell()
+        while True:
+            try:
+                record = cPickle.load(buf)
+            except (EOFError,ValueError,cPickle.UnpicklingError):
+                break
+            key = record[1]
+            self.__nrecords += 1
+            self.__versions[key] = record[-1]
+            self.__maxversion = max(self.__maxversion,record[-1])
+            self.__updates.append(key)
+            if record[0] == 'set':
+                super(Database,self).__setitem__(key,record[2])
+                self.__positions[key] = self.__offset + end
+            else:
+                super(Database,self).pop(key,None)
+                self.__positions.pop(key,None)
+            end = buf.tell()
+        self.__offset += end
+        return end == len(data)
+        
+        
+        
+    def __readRecord(self,position):
+        
+        '''
+        Read a single record from the log on the hard disk.
+        
+        Only called by Database() internally, while holding a lock. 
+        
+        @param position: The position of the record in the log file.
+        @type position: int
+        
+        @return: The record
+        @rtype: tuple
+        
+        '''
+        
+        dbfile = open(self.path,'rb')
+        try:
+            dbfile.seek(position)
+            return cPickle.load(dbfile)
+        finally:
+            dbfile.close()
                 
                 
                 
@@ -570,9 +905,10 @@ class Database(dict):
         Update the database on the harddisk and in the memory.
          
         The database is read anew, ie updated with the hard disk version to 
-        account for any changes made by a different program. Next, the changes
-        made to the database in memory are applied, before saving the database
-        to the hard disk again.
+        account for any changes made by a different program. Only the records
+        appended to the log since the last read are applied. Next, the changes
+        made to the database in memory are applied, before appending them to 
+        the log on the hard disk.
         
         Any items deleted from the database in memory will also be deleted from
         the version saved on the hard disk!
@@ -581,74 +917,182 @@ class Database(dict):
         to which entries can be added manually using the addChangedKey method, 
         or automatically by calling .update(), .__setitem__() or .setdefault().
         
+        All of this happens while holding an exclusive lock on the database, 
+        so other instances wait for the sync to finish rather than overwrite 
+        it. Every key carries a version number. If a key was changed by 
+        another instance since it was last read by this one, both versions are
+        merged (see mergeValues()). A key deleted here that was changed by 
+        another instance in the mean time is not deleted.
+        
+        The log is compacted when the number of records in it exceeds 
+        Database.compact_factor times the number of keys in the database plus
+        Database.min_log, and whenever the database on the hard disk is still 
+        in the old format.
+        
         '''
         
         if self.__changed or self.__deleted:
             current_db = dict([(k,v) 
                                for k,v in self.items() 
                                if k in set(self.__changed)])
-            while True:    
-                self.read()
-                self.__deleted = list(set(self.__deleted))
-                for key in self.__deleted:
-                    try:
-                        super(Database,self).__delitem__(key)
-                    except KeyError:
-                        pass
-                super(Database,self).update(current_db)
-                backup_file = self.__save()
-                try:
-                    #-- Read the object, if TypeError, catch and repeat (which  
-                    #   can happen if db written into by two instances of 
-                    #   Database at the same time)
-                    testread = Database(self.path)
-                    #-- If the read object is not the same as the one in memory, 
-                    #   repeat writing as well. 
-                    if testread != self:
-                        raise TypeError
-                    #-- Remove backup if all is fine. If not, it won't be 
-                    #   removed: tracer for issues if they occur.
-                    if backup_file and os.path.isfile(backup_file):
-                        subprocess.call(['rm %s'%(backup_file)],shell=True)
-                    break
-                except TypeError: 
-                    #-- Just wait a few seconds to allow other instances to 
-                    #   finish writing
-                    time.sleep(2)
+            deleted = set(self.__deleted).difference(current_db.keys())
+            versions = dict([(k,self.__versions.get(k,0)) 
+                             for k in deleted.union(current_db.keys())])
+            positions = dict([(k,self.__positions.get(k)) 
+                              for k in current_db.keys()])
+            inode = self.__inode
+            lockfile = self.__lock(fcntl.LOCK_EX)
+            try:
+                if not self.__replay():
+                    print 'WARNING! Removing an incomplete entry at the ' + \
+                          'end of the database at %s.'%self.path
+                    dbfile = open(self.path,'r+b')
+                    dbfile.truncate(self.__offset)
+                    dbfile.close()
+                records = []
+                new_version = self.__maxversion + 1
+                for key in deleted:
+                    if self.__versions.get(key,0) != versions[key]:
+                        continue
+                    super(Database,self).pop(key,None)
+                    self.__versions[key] = new_version
+                    records.append(('del',key,new_version))
+                for key,value in current_db.items():
+                    if self.__versions.get(key,0) != versions[key]:
+                        base = MISSING
+                        if positions[key] is not None and inode == self.__inode:
+                            base = self.__readRecord(positions[key])[2]
+                        value = mergeValues(base,value,\
+                                            self.get(key,MISSING))
+                    super(Database,self).__setitem__(key,value)
+                    self.__versions[key] = new_version
+                    records.append(('set',key,value,new_version))
+                self.__maxversion = new_version
+                nrecords = self.__nrecords + len(records)
+                if self.__legacy \
+                      or nrecords > self.compact_factor*len(self)+self.min_log:
+                    self.__compact()
+                else:
+                    self.__append(records)
+            finally:
+                self.__unlock(lockfile)
             self.__deleted = []
             self.__changed = []
     
     
     
-    def __save(self):
+    def __append(self,records):
         
         '''
-        Save a database. 
+        Append records to the log on the hard disk.
         
-        Only called by Database() internally. Use sync() to save the Database
-        to the hard disk.
+        Only called by Database() internally, while holding an exclusive lock 
+        and after the log has been read up to its end. Use sync() to save the 
+        Database to the hard disk.
         
-        Reading and saving of the database is done by cPickle-ing the dict(). 
+        The records are pickled in memory first, and written to the log in a 
+        single write call.
         
-        @return: the filename of the backup database is returned
-        @rtype: string
+        @param records: The records, either ('set',key,value,version) or 
+                        ('del',key,version)
+        @type records: list[tuple]
         
         '''
         
-        backup_file = ''
-        if os.path.isfile(self.path):
-            i = 0
-            backup_file =  '%s_backup%i'%(self.path,i)
-            while os.path.isfile(backup_file):
-                i += 1
-                backup_file = '%s_backup%i'%(self.path,i)
-            subprocess.call(['mv %s %s'%(self.path,backup_file)],\
-                            shell=True)
-        #-- Write the file, dump the object
-        dbfile = open(self.path,'w')
-        cPickle.dump(self,dbfile)
-        dbfile.close()
-        return backup_file
+        data = []
+        position = self.__offset
+        self.__updates.extend([r[1] for r in records])
+        for r in records:
+            if r[0] == 'set':
+                self.__positions[r[1]] = position
+            else:
+                self.__positions.pop(r[1],None)
+            data.append(cPickle.dumps(r,cPickle.HIGHEST_PROTOCOL))
+            position += len(data[-1])
+        dbfile = open(self.path,'ab')
+        try:
+            dbfile.write(''.join(data))
+            dbfile.flush()
+            os.fsync(dbfile.fileno())
+        finally:
+            dbfile.close()
+        self.__offset = position
+        self.__nrecords += len(records)
+        
+    
+    
+    def __compact(self):
+        
+        '''
+        Save the full database as a new log, with one record per key.
+        
+        Only called by Database() internally, while holding an exclusive lock. 
+        Use sync() or compact() to save the Database to the hard disk.
+        
+        The log is written to a temporary file first, which then replaces the 
+        database file. The version numbers of the keys are kept, and the 
+        highest version number given out so far is saved in the header along 
+        with the log id. A new log id is made for a new database.
+        
+        '''
+        
+        if self.__logid is None:
+            self.__logid = os.urandom(8).encode('hex')
+        temp_file = '%s_compact%i'%(self.path,os.getpid())
+        dbfile = open(temp_file,'wb')
+        try:
+            cPickle.dump(LOG_HEADER+(self.__maxversion,self.__logid),dbfile,\
+                         cPickle.HIGHEST_PROTOCOL)
+            self.__positions = dict()
+            for k,v in self.items():
+                self.__positions[k] = dbfile.tell()
+                cPickle.dump(('set',k,v,self.__versions.get(k,0)),dbfile,\
+                             cPickle.HIGHEST_PROTOCOL)
+            dbfile.flush()
+            os.fsync(dbfile.fileno())
+            self.__offset = dbfile.tell()
+            self.__inode = os.fstat(dbfile.fileno()).st_ino
+        finally:
+            dbfile.close()
+        os.rename(temp_file,self.path)
+        self.__nrecords = len(self)
+        self.__legacy = False
+    
+    
+    
+    def compact(self):
+        
+        '''
+        Compact the log on the hard disk, after synchronizing the database.
+        
+        This happens automatically during sync() when required, but can be 
+        forced by calling this method. It also converts a database in the old 
+        format to the log format.
+        
+        '''
+        
+        self.sync()
+        lockfile = self.__lock(fcntl.LOCK_EX)
+        try:
+            self.__replay()
+            self.__compact()
+        finally:
+            self.__unlock(lockfile)
+    
+    
+    
+    def isLegacy(self):
+        
+        '''
+        Is the database on the hard disk saved in the old format, ie a single
+        pickled dict?
+        
+        @return: True if the old format is used.
+        @rtype: bool
+        
+        '''
+        
+        return self.__legacy
             
     
     
@@ -686,6 +1130,74 @@ class Database(dict):
     
     
     
+    def getVersion(self,key):
+        
+        '''
+        Return the version of a key, as last read from or saved to the hard 
+        disk. 
+        
+        Every sync() that saves a key gives it a higher version. Keys read from
+        a database in the old format have no version.
+        
+        @param key: The key
+        @type key: a type valid for a dict key
+        
+        @return: The version, None if not known
+        @rtype: int
+        
+        '''
+        
+        return self.__versions.get(key)
+        
+        
+        
+    def getLogId(self):
+        
+        '''
+        Return the id of the database log on the hard disk. 
+        
+        The id is made when the database is created or converted from the old 
+        format, and kept when the log is compacted. Together with getVersion()
+        it identifies the content of a key.
+        
+        @return: The log id, None for a database in the old format
+        @rtype: string
+        
+        '''
+        
+        return self.__logid
+        
+        
+        
+    def getUpdatedKeys(self,mark=None):
+        
+        '''
+        Return the keys that were updated from or saved to the hard disk since
+        a given mark.
+        
+        Changes in memory that have not been synchronized yet are not included,
+        see getChangedKeys() and getDeletedKeys() for those.
+        
+        @keyword mark: The mark returned by an earlier call, None to start 
+                       tracking updates.
+                       
+                       (default: None)
+        @type mark: tuple
+        
+        @return: The updated keys, possibly with duplicates, or None if the 
+                 database was read in full since the mark (ie any key may have
+                 changed). Also returns a new mark.
+        @rtype: (list,tuple)
+        
+        '''
+        
+        new_mark = (self.__generation,len(self.__updates))
+        if mark is None or mark[0] != self.__generation:
+            return None,new_mark
+        return self.__updates[mark[1]:],new_mark
+        
+        
+        
     def getChangedKeys(self):
         
         '''
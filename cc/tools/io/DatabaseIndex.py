@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+"""
+An index on the parameters of the models in a Database, for fast retrieval of
+older models.
+
+"""
+
+import os
+import types
+import cPickle
+import itertools
+from math import log, floor
+
+#-- Tolerances used by ModelingSession.compareCommandLists: relative for float
+#   parameters, absolute for parameters equal to zero.
+TOLERANCE = 0.001
+ZERO = 1e-10
+
+#-- Width of the logarithmic buckets for float parameters. Must be much wider
+#   than the tolerance, so a tolerance interval spans at most two buckets.
+BUCKET = log(1.1)
+
+
+
+def getIndex(db,name,**kwargs):
+
+    '''
+    Return an index on a database, creating it if it does not exist yet.
+
+    The index is kept with the Database() instance, so all modeling sessions
+    that share a database also share its indices.
+
+    @param db: The database
+    @type db: Database()
+    @param name: The name of the index, eg 'cooling'
+    @type name: string
+
+    @keyword kwargs: Extra keywords passed to DatabaseIndex() if the index is
+                     created.
+    @type kwargs: dict
+
+    @return: The index
+    @rtype: DatabaseIndex()
+
+    '''
+
+    if not db.indices.has_key(name):
+        db.indices[name] = DatabaseIndex(db=db,name=name,**kwargs)
+    return db.indices[name]
+
+
+
+class DatabaseIndex(object):
+
+    '''
+    An index on the model parameters in a Database.
+
+    The index narrows down the database entries that can match a set of
+    parameters in ModelingSession.compareCommandLists, without comparing them
+    one by one. Every entry is hashed on its parameters: parameters that can be
+    converted to float are quantized in logarithmic buckets, all others are
+    used as they are. A lookup then only has to check the one or two buckets
+    that overlap with the tolerance interval of every float parameter.
+
+    The candidates returned by a lookup are a superset of the matching entries.
+    They still have to be compared with compareCommandLists, which guarantees
+    the same matching as a full scan of the database.
+
+    The index follows changes made to the database through getUpdatedKeys(),
+    so only changed entries are hashed anew. It is saved next to the database
+    as db_path_name.index, together with the database version of every entry,
+    so a new session only has to hash the entries that changed since.
+
+    '''
+
+    def __init__(self,db,name,keywords=None,depth=1,group=[],\
+                 max_combinations=256):
+
+        '''
+        Initializing a DatabaseIndex instance.
+
+        @param db: The database
+        @type db: Database()
+        @param name: The name of the index, used for the filename
+        @type name: string
+
+        @keyword keywords: The parameters that are compared. None if all
+                           parameters present in the entries are compared, as
+                           is the case for MCMax.
+
+                           (default: None)
+        @type keywords: list[string]
+        @keyword depth: The depth of the entries in the database, eg 3 for the
+                        mline database: db[cooling_id][mline_id][molecule]
+
+                        (default: 1)
+        @type depth: int
+        @keyword group: Indices in the path to an entry (eg (cooling_id,
+                        mline_id,molecule)) that select the group of entries
+                        in which a lookup is done, eg [0,2] for the mline
+                        database.
+
+                        (default: [])
+        @type group: list[int]
+        @keyword max_combinations: The maximum number of bucket combinations
+                                   checked for a lookup. If a lookup requires
+                                   more, all entries in the group are returned.
+
+                                   (default: 256)
+        @type max_combinations: int
+
+        '''
+
+        self.db = db
+        self.name = name
+        self.keywords = keywords is not None and tuple(keywords) or None
+        self.depth = depth
+        self.group = tuple(group)
+        self.max_combinations = max_combinations
+        self.path = '%s_%s.index'%(db.path,name)
+        #-- Hash table (group,signature): paths, all paths per group, and the
+        #   (path,group,signature) entries and version per database key
+        self.__table = dict()
+        self.__groups = dict()
+        self.__entries = dict()
+        self.__versions = dict()
+        self.__mark = None
+        self.__load()
+
+
+
+    def __load(self):
+
+        '''
+        Load the index from the hard disk, if it was made for the same database
+        log and with the same settings.
+
+        Entries that changed since are hashed anew at the first lookup.
+
+        '''
+
+        if not os.path.isfile(self.path) or self.db.getLogId() is None:
+            return
+        indexfile = open(self.path,'rb')
+        try:
+            saved = cPickle.load(indexfile)
+        except (EOFError,ValueError,cPickle.UnpicklingError):
+            print 'WARNING! Index at %s cannot be read. '%self.path + \
+                  'Building it anew.'
+            return
+        finally:
+            indexfile.close()
+        if saved['settings'] != (self.db.getLogId(),self.keywords,\
+                                 self.depth,self.group):
+            return
+        for key,entries in saved['entries'].items():
+            self.__insert(key,entries,saved['versions'][key])
+
+
+
+    def save(self):
+
+        '''
+        Save the index to the hard disk.
+
+        The index is written to a temporary file first, which then replaces the
+        index file. Nothing is saved for a database in the old format.
+
+        '''
+
+        if self.db.getLogId() is None:
+            return
+        saved = dict([('settings',(self.db.getLogId(),self.keywords,\
+                                   self.depth,self.group)),\
+                      ('entries',self.__entries),\
+                      ('versions',self.__versions)])
+        temp_file = '%s_%i'%(self.path,os.getpid())
+        indexfile = open(temp_file,'wb')
+        try:
+            cPickle.dump(saved,indexfile,cPickle.HIGHEST_PROTOCOL)
+        finally:
+            indexfile.close()
+        os.rename(temp_file,self.path)
+
+
+
+    def update(self):
+
+        '''
+        Bring the index up to date with the database.
+
+        Only the keys updated in the database since the last call are hashed
+        anew, as well as the keys changed in memory but not yet synchronized.
+        If the database was read in full, all versions are checked, and the
+        index is saved if anything changed.
+
+        '''
+
+        keys,self.__mark = self.db.getUpdatedKeys(self.__mark)
+        if keys is None:
+            keys = [k
+                    for k in self.db.keys()
+                    if not self.__entries.has_key(k) \
+                        or self.__versions[k] is None \
+                        or self.__versions[k] != self.db.getVersion(k)]
+            keys += [k for k in self.__entries.keys() if not self.db.has_key(k)]
+            save = bool(keys)
+        else:
+            save = False
+        keys = set(keys + self.db.getChangedKeys() + self.db.getDeletedKeys())
+        for key in keys:
+            self.__remove(key)
+            if self.db.has_key(key):
+                self.__insert(key,self.__hash(key),self.db.getVersion(key))
+        if save:
+            self.save()
+
+
+
+    def lookup(self,query,group=()):
+
+        '''
+        Return the database entries that can match a set of parameters.
+
+        The entries are returned as paths in the database, eg (model_id,) for
+        the cooling database, in sorted order. They still have to be compared
+        with the parameters one by one, eg with compareCommandLists.
+
+        @param query: The parameters, eg a command_list
+        @type query: dict
+
+        @keyword group: The values at the group indices of the path, eg
+                        (cooling_id,molecule) for the mline database.
+
+                        (default: ())
+        @type group: tuple
+
+        @return: The paths of the candidate entries
+        @rtype: list[tuple]
+
+        '''
+
+        self.update()
+        group = tuple(group)
+        options = []
+        for k in sorted(self.__keywords(query)):
+            tokens = self.__candidates(k,query[k])
+            if not tokens:
+                return []
+            options.append([(k,t) for t in tokens])
+        if reduce(lambda x,y: x*len(y),options,1) > self.max_combinations:
+            return sorted(self.__groups.get(group,[]))
+        paths = set()
+        for signature in itertools.product(*options):
+            paths.update(self.__table.get((group,signature),[]))
+        return sorted(paths)
+
+
+
+    def __insert(self,key,entries,version):
+
+        '''
+        Add the hashed entries of a database key to the index.
+
+        @param key: The database key
+        @type key: a type valid for a dict key
+        @param entries: The (path,group,signature) of every entry for the key
+        @type entries: list[tuple]
+        @param version: The database version of the key
+        @type version: int
+
+        '''
+
+        self.__entries[key] = entries
+        self.__versions[key] = version
+        for path,group,signature in entries:
+            self.__table.setdefault((group,signature),set()).add(path)
+            self.__groups.setdefault(group,set()).add(path)
+
+
+
+    def __remove(self,key):
+
+        '''
+        Remove the hashed entries of a database key from the index.
+
+        @param key: The database key
+        @type key: a type valid for a dict key
+
+        '''
+
+        self.__versions.pop(key,None)
+        for path,group,signature in self.__entries.pop(key,[]):
+            paths = self.__table[(group,signature)]
+            paths.discard(path)
+            if not paths:
+                del self.__table[(group,signature)]
+            self.__groups[group].discard(path)
+            if not self.__groups[group]:
+                del self.__groups[group]
+
+
+
+    def __hash(self,key):
+
+        '''
+        Hash all entries in the database for a key.
+
+        @param key: The database key
+        @type key: a type valid for a dict key
+
+        @return: The (path,group,signature) of every entry
+        @rtype: list[tuple]
+
+        '''
+
+        entries = [((key,),self.db[key])]
+        for i in range(self.depth-1):
+            entries = [(path+(k,),v)
+                       for path,value in entries
+                       if isinstance(value,dict)
+                       for k,v in value.items()]
+        return [(path,tuple([path[i] for i in self.group]),\
+                 tuple([(k,self.__token(k,entry[k]))
+                        for k in sorted(self.__keywords(entry))]))
+                for path,entry in entries
+                if isinstance(entry,dict)]
+
+
+
+    def __keywords(self,parameters):
+
+        '''
+        Return the parameters that are compared, out of those given.
+
+        @param parameters: The parameters
+        @type parameters: dict
+
+        @return: The parameter names
+        @rtype: list[string]
+
+        '''
+
+        if self.keywords is None:
+            return [k for k in parameters.keys() if k != 'IN_PROGRESS']
+        return [k for k in self.keywords if parameters.has_key(k)]
+
+
+
+    def __number(self,keyword,value):
+
+        '''
+        Convert a parameter to float the way compareCommandLists does.
+
+        @param keyword: The parameter name
+        @type keyword: string
+        @param value: The parameter value
+        @type value: any
+
+        @return: The float, None if the value is compared as is
+        @rtype: float
+
+        '''
+
+        if keyword == 'STEP_RS_RIN' and type(value) is types.StringType:
+            value = value.replace('d','e')
+        try:
+            return float(value)
+        except (TypeError,ValueError):
+            return None
+
+
+
+    def __bucket(self,number):
+
+        '''
+        Return the bucket of a float parameter.
+
+        @param number: The parameter value
+        @type number: float
+
+        @return: The bucket
+        @rtype: tuple
+
+        '''
+
+        if abs(number) <= ZERO:
+            return ('num',0)
+        if number != number or abs(number) == float('inf'):
+            return ('num','nan')
+        return ('num',number > 0 and 1 or -1,\
+                int(floor(log(abs(number))/BUCKET+0.5)))
+
+
+
+    def __token(self,keyword,value):
+
+        '''
+        Return the token of a parameter in a database entry.
+
+        Values that are not converted to float are compared for equality.
+        Equal values always have equal tokens, but unhashable values only give
+        their type and length.
+
+        @param keyword: The parameter name
+        @type keyword: string
+        @param value: The parameter value
+        @type value: any
+
+        @return: The token
+        @rtype: tuple
+
+        '''
+
+        number = self.__number(keyword,value)
+        if number is not None:
+            return self.__bucket(number)
+        if isinstance(value,dict):
+            return ('dict',tuple(sorted(value.keys())))
+        if isinstance(value,(list,tuple)):
+            return ('seq',len(value))
+        try:
+            hash(value)
+        except TypeError:
+            return ('other',)
+        return ('exact',value)
+
+
+
+    def __candidates(self,keyword,value):
+
+        '''
+        Return the tokens of database entries that can match a parameter.
+
+        For a float, these are the buckets at both ends of the tolerance
+        interval, which is never wider than a bucket.
+
+        @param keyword: The parameter name
+        @type keyword: string
+        @param value: The parameter value
+        @type value: any
+
+        @return: The tokens. Empty if no value can match.
+        @rtype: list[tuple]
+
+        '''
+
+        number = self.__number(keyword,value)
+        if number is None:
+            return [self.__token(keyword,value)]
+        if number != number or abs(number) == float('inf'):
+            return []
+        delta = not number and ZERO or TOLERANCE*number
+        return list(set([self.__bucket(number-delta),\
+                         self.__bucket(number+delta)]))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+A least-recently-used cache for data read from files, with a memory budget.
+
+"""
+
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+
+def getFileStamp(filename):
+
+    '''
+    Return the modification time and size of a file, which tell if a file
+    was changed since it was read.
+
+    @param filename: The filename
+    @type filename: string
+
+    @return: The modification time and the size in bytes
+    @rtype: (float,int)
+
+    '''
+
+    stat = os.stat(filename)
+    return (stat.st_mtime,stat.st_size)
+
+
+
+def getSize(value):
+
+    '''
+    Estimate the memory taken by a cached value.
+
+    Arrays count with their data, also if they are a view on another array.
+    Lists, tuples and dicts count with their elements.
+
+    @param value: The value
+    @type value: any
+
+    @return: The estimated size in bytes
+    @rtype: int
+
+    '''
+
+    if isinstance(value,np.ndarray):
+        return max(value.nbytes,sys.getsizeof(value))
+    if isinstance(value,(list,tuple)):
+        return sys.getsizeof(value) + sum([getSize(v) for v in value])
+    if isinstance(value,dict):
+        return sys.getsizeof(value) + sum([getSize(k) + getSize(v)
+                                           for k,v in value.items()])
+    return sys.getsizeof(value)
+
+
+
+class FileCache(object):
+
+    '''
+    A cache for data read from files, such as model output.
+
+    Every entry remembers the modification time and size of the file it was
+    read from, and is only returned as long as the file did not change. When
+    the estimated memory taken by the entries exceeds the budget, the least
+    recently used entries are removed.
+
+    The cached values are shared: callers must not change them in place.
+
+    '''
+
+    def __init__(self,max_size=100,check_interval=0):
+
+        '''
+        Initializing a FileCache instance.
+
+        @keyword max_size: The memory budget of the cache in MB. The cache is
+                           not used if zero.
+
+                           (default: 100)
+        @type max_size: float
+        @keyword check_interval: The time in seconds during which an entry is
+                                 returned without checking its file again.
+                                 If zero, the file is checked for every get.
+
+                                 (default: 0)
+        @type check_interval: float
+
+        '''
+
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.check_interval = float(check_interval)
+        self.setMaxSize(max_size)
+
+
+
+    def setMaxSize(self,max_size):
+
+        '''
+        Set the memory budget of the cache, and remove entries beyond it.
+
+        @param max_size: The memory budget of the cache in MB. The cache is
+                         not used if zero.
+        @type max_size: float
+
+        '''
+
+        self.max_size = float(max_size)
+        self.__evict()
+
+
+
+    def get(self,key,filename):
+
+        '''
+        Return the value cached for a key, if the file it was read from did not
+        change since.
+
+        @param key: The key of the value
+        @type key: a type valid for a dict key
+        @param filename: The file the value was read from
+        @type filename: string
+
+        @return: The cached value, None if not available
+        @rtype: any
+
+        '''
+
+        entry = self.__entries.pop(key,None)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry[3] >= self.check_interval:
+            try:
+                stamp = getFileStamp(filename)
+            except OSError:
+                stamp = None
+            if entry[0] != stamp:
+                self.__size -= entry[2]
+                return None
+            entry = entry[:3] + (now,)
+        self.__entries[key] = entry
+        return entry[1]
+
+
+
+    def set(self,key,filename,value):
+
+        '''
+        Cache a value read from a file.
+
+        Values larger than the budget are not cached.
+
+        @param key: The key of the value
+        @type key: a type valid for a dict key
+        @param filename: The file the value was read from
+        @type filename: string
+        @param value: The value
+        @type value: any
+
+        '''
+
+        self.remove(key)
+        size = getSize(value)
+        if size > self.max_size*1024**2:
+            return
+        self.__entries[key] = (getFileStamp(filename),value,size,time.time())
+        self.__size += size
+        self.__evict()
+
+
+
+    def remove(self,key):
+
+        '''
+        Remove the value cached for a key, if any.
+
+        @param key: The key of the value
+        @type key: a type valid for a dict key
+
+        '''
+
+        entry = self.__entries.pop(key,None)
+        if entry is not None:
+            self.__size -= entry[2]
+
+
+
+    def clear(self):
+
+        '''
+        Remove all cached values.
+
+        '''
+
+        self.__entries.clear()
+        self.__size = 0
+
+
+
+    def getSize(self):
+
+        '''
+        Return the estimated memory taken by the cached values.
+
+        @return: The size in MB
+        @rtype: float
+
+        '''
+
+        return self.__size/1024.**2
+
+
+
+    def __len__(self):
+
+        '''
+        Return the number of cached values.
+
+        @return: The number of entries
+        @rtype: int
+
+        '''
+
+        return len(self.__entries)
+
+
+
+    def __evict(self):
+
+        '''
+        Remove the least recently used values until the cache fits its budget.
+
+        '''
+
+        while self.__entries and self.__size > self.max_size*1024**2:
+            self.__size -= self.__entries.popitem(last=False)[1][2]
+
@@ -8,10 +8,197 @@ Author: R. Lombaert
 """
 
 import os
-from scipy import array
+import zipfile
+import numpy as np
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.tools.io import FileCache
+from cc.tools.io.FileCache import getFileStamp
+
+
+#-- Opacity files read by readOpacities(), shared by all KappaReader and 
+#   CustomOpacity instances. The memory budget is in MB.
+opacity_cache = FileCache.FileCache(max_size=100)
+
+
+
+def getSidecar(filename):
+
+    '''
+    Return the filename of the binary sidecar file of an opacity file.
+    
+    The sidecar of [name] is cache_[name].npz in the same folder, which does 
+    not match any of the opacity file extensions.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    
+    @return: The full filename of the sidecar file
+    @rtype: string
+    
+    '''
+    
+    folder,fn = os.path.split(filename)
+    return os.path.join(folder,'cache_%s.npz'%fn)
+    
+
+
+def parseOpacities(filename):
+
+    '''
+    Parse an opacity file.
+    
+    In .particle files, only lines with four columns give the opacities. The
+    scattering matrix that follows is skipped. Other files (.opac, .opacity, 
+    .topac) are read as columns.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    
+    @return: The wavelength grid and the opacities, one row for every column 
+             after the wavelength
+    @rtype: (array,array)
+    
+    '''
+    
+    if filename[-9:] == '.particle':
+        ofile = open(filename,'r')
+        try:
+            rows = [line.split() for line in ofile]
+        finally:
+            ofile.close()
+        cols = np.array([row for row in rows if len(row) == 4],dtype=float).T
+        cols = cols.reshape(4,-1)
+    else:
+        cols = np.array(DataIO.readCols(filename=filename),dtype=float)
+    return (cols[0].copy(),cols[1:].copy())
+
+
+
+def readSidecar(filename):
+    
+    '''
+    Read the parsed opacities from the binary sidecar file of an opacity file,
+    if it was written for the current version of the opacity file.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    
+    @return: The wavelength grid and the opacities, None if the sidecar file 
+             is not available or out of date
+    @rtype: (array,array)
+    
+    '''
+    
+    sidecar = getSidecar(filename)
+    if not os.path.isfile(sidecar):
+        return None
+    try:
+        stamps = np.array(getFileStamp(filename),dtype=float)
+        npz = np.load(sidecar)
+        try:
+            if not np.array_equal(npz['stamps'],stamps):
+                return None
+            return (npz['wave'],npz['kappas'])
+        finally:
+            npz.close()
+    except (IOError,OSError,ValueError,KeyError,zipfile.BadZipfile):
+        return None
+
+
+
+def writeSidecar(filename,wave,kappas):
+    
+    '''
+    Write the parsed opacities to the binary sidecar file of an opacity file.
+    
+    The sidecar file is written to a temporary file first, which then 
+    replaces the sidecar file. Nothing is written if the opacity folder cannot
+    be written to.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    @param wave: The wavelength grid
+    @type wave: array
+    @param kappas: The opacities
+    @type kappas: array
+    
+    '''
+    
+    sidecar = getSidecar(filename)
+    temp_file = '%s_%i.npz'%(sidecar[:-4],os.getpid())
+    try:
+        np.savez(temp_file,wave=wave,kappas=kappas,\
+                 stamps=np.array(getFileStamp(filename),dtype=float))
+        os.rename(temp_file,sidecar)
+    except (IOError,OSError):
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+
+
+def readOpacities(filename):
+    
+    '''
+    Read the opacities from a .opac, .opacity, .particle or .topac file.
+    
+    The file is parsed once and shared with all callers as long as it does 
+    not change. The parsed opacities are also saved in a binary sidecar file,
+    which is read instead of the opacity file in later sessions. The returned
+    arrays are read-only.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    
+    @return: The wavelength grid and the opacities, one row for every column 
+             after the wavelength. For .particle and .opac(ity) files, these 
+             are extinction, absorption and scattering. [micron,cm2/g]
+    @rtype: (array,array)
+    
+    '''
+    
+    key = ('opacities',filename)
+    opacities = opacity_cache.get(key,filename)
+    if opacities is None:
+        opacities = readSidecar(filename)
+        if opacities is None:
+            opacities = parseOpacities(filename)
+            writeSidecar(filename,*opacities)
+        for arr in opacities:
+            arr.flags.writeable = False
+        opacity_cache.set(key,filename,opacities)
+    return opacities
+
+
+
+def readExtEff(filename,spec_dens):
+    
+    '''
+    Return Q_ext/a for the opacities in an opacity file.
+    
+    Q_ext/a is calculated once for a given specific density and shared with 
+    all callers as long as the opacity file does not change. The returned 
+    arrays are read-only.
+    
+    @param filename: The full filename of the opacity file
+    @type filename: string
+    @param spec_dens: The specific density of the dust species [g/cm3]
+    @type spec_dens: float
+    
+    @return: Q_ext/a, one row for every column of opacities [cm-1]
+    @rtype: array
+    
+    '''
+    
+    key = ('qext_a',filename,spec_dens)
+    qext_a = opacity_cache.get(key,filename)
+    if qext_a is None:
+        qext_a = readOpacities(filename)[1] * 4/3. * spec_dens
+        qext_a.flags.writeable = False
+        opacity_cache.set(key,filename,qext_a)
+    return qext_a
+
 
 
 class KappaReader(object):
@@ -49,7 +236,9 @@ class KappaReader(object):
         Read kappas (cm2/g) and Q_ext/a (cm-1) for a dust species from the 
         MCMax INPUT files. 
         
-        This also reads the absorption and scattering kappas separately. 
+        This also reads the absorption and scattering kappas separately. The 
+        opacities are shared with all other instances through 
+        readOpacities().
         
         @param species: The dust species (from Dust.dat)
         @type species: string
@@ -65,23 +254,8 @@ class KappaReader(object):
             return
         fn = os.path.join(cc.path.mopac,self.lfilenames[ispecies])
         sd = self.lspec_dens[ispecies]
-        if fn[-9:] == '.particle':
-            part_file = DataIO.readFile(filename=fn,delimiter=' ') 
-            wav = array([float(q[0]) 
-                         for q in part_file if len(q) == 4]) 
-            kappa = [array([float(q[1]) 
-                            for q in part_file if len(q) == 4]),
-                     array([float(q[2]) 
-                            for q in part_file if len(q) == 4]),
-                     array([float(q[3]) 
-                            for q in part_file if len(q) == 4])]
-        else: 
-            part_file = DataIO.readCols(filename=fn)
-            wav = part_file[0]
-            kappa = part_file[1:]
-        self.waves[species] = wav
-        self.kappas[species] = kappa
-        self.qext_a[species] = array(kappa) * 4/3. * sd
+        self.waves[species],self.kappas[species] = readOpacities(fn)
+        self.qext_a[species] = readExtEff(fn,sd)
         
     
     
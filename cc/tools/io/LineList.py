@@ -11,12 +11,148 @@ Author: R. Lombaert
 import os 
 import re
 import string
+import zipfile
+import numpy as np
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.tools.io import FileCache
 from cc.modeling.objects import Transition
 
 
+#-- The columns of a catalog converted by readCatalog. The frequency is in the
+#   unit of the catalog, the strength in log(nm2*MHz) and the excitation
+#   energy in cm-1.
+CATALOG_DTYPE = [('frequency',float),('uncertainty',float),\
+                 ('strength',float),('exc_energy',float),\
+                 ('vup',int),('jup',int),('kaup',int),('kcup',int),\
+                 ('vlow',int),('jlow',int),('kalow',int),('kclow',int),\
+                 ('vibrational','S8')]
+
+#-- The fixed-width columns of the quantum numbers in a catalog line, in the 
+#   order of CATALOG_DTYPE. None if the column is mandatory.
+CATALOG_QUANTUM = [(61,63,0),(55,57,None),(57,59,0),(59,61,0),\
+                   (73,75,0),(67,69,None),(69,71,0),(71,73,0)]
+
+#-- The vibrational state in the comments of a catalog line
+vib_pattern = re.compile(r'(v\d?=\d)')
+
+#-- Catalogs converted by readCatalog, shared by all LineList() objects. The 
+#   memory budget is in MB.
+catalog_cache = FileCache.FileCache(max_size=100)
+
+
+
+def makeCatInt(numeral):
+    
+    '''
+    Return an integer matching the given string from the catalog 
+    (to deal with 'A#' numerals).
+    
+    @param numeral: The numeral to be converted to integer
+    @type numeral: string
+    
+    @return: The integer
+    @rtype: int
+    
+    '''
+    
+    try:
+        return int(numeral)
+    except ValueError:
+        alpha = string.letters[:26]
+        alphanumerals = [100+10*i for i,letter in enumerate(alpha)]
+        return alphanumerals[alpha.index(numeral[0])] + int(numeral[1])
+
+
+
+def readCatalog(filename):
+    
+    '''
+    Read a line list catalog of standard format, such as for JPL or CDMS, as 
+    a structured array sorted by frequency.
+    
+    The catalog is converted only once. The array is kept in memory, and saved
+    in a binary file next to the catalog, cache_[catalog].npz, together with 
+    the modification time and size of the catalog. The binary file is read 
+    instead of the catalog as long as the catalog does not change. Nothing is
+    saved if the folder cannot be written to. Lines that cannot be parsed 
+    are left out.
+    
+    @param filename: The full filename of the catalog
+    @type filename: string
+    
+    @return: The catalog, with the columns given by CATALOG_DTYPE. The array
+             is shared and must not be changed.
+    @rtype: array
+    
+    '''
+    
+    catalog = catalog_cache.get(filename,filename)
+    if catalog is not None: 
+        return catalog
+    folder,fn = os.path.split(filename)
+    sidecar = os.path.join(folder,'cache_%s.npz'%os.path.splitext(fn)[0])
+    stamps = np.array(FileCache.getFileStamp(filename),dtype=float)
+    try:
+        npz = np.load(sidecar)
+        try:
+            if np.array_equal(npz['stamps'],stamps):
+                catalog = npz['catalog']
+        finally:
+            npz.close()
+    except (IOError,OSError,ValueError,KeyError,zipfile.BadZipfile):
+        pass
+    if catalog is None:
+        data = DataIO.readFile(filename,replace_spaces=0)
+        lines = []
+        for line in data:
+            try:
+                lines.append(parseCatalogLine(line))
+            except (ValueError,IndexError):
+                print 'WARNING! Cannot parse line in %s:'%filename
+                print line.rstrip()
+        catalog = np.array(lines,dtype=CATALOG_DTYPE)
+        catalog = catalog[np.argsort(catalog['frequency'],kind='mergesort')]
+        temp_file = '%s_%i.npz'%(sidecar[:-4],os.getpid())
+        try:
+            np.savez(temp_file,stamps=stamps,catalog=catalog)
+            os.rename(temp_file,sidecar)
+        except (IOError,OSError):
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+    catalog_cache.set(filename,filename,catalog)
+    return catalog
+    
+    
+
+def parseCatalogLine(line):
+    
+    '''
+    Parse a line of a line list catalog of standard format, such as for JPL 
+    or CDMS.
+    
+    @param line: The line, no replaced spaces or delimiter used when reading
+                 with DataIO.readFile!
+    @type line: string
+    
+    @return: The values of the line in the order of CATALOG_DTYPE
+    @rtype: tuple
+    
+    '''
+    
+    quantum = []
+    for i0,i1,default in CATALOG_QUANTUM:
+        if default is None or line[i0:i1].strip():
+            quantum.append(makeCatInt(line[i0:i1]))
+        else:
+            quantum.append(default)
+    vib = vib_pattern.search(line[81:len(line)])
+    return tuple([float(line[0:13]),float(line[13:21]),float(line[21:29]),\
+                  float(line[31:41])] + quantum \
+                 + [vib and vib.groups()[0] or ''])
+
+
 
 class LineList():
     
@@ -115,97 +251,41 @@ class LineList():
         
         '''
         
-        try:
-            return int(numeral)
-        except ValueError:
-            alpha = string.letters[:26]
-            alphanumerals = [100+10*i for i,letter in enumerate(alpha)]
-            return alphanumerals[alpha.index(numeral[0])] + int(numeral[1])
+        return makeCatInt(numeral)
 
 
 
-    def parseStandardCatalog(self,data,catstring):
+    def parseStandardCatalog(self,catalog,catstring):
         
         '''
         Parse Line Lists of standard format, such as for JPL or CDMS.
         
-        @param data: The content of the inputfile, no replaced spaces or 
-                       delimiter used when reading with DataIO.readFile!
-        @type data: list[string]
+        Only the lines between x_min and x_max are taken from the catalog, 
+        which is sorted by frequency.
+        
+        @param catalog: The catalog as returned by readCatalog
+        @type catalog: array
         @param catstring: the name of the catalog to be included in the output,
                           for instance 'CDMS', or 'JPL'
         @type catstring: string
         
         '''
         
-        data = [line 
-                for line in data 
-                if float(line[0:13]) <= self.x_max \
-                    and float(line[0:13]) >= self.x_min]
+        i_min = np.searchsorted(catalog['frequency'],self.x_min,side='left')
+        i_max = np.searchsorted(catalog['frequency'],self.x_max,side='right')
+        data = catalog[i_min:i_max]
         if self.min_strength <> None:
-            data = [line 
-                    for line in data 
-                    if float(line[21:29]) >= self.min_strength]
+            data = data[data['strength'] >= self.min_strength]
         if self.max_exc <> None:
-            data = [line 
-                    for line in data 
-                    if float(line[31:41]) <= self.max_exc]
-        vib_pattern = re.compile(r'(v\d?=\d)')
+            data = data[data['exc_energy'] <= self.max_exc]
+        columns = ['frequency','vup','jup','kaup','kcup',\
+                   'vlow','jlow','kalow','kclow','vibrational']
+        columns = [data[col].tolist() for col in columns]
+        columns.append([catstring]*len(data))
         if self.include_extra:
-            data = [[float(line[0:13]),\
-                     line[61:63].strip() \
-                        and self.makeCatInt(line[61:63]) \
-                        or 0,self.makeCatInt(line[55:57]),\
-                     line[57:59].strip() \
-                        and self.makeCatInt(line[57:59]) \
-                        or 0,\
-                     line[59:61].strip() \
-                        and self.makeCatInt(line[59:61]) \
-                        or 0,\
-                     line[73:75].strip() \
-                        and self.makeCatInt(line[73:75]) \
-                        or 0,\
-                     self.makeCatInt(line[67:69]),\
-                     line[69:71].strip() \
-                        and self.makeCatInt(line[69:71]) \
-                        or 0,\
-                     line[71:73].strip() \
-                        and self.makeCatInt(line[71:73]) \
-                        or 0,\
-                     vib_pattern.search(line[81:len(line)]) \
-                        and vib_pattern.search(line[81:len(line)]).groups()[0]\
-                        or '',\
-                     catstring,\
-                     float(line[21:29]),\
-                     float(line[31:41])] 
-                    for line in data]
-        else:
-            data = [[float(line[0:13]),\
-                     line[61:63].strip() \
-                        and self.makeCatInt(line[61:63]) \
-                        or 0,\
-                     self.makeCatInt(line[55:57]),\
-                     line[57:59].strip() \
-                        and self.makeCatInt(line[57:59]) \
-                        or 0,\
-                     line[59:61].strip() \
-                        and self.makeCatInt(line[59:61]) \
-                        or 0,\
-                     line[73:75].strip() \
-                        and self.makeCatInt(line[73:75]) \
-                        or 0,\
-                     self.makeCatInt(line[67:69]),line[69:71].strip() \
-                        and self.makeCatInt(line[69:71]) \
-                        or 0,\
-                     line[71:73].strip() \
-                        and self.makeCatInt(line[71:73]) \
-                        or 0,\
-                     vib_pattern.search(line[81:len(line)]) \
-                        and vib_pattern.search(line[81:len(line)]).groups()[0]\
-                        or '',\
-                     catstring] 
-                    for line in data]
-        return data
+            columns.append(data['strength'].tolist())
+            columns.append(data['exc_energy'].tolist())
+        return [list(line) for line in zip(*columns)]
         
 
 
@@ -216,22 +296,21 @@ class LineList():
         
         '''
         
-        data = DataIO.readFile(os.path.join(cc.path.ll,\
-                                          self.molecule.molecule+'_CDMS.dat'),\
-                               replace_spaces=0)
+        catalog = readCatalog(os.path.join(cc.path.ll,\
+                                           self.molecule.molecule+'_CDMS.dat'))
         print 'Reading data from CDMS database for %s.'%self.molecule.molecule
-        uncertainties = [float(line[13:21]) for line in data]
-        if min(uncertainties) < 0 and max(uncertainties) == 0:
+        uncertainties = catalog['uncertainty']
+        if uncertainties.min() < 0 and uncertainties.max() == 0:
             input_xmin = self.x_min
             input_xmax = self.x_max
             self.x_min = (self.c/(input_xmin*10**6))**-1
             self.x_max = (self.c/(input_xmax*10**6))**-1
             self.input_unit = 'cm-1'
-        elif min(uncertainties) < 0 and max(uncertainties) > 0:
+        elif uncertainties.min() < 0 and uncertainties.max() > 0:
             raise ValueError('Uncertainties in CDMS input file for ' + \
                              'molecule %s are ambiguous.'\
                              %self.molecule.molecule)
-        data = self.parseStandardCatalog(data,'CDMS')
+        data = self.parseStandardCatalog(catalog,'CDMS')
         if self.input_unit == 'cm-1':
             data = sorted([[i == 0 \
                                 and self.c*entry*10**-6 \
@@ -249,11 +328,10 @@ class LineList():
         
         '''
         
-        data = DataIO.readFile(os.path.join(cc.path.ll,\
-                                           self.molecule.molecule+'_JPL.dat'),\
-                               replace_spaces=0)
+        catalog = readCatalog(os.path.join(cc.path.ll,\
+                                           self.molecule.molecule+'_JPL.dat'))
         print 'Reading data from JPL database for %s.'%self.molecule.molecule
-        data = self.parseStandardCatalog(data,'JPL')
+        data = self.parseStandardCatalog(catalog,'JPL')
         self.line_list.extend(data)
 
 
@@ -11,9 +11,49 @@ Author: R. Lombaert
 """
 
 import os 
+import numpy as np
 
 import cc.path
 from cc.tools.io import DataIO
+from cc.tools.io import FileCache
+
+
+#-- Radiat and indices files read by Radiat() and readIndices(), shared by 
+#   all molecules. The memory budget is in MB.
+radiat_cache = FileCache.FileCache(max_size=100)
+
+
+
+def readIndices(filename):
+
+    '''
+    Read a GASTRoNOoM indices file, which gives the quantum numbers of every
+    level of a molecule.
+    
+    The file is read once and shared with all molecules that use it, as long 
+    as it does not change. The returned objects must not be changed.
+    
+    @param filename: The full filename of the indices file
+    @type filename: string
+    
+    @return: The indices file as a list of [level index, quantum numbers...],
+             and a dict from the tuple of quantum numbers to the level index. 
+             The first level is taken if quantum numbers occur more than once.
+    @rtype: (list[list[int]],dict)
+    
+    '''
+    
+    key = ('indices',filename)
+    indices = radiat_cache.get(key,filename)
+    if indices is None:
+        rf = DataIO.readFile(filename,' ')
+        radiat_indices = [[int(i) for i in line] for line in rf]
+        levels = dict()
+        for line in radiat_indices:
+            levels.setdefault(tuple(line[1:]),line[0])
+        indices = (radiat_indices,levels)
+        radiat_cache.set(key,filename,indices)
+    return indices
 
 
 
@@ -22,6 +62,10 @@ class Radiat():
     '''
     Class for working with radiat files from GASTRoNOoM's input. 
     
+    The contents of a radiat file are read once for a given number of lines 
+    and levels, and shared with all Radiat() instances that use the same file,
+    as long as the file does not change. They must not be changed.
+    
     '''
     
     def __init__(self,molecule):
@@ -47,7 +91,16 @@ class Radiat():
                                         '%s_radiat.dat'%self.molecule.molecule)
             
         self.c = 2.99792458e10          #in cm/s
-        self.__read()
+        key = ('radiat',self.filename,self.molecule.nline,\
+               self.molecule.ny_up,self.molecule.ny_low)
+        radiat = radiat_cache.get(key,self.filename)
+        if radiat is None:
+            self.__read()
+            self.__index()
+            radiat_cache.set(key,self.filename,\
+                             (self.dict,self.arrays,self.trans_index))
+        else:
+            self.dict,self.arrays,self.trans_index = radiat
         
         
         
@@ -120,6 +173,24 @@ class Radiat():
              
              
     
+    def __index(self):
+        
+        '''
+        Set arrays of all radiat information in self.arrays, and the index
+        from the upper and lower level indices of a transition to the radiat 
+        index in self.trans_index.
+        
+        '''
+        
+        self.arrays = dict([(k,np.array(v)) for k,v in self.dict.items()])
+        self.trans_index = dict()
+        for i,(up_i,low_i) in enumerate(zip(self.dict['UPPER'],\
+                                            self.dict['LOWER'])):
+            self.trans_index.setdefault((up_i,low_i),[]).append(i)
+        
+        
+        
+    
     def getTransInfo(self,up_i,low_i):
         
         '''
@@ -139,17 +210,10 @@ class Radiat():
         '''
         
         transdict = dict()
-        low_indices = [i 
-                       for i,l in enumerate(self.dict['LOWER']) 
-                       if l == low_i]
-        up_indices = [i 
-                      for i,u in enumerate(self.dict['UPPER']) 
-                      if u == up_i]
-        common_indices1 = [i for i in low_indices if i in up_indices]
-        common_indices2 = [i for i in up_indices if i in low_indices]
-        if common_indices1 == common_indices2 and len(common_indices1) == 1:
-            transdict['radiat_index'] = common_indices1[0]
-            radi = common_indices1[0]
+        radiat_indices = self.trans_index.get((up_i,low_i),[])
+        if len(radiat_indices) == 1:
+            transdict['radiat_index'] = radiat_indices[0]
+            radi = radiat_indices[0]
         else:
             print 'Could not find transition. Check upper and/or lower level.'
             return False
@@ -197,6 +261,41 @@ class Radiat():
         
         
         
+    def selectTransitions(self,ls_min,ls_max,unit='GHz'):
+        
+        '''
+        Return the radiat indices of the transitions with a frequency or 
+        wavelength strictly between a minimum and a maximum value.
+        
+        @param ls_min: The minimum frequency/wavelength
+        @type ls_min: float
+        @param ls_max: The maximum frequency/wavelength
+        @type ls_max: float
+        
+        @keyword unit: The unit of the range. Can be: GHz, MHz, KHz, Hz, 
+                       MICRON, MM, CM, M
+                        
+                       (default: 'GHz')
+        @type unit: string
+        
+        @return: The radiat indices of the selected transitions, in the order
+                 of the radiat file
+        @rtype: array
+        
+        '''
+        
+        freq = self.arrays['FREQUENCY']
+        unit = unit.upper()
+        if unit in ['GHZ','MHZ','KHZ','HZ']:
+            power = {'GHZ':0,'MHZ':3,'KHZ':6,'HZ':9}[unit]
+            wave = freq*10.0**power
+        else:
+            power = {'MICRON':5,'MM':8,'CM':9,'M':11}[unit]
+            wave = self.c/(freq*10.0**power)
+        return np.nonzero((wave > ls_min) & (wave < ls_max))[0]
+        
+        
+        
     def getEnergyLevels(self):
         
         '''
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+A binary store for model spectra on the wavelength grid of a data set, such as
+the convolved Sphinx output for PACS and SPIRE.
+
+"""
+
+import os
+import fcntl
+import struct
+
+import numpy as np
+
+
+#-- The file starts with MAGIC, followed by records of a header (model id,
+#   band and number of flux points) and the flux. All sizes are multiples of
+#   8 bytes, so the fluxes can be read from one memory map of float64 values.
+MAGIC = 'CCSPEC01'
+HEADER = struct.Struct('<64s128sq')
+
+
+
+class SpectrumStore(object):
+
+    '''
+    A single-file store of model spectra, indexed by model id and band.
+
+    Spectra are appended to the end of the file, which is locked while they
+    are written, so several processes can add spectra to the same store. An
+    incomplete record at the end of the file, left by a crash, is removed 
+    before new spectra are appended. A spectrum added again for the same model
+    id and band replaces the earlier one. The stored spectra are returned as 
+    read-only views on a memory map of the file, without copying.
+
+    '''
+
+    def __init__(self,filename):
+
+        '''
+        Initializing a SpectrumStore instance.
+
+        The file is created when the first spectrum is added.
+
+        @param filename: The filename of the store, including filepath
+        @type filename: string
+
+        '''
+
+        self.filename = filename
+        self.__index = dict()
+        self.__scanned = 0
+        self.__data = None
+        self.refresh()
+
+
+
+    def refresh(self):
+
+        '''
+        Read the index of the spectra added to the file since the last refresh,
+        also by other processes.
+
+        '''
+
+        if not os.path.isfile(self.filename):
+            return
+        sfile = open(self.filename,'rb')
+        try:
+            fcntl.flock(sfile.fileno(),fcntl.LOCK_SH)
+            self.__scan(sfile)
+        finally:
+            #-- Closing the file releases the lock
+            sfile.close()
+
+
+
+    def __scan(self,sfile):
+
+        '''
+        Add the complete records after the last scanned one to the index.
+
+        The file must be locked by the caller. The scan stops at a record that
+        is cut short, e.g. by a crash while it was written. 
+
+        @param sfile: The store, opened for reading
+        @type sfile: file
+
+        '''
+
+        size = os.fstat(sfile.fileno()).st_size
+        if not self.__scanned:
+            if not size:
+                return
+            sfile.seek(0)
+            if sfile.read(len(MAGIC)) != MAGIC:
+                raise IOError('%s is not a spectrum store.'%self.filename)
+            self.__scanned = len(MAGIC)
+        sfile.seek(self.__scanned)
+        while self.__scanned + HEADER.size <= size:
+            model_id,band,n = HEADER.unpack(sfile.read(HEADER.size))
+            start = self.__scanned + HEADER.size
+            if n < 0 or start + 8*n > size:
+                break
+            self.__index[(model_id.rstrip('\0'),band.rstrip('\0'))] = \
+                (start/8,n)
+            self.__scanned = start + 8*n
+            sfile.seek(self.__scanned)
+        if self.__data is not None and len(self.__data)*8 < self.__scanned:
+            self.__data = None
+
+
+
+    def get(self,model_id,band):
+
+        '''
+        Return the spectrum of a model in a band.
+
+        @param model_id: The model id
+        @type model_id: string
+        @param band: The band, eg the filename of the data set
+        @type band: string
+
+        @return: The flux, as a read-only view on the store. None if the
+                 spectrum is not in the store.
+        @rtype: array
+
+        '''
+
+        if not self.__index.has_key((model_id,band)):
+            self.refresh()
+            if not self.__index.has_key((model_id,band)):
+                return None
+        if self.__data is None:
+            self.__data = np.memmap(self.filename,dtype='<f8',mode='r',\
+                                    shape=(self.__scanned/8,))
+        start,n = self.__index[(model_id,band)]
+        return self.__data[start:start+n]
+
+
+
+    def append(self,model_id,fluxes):
+
+        '''
+        Add the spectra of a model to the store.
+
+        @param model_id: The model id, at most 64 characters
+        @type model_id: string
+        @param fluxes: The flux for every band, with bands of at most 128
+                       characters
+        @type fluxes: dict(string: array)
+
+        '''
+
+        if len(model_id) > 64 or max([len(b) for b in fluxes]+[0]) > 128:
+            raise ValueError('Model id or band name too long for the ' + \
+                             'spectrum store %s.'%self.filename)
+        sfile = os.fdopen(os.open(self.filename,os.O_RDWR|os.O_CREAT),'r+b')
+        try:
+            fcntl.flock(sfile.fileno(),fcntl.LOCK_EX)
+            #-- Cut off a record left incomplete by a crash, which would 
+            #   otherwise swallow the records appended after it.
+            self.__scan(sfile)
+            if not self.__scanned:
+                sfile.write(MAGIC)
+                self.__scanned = len(MAGIC)
+            sfile.truncate(self.__scanned)
+            sfile.seek(self.__scanned)
+            for band,flux in sorted(fluxes.items()):
+                flux = np.asarray(flux,dtype='<f8')
+                sfile.write(HEADER.pack(model_id,band,len(flux)))
+                sfile.write(flux.tostring())
+            sfile.flush()
+        finally:
+            #-- Closing the file releases the lock
+            sfile.close()
+        self.refresh()
+
+
+
+    def hasModel(self,model_id,bands):
+
+        '''
+        Check if the spectra of a model are in the store for all bands.
+
+        @param model_id: The model id
+        @type model_id: string
+        @param bands: The bands
+        @type bands: list[string]
+
+        @return: All spectra are in the store
+        @rtype: bool
+
+        '''
+
+        self.refresh()
+        return False not in [self.__index.has_key((model_id,band))
+                             for band in bands]
+
@@ -8,12 +8,15 @@ Author: R. Lombaert
 """
 
 import os
+import zipfile
 from scipy import array 
 from scipy import isnan
 from scipy import isfinite
+import numpy as np
 
 from cc.tools.io.Reader import Reader
 from cc.tools.io import DataIO
+from cc.tools.io.FileCache import getFileStamp
 
 
 
@@ -22,9 +25,15 @@ class SphinxReader(Reader):
     '''
     A Reader for Sphinx output files. 
     
+    The parsed output is saved in a binary sidecar file next to the sphinx 
+    files, together with the modification time and size of both sphinx files.
+    The sidecar of sph*[name].dat is cache_sph[name].dat.npz, which does not
+    match sph* when the sphinx files are searched for. It is read instead of 
+    the sphinx files as long as these do not change.
+    
     '''
     
-    def __init__(self,filename):
+    def __init__(self,filename,use_sidecar=1):
         
         '''
         Creating a Sphinx object ready for reading Sphinx output.
@@ -37,14 +46,124 @@ class SphinxReader(Reader):
                          file number is given by *.
         @type filename: string
         
+        @keyword use_sidecar: Read the output from the binary sidecar file if it
+                              is up to date, and write it otherwise.
+                              
+                              (default: 1)
+        @type use_sidecar: bool
+        
         '''
         
         super(SphinxReader, self).__init__()
         self.filename = filename.replace('sph1','sph*').replace('sph2','sph*')
+        folder,fn = os.path.split(self.filename)
+        self.sidecar = os.path.join(folder,'cache_%s.npz'\
+                                           %fn.replace('sph*','sph'))
         self.nans_present=False
-        self.parseImpact()
-        self.parseProfile()
+        if not (use_sidecar and self.readSidecar()):
+            self.parseImpact()
+            self.parseProfile()
+            if use_sidecar: 
+                self.writeSidecar()
+        self.checkNans()
+        
+    
+    
+    def getStamps(self):
+        
+        '''
+        Return the modification time and size of sphinx files 1 and 2.
         
+        @return: The modification times and sizes
+        @rtype: array
+        
+        '''
+        
+        return array(getFileStamp(self.filename.replace('*','1')) + \
+                     getFileStamp(self.filename.replace('*','2')),dtype=float)
+    
+    
+    
+    def readSidecar(self):
+        
+        '''
+        Read the parsed output from the binary sidecar file, if it was written
+        for the current sphinx files.
+        
+        @return: The output was read from the sidecar file
+        @rtype: bool
+        
+        '''
+        
+        if not os.path.isfile(self.sidecar):
+            return False
+        try:
+            stamps = self.getStamps()
+            npz = np.load(self.sidecar)
+            try:
+                if not np.array_equal(npz['stamps'],stamps):
+                    return False
+                arrays = dict([(k,npz[k]) for k in npz.files if k != 'stamps'])
+            finally:
+                npz.close()
+        except (IOError,OSError,ValueError,KeyError,zipfile.BadZipfile):
+            return False
+        self.sph1 = dict()
+        self.sph2 = dict([(k,dict()) 
+                          for k in ['nobeam','beam','nobeam_cont','beam_cont']])
+        self.contents['sph1'] = self.sph1
+        self.contents['sph2'] = self.sph2
+        for k,v in arrays.items():
+            keys = k.split('/')
+            if keys[0] == 'sph1':
+                self.sph1[keys[1]] = v
+            elif keys[1][-5:] == '_cont':
+                self.sph2[keys[1]][keys[2]] = v[()]
+            else:
+                self.sph2[keys[1]][keys[2]] = v
+        return True
+        
+        
+    
+    def writeSidecar(self):
+        
+        '''
+        Write the parsed output to the binary sidecar file.
+        
+        The sidecar file is written to a temporary file first, which then 
+        replaces the sidecar file. Nothing is written if the sphinx folder 
+        cannot be written to.
+        
+        '''
+        
+        arrays = dict([('sph1/%s'%k,v) for k,v in self.sph1.items()])
+        for beam,lps in self.sph2.items():
+            arrays.update([('sph2/%s/%s'%(beam,k),v) for k,v in lps.items()])
+        temp_file = '%s_%i.npz'%(self.sidecar[:-4],os.getpid())
+        try:
+            np.savez(temp_file,stamps=self.getStamps(),**arrays)
+            os.rename(temp_file,self.sidecar)
+        except (IOError,OSError):
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+    
+    
+    
+    def checkNans(self):
+        
+        '''
+        Check the intrinsic line profile for NaNs, and warn if there are any.
+        
+        '''
+        
+        if True in list(isnan(self.sph2['nobeam']['flux'])):
+            self.nans_present = True
+            print "WARNING! There are NaN's in the intrinsic line profile " + \
+                  "with model id %s:"\
+                  %(os.path.split(os.path.split(self.filename)[0])[1])
+            print os.path.split(self.filename.replace('sph*','sph2'))[1]
+    
+    
     
     def parseImpact(self):
         
@@ -116,12 +235,6 @@ class SphinxReader(Reader):
         if self.sph2['nobeam']['velocity'][0] > self.sph2['nobeam']['velocity'][-1]:
             self.sph2['nobeam']['velocity'] = self.sph2['nobeam']['velocity'][::-1]
             self.sph2['nobeam']['flux'] = self.sph2['nobeam']['flux'][::-1]
-        if True in list(isnan(self.sph2['nobeam']['flux'])):
-            self.nans_present = True
-            print "WARNING! There are NaN's in the intrinsic line profile " + \
-                  "with model id %s:"\
-                  %(os.path.split(os.path.split(self.filename)[0])[1])
-            print os.path.split(self.filename.replace('sph*','sph2'))[1]
     
     
     def setContinuum(self,beam,lp):
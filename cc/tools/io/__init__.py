@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["DataIO","Radiat","LineList","Database","FitsReader",\
-           "LPDataReader","Reader","SphinxReader","TxtReader","Atmosphere"]
+__all__ = ["DataIO","Radiat","LineList","Database","DatabaseIndex",\
+           "FitsReader","LPDataReader","Reader","SphinxReader","TxtReader",\
+           "Atmosphere","FileCache"]